@@ -15,9 +15,10 @@ to go to a specific line.
 
 Differences from grep:
 - The output is a geany command for each match rather than bare output.
-- Binary files are ignored.
-- Basically no special grep options are implemented (-n/--line-number is
-  automatic, -r/--recursive is automatic)
+- Binary files are ignored (A file with a NUL byte near the start is
+  skipped without reading the rest).
+- Only some grep options are implemented (See Options; -n/--line-number
+  is automatic, -r/--recursive is automatic)
 - stderr output differs significantly.
 
 You can install it such as via:
@@ -66,13 +67,45 @@ Options
 --include-all        Include all file types (For the default grep
                      behavior, you must specify this and --no-ignore
                      but binary files are still ignored).
+-i, --ignore-case    Ignore case distinctions in patterns and data.
+-l, --files-with-matches
+                     Only show the path of each matching file (Each
+                     file is only read up to its first match).
+-c, --count          Only show "path:count" for each matching file.
+-m NUM, --max-count=NUM
+                     Stop reading each file after NUM matching lines.
+-A NUM, --after-context=NUM
+                     Also show NUM lines after each matching line
+                     (marked with "# -" instead of "# <").
+-B NUM, --before-context=NUM
+                     Also show NUM lines before each matching line.
+-C NUM, --context=NUM
+                     Same as -A NUM -B NUM.
+-j N, --jobs=N       Scan file contents using N processes (0 for one
+                     per CPU) while the tree is walked. Results are
+                     still shown in path order.
+--index              Keep an index of the files searched (in
+                     --cache-dir) so the next search with the same
+                     options only re-reads files that changed or may
+                     contain the (literal) pattern.
+--cache-dir=DIR      Store the index in DIR instead of the default
+                     (under the user's cache directory).
+--invalidate-index   Delete all indexes (in --cache-dir). If there is no
+                     pattern, exit after that.
 '''
 from __future__ import print_function
 import sys
 import os
 import re
 import json
+import mmap
 import platform
+from collections import (
+    deque,
+    namedtuple,
+)
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from datetime import (
     datetime,
     # timedelta,
@@ -84,11 +117,16 @@ from hierosoft import (
     echo3,
     echo4,
     set_verbosity,
+    get_verbosity,
     join_if_exists,
 )
 
 DEFAULT_IGNORE_DIRS = (".git", "node_modules", ".venv")
 
+PENDING_PER_JOB = 4
+# ^ How many files per worker ggrep may submit before waiting for the
+#   oldest result (when jobs > 1).
+
 default_includes = [
     "*.py",
     "*.lua",
@@ -358,13 +396,105 @@ def is_abs_path(path):
     return False
 
 
-def _wild_increment(haystack_c, needle_c):
-    if needle_c == "*":
-        return 0
-    if needle_c == "?":
-        return 1
-    if needle_c == haystack_c:
-        return 1
+LIKE_CACHE_SIZE = 1024
+# ^ How many compiled needles compile_like keeps (There is typically
+#   one per include, exclude or command-line exclusion pattern).
+
+_LikeSegment = namedtuple('_LikeSegment', ['length', 'pieces'])
+# ^ A run of needle characters without '*': The length (in characters)
+#   and a tuple of (offset, literal) for each run without '?'.
+
+
+def _like_segment(chars):
+    pieces = []
+    run_start = None
+    for i, c in enumerate(chars):
+        if c == "?":
+            if run_start is not None:
+                pieces.append((run_start, "".join(chars[run_start:i])))
+                run_start = None
+        elif run_start is None:
+            run_start = i
+    if run_start is not None:
+        pieces.append((run_start, "".join(chars[run_start:])))
+    return _LikeSegment(len(chars), tuple(pieces))
+
+
+@lru_cache(maxsize=LIKE_CACHE_SIZE)
+def compile_like(needle):
+    '''Compile a wildcard needle (See is_like) once.
+
+    Args:
+        needle (str): A filename pattern such as "*.png".
+
+    Returns:
+        tuple(_LikeSegment): The needle split at each '*' (or '**'),
+            so a needle without '*' has only one segment. None if the
+            needle is blank.
+
+    Raises:
+        ValueError: The needle has "***", is "**", starts with "**" but
+            not "**/", or starts with "!".
+        TypeError: The needle is not a str.
+    '''
+    segments = []
+    chars = []
+    prev_c = None
+    star_count = 0
+    for c in needle:
+        if c == "*":
+            star_count += 1
+            if star_count == 3:
+                raise ValueError("*** is an invalid .gitignore wildcard.")
+            if prev_c != "*":
+                segments.append(_like_segment(chars))
+                chars = []
+        else:
+            star_count = 0
+            chars.append(c)
+        prev_c = c
+    segments.append(_like_segment(chars))
+    if not needle:
+        return None
+    if needle == "**":
+        raise ValueError("** would match every directory!")
+    if needle.startswith("**") and not needle.startswith("**/"):
+        raise ValueError(
+            "More than one '*' in a row in needle isn't allowed"
+            " (needle={}). Outer logic should handle special"
+            " syntax if that is allowed."
+            "".format(json.dumps(needle))
+        )
+    if needle.startswith("!"):
+        raise ValueError(
+            "The value should not start with '!'."
+            " The higher-level logic should check for inverse"
+            " results and handle them differently."
+        )
+    return tuple(segments)
+
+
+def _like_at(haystack, segment, pos):
+    for offset, literal in segment.pieces:
+        if not haystack.startswith(literal, pos + offset):
+            return False
+    return True
+
+
+def _like_find(haystack, segment, pos, end):
+    '''Find the first place segment fits in haystack[pos:end].'''
+    last = end - segment.length
+    if not segment.pieces:
+        return pos if pos <= last else -1
+    offset, literal = segment.pieces[0]
+    found = haystack.find(literal, pos + offset, end)
+    while found >= 0:
+        start = found - offset
+        if start > last:
+            return -1
+        if _like_at(haystack, segment, start):
+            return start
+        found = haystack.find(literal, found + 1, end)
     return -1
 
 
@@ -372,10 +502,18 @@ def is_like(haystack, needle, allow_blank=False, quiet=False,
             haystack_start=None, needle_start=None, indent=2):
     '''Compare to needle using wildcard notation not regex.
 
+    The needle is compiled once (and cached; See compile_like), then
+    matched in one pass without recursion: The part before the first
+    '*' must match the start, the part after the last '*' must match the
+    end, and each part between is found in order (leftmost first, which
+    is always sufficient since '*' matches any characters).
+
     Args:
         haystack (str): a string in which to find the needle.
         needle (str): It is a filename pattern such as "*.png" not
-            regex, so the only wildcards are '*' and '?'.
+            regex, so the only wildcards are '*' and '?' (and '**' in a
+            .gitignore-style path, which is the same as '*' here since
+            '*' also matches '/').
         allow_blank (Optional[bool]): Instead of raising an exception on
             a blank needle, return False and show a warning (unless
             quiet).
@@ -385,189 +523,47 @@ def is_like(haystack, needle, allow_blank=False, quiet=False,
         needle_start (Optional[bool]): Start at this character index in
             needle.
         indent (Optional[int]): Set the visual indent level for debug
-            output, expressed as a number of spaces. The default is 2
-            since some higher level debugging will normally be taking
-            place and calling this method.
+            output, expressed as a number of spaces.
 
     Returns:
         bool: If needle in literal text or wildcard syntax matches
             haystack.
     '''
-    tab = " " * indent
-    if haystack_start is None:
-        haystack_start = 0
-    if needle_start is None:
-        needle_start = 0
-    haystack = haystack[haystack_start:]
-    needle = needle[needle_start:]
-    echo3(tab+"in is_like({}, {})"
-          "".format(json.dumps(haystack), json.dumps(needle)))
-    if needle_start == 0:
-        double_star_i = needle.find("**")
-        if "***" in needle:
-            raise ValueError("*** is an invalid .gitignore wildcard.")
-        if needle == "**":
-            raise ValueError("** would match every directory!")
-        if (double_star_i > 0):
-            # and (double_star_i < len(needle) - 2):
-            # It is allowed to be at the end.
-            echo3(tab+"* splitting needle {} at **"
-                  "".format(json.dumps(needle)))
-            left_needle = needle[:double_star_i] + "*"
-            right_needle = needle[double_star_i+2:]
-            echo3(tab+"* testing left_needle={}"
-                  "".format(json.dumps(left_needle)))
-            if is_like(haystack, left_needle,
-                       allow_blank=allow_blank, quiet=quiet,
-                       indent=indent+2):
-                right_haystack = haystack[len(left_needle)-1:]
-                # ^ -1 to skip '*'
-                # ^ -2 to skip '*/' but that's not all that needs to be
-                #   skipped, the whole matching directory needs to be
-                #   skipped, so:
-                next_slash_i = right_haystack.find("/")
-                if next_slash_i > -1:
-                    right_haystack = right_haystack[next_slash_i:]
-                elif right_needle == "":
-                    echo3(tab+"  * there is no right side,"
-                          " so it matches")
-                    # ** can match any folder, so the return is True
-                    # since:
-                    # - There is nothing to match after **, so any
-                    #   folder (leaf only though) matches.
-                    # - The remainder of haystack has no slash, so it is
-                    #   a leaf.
-                    return True
-                echo3(tab+"* testing right_haystack={}, right_needle={}"
-                      "".format(json.dumps(right_haystack),
-                                json.dumps(right_needle)))
-                if (right_needle == ""):
-                    if (right_haystack == ""):
-                        return True
-                    else:
-                        echo3(tab+"* WARNING: right_haystack")
-                return is_like(right_haystack, right_needle,
-                               allow_blank=True, quiet=quiet,
-                               indent=indent+2)
-            else:
-                echo3(tab+"  * False")
-                # It is already false, so return
-                # (prevent issue 22: "More than one '*' in a row").
-                return False
-        if needle.startswith("**/"):
-            needle = needle[1:]
-            # It is effectively the same, and is only different when
-            # a subfolder is specified (See
-            # <https://git-scm.com/docs/gitignore#:~:
-            # text=Two%20consecutive%20asterisks%20(%22%20**%20%22,
-            # means%20match%20in%20all%20directories.>.
-            # That circumstance is tested in test_ggrep.py.
-        elif needle.startswith("!"):
-            raise ValueError(
-                "The value should not start with '!'."
-                " The higher-level logic should check for inverse"
-                " results and handle them differently."
-            )
-    req_count = 0
-    prev_c = None
-    for i in range(0, len(needle)):
-        # ^ 0 since needle = needle[needle_start:]
-        c = needle[i]
-        if c == "*":
-            if prev_c == "*":
-                raise ValueError(
-                    "More than one '*' in a row in needle isn't allowed"
-                    " (needle={}). Outer logic should handle special"
-                    " syntax if that is allowed."
-                    "".format(json.dumps(needle))
-                )
-            prev_c = c
-            continue
-        req_count += 1
-        prev_c = c
-    if len(needle) == 0:
+    if haystack_start:
+        haystack = haystack[haystack_start:]
+    if needle_start:
+        needle = needle[needle_start:]
+    segments = compile_like(needle)
+    if segments is None:
         if not allow_blank:
             raise ValueError(
                 'The needle can\'t be blank or it would match all.'
                 ' Set to "*" to match all explicitly.'
             )
-        else:
-            if not quiet:
-                echo0(
-                    tab
-                    + "The needle is blank so the match will be False."
-                )
+        if not quiet:
+            echo0(
+                " " * indent
+                + "The needle is blank so the match will be False."
+            )
         return False
-    if req_count == 0:
-        # req_count may be 0 even if has one character: "*"
-        return True
-    hI = 0  # 0 since haystack = haystack[haystack_start:]
-    nI = 0  # 0 since needle = needle[needle_start:]
-    matches = 0
-    while hI < len(haystack):
-        if nI >= len(needle):
-            # If still in haystack, there are more things to match so
-            # there aren't enough needle characters/wildcards.
-            return False
-        inc = _wild_increment(haystack[hI], needle[nI])
-        if inc == 0:
-            # *
-            if (nI+1) == len(needle):
-                # The needle ends with *, so the matching is complete.
-                return True
-            match_indices = []
-            next_needle_c = needle[nI+1]
-            echo3(tab+"* checking for each possible continuation of"
-                  " needle[needle.find('*')+1]"
-                  " in haystack {}[{}:] -> {}"
-                  .format(haystack, hI, haystack[hI:]))
-            for try_h_i in range(hI, len(haystack)):
-                if haystack[try_h_i] == next_needle_c:
-                    echo3(tab+"  * is_like({}[{}:] -> {}, {}[{}+1:]"
-                          " -> {})"
-                          "".format(haystack, try_h_i,
-                                    haystack[try_h_i:],
-                                    needle, nI, needle[nI+1:]))
-                    if is_like(haystack, needle,
-                               allow_blank=allow_blank,
-                               quiet=quiet, haystack_start=try_h_i,
-                               needle_start=nI+1,
-                               indent=indent+2):
-                        echo3(tab+"    * True")
-                        # The rest may match from ANY starting point of
-                        # the character after *, such as:
-                        # cspell:disable-next-line
-                        # abababc is like *ababc (should be True)
-                        # - If next_needle_c were used, that wouldn't
-                        #   return True as it should.
-                        # - To return True, the recursion will occur
-                        #   twice:
-                        # cspell:disable-next-line
-                        #   - (abababc, ababc) -> False
-                        # cspell:disable-next-line
-                        #   - (ababc, ababc) -> True
-                        #   - or:
-                        # cspell:disable-next-line
-                        #     - (abababc, a*c) -> False
-                        # cspell:disable-next-line
-                        #     - (ababc, a*c) -> True
-                        return True
-                    else:
-                        echo3(tab+"    * False")
-
-            if next_needle_c == haystack[hI]:
-                nI += 2
-                matches += 1  # Only 1 since req_count doesn't have '*'
-            hI += 1
-        elif inc == 1:
-            hI += 1
-            nI += 1
-            matches += 1
-        elif inc == -1:
+    size = len(haystack)
+    head = segments[0]
+    if len(segments) == 1:
+        return (size == head.length) and _like_at(haystack, head, 0)
+    tail = segments[-1]
+    end = size - tail.length
+    if (end < head.length) or not _like_at(haystack, head, 0):
+        return False
+    if not _like_at(haystack, tail, end):
+        return False
+    pos = head.length
+    for i in range(1, len(segments) - 1):
+        segment = segments[i]
+        found = _like_find(haystack, segment, pos, end)
+        if found < 0:
             return False
-    echo3(tab+"is_like matches={} req_count={}"
-          "".format(matches, req_count))
-    return matches == req_count
+        pos = found + segment.length
+    return True
 
 
 def is_like_any(haystack, needles, allow_blank=False, quiet=False):
@@ -578,6 +574,235 @@ def is_like_any(haystack, needles, allow_blank=False, quiet=False):
     return False
 
 
+IGNORED = "ignored"
+KEPT = "kept"
+UNDECIDED = None
+
+
+def _ignore_glob_to_regex(glob):
+    '''Convert one .gitignore glob to regular expression source.
+
+    The glob must already have any "!" prefix, leading "/" and trailing
+    "/" removed (See IgnoreRules for how those are handled).
+
+    Args:
+        glob (str): A gitignore-style pattern where "*" and "?" do not
+            match "/", "**" between slashes (or at either end) matches
+            any number of directories, "[...]" is a character class, and
+            a backslash escapes the next character.
+
+    Returns:
+        str: Regular expression source (not anchored).
+    '''
+    if "***" in glob:
+        raise ValueError("*** is an invalid .gitignore wildcard.")
+    if glob == "**":
+        raise ValueError("** would match every directory!")
+    parts = []
+    i = 0
+    count = len(glob)
+    while i < count:
+        c = glob[i]
+        if c == "*":
+            if glob.startswith("**", i):
+                at_start = (i == 0) or (glob[i-1] == "/")
+                at_end = (i + 2 == count) or (glob[i+2] == "/")
+                if at_start and at_end:
+                    if i + 2 == count:
+                        # "foo/**" matches everything inside of foo.
+                        parts.append(".*")
+                        i += 2
+                    else:
+                        # "**/" matches zero or more directories.
+                        parts.append("(?:[^/]*/)*")
+                        i += 3
+                    continue
+                # Otherwise "**" is the same as "*" (as per git).
+                i += 1
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            end = glob.find("]", i + 2)
+            # ^ +2 since "]" right after "[" (or "[!") is literal.
+            if end < 0:
+                parts.append(re.escape(c))
+            else:
+                chars = glob[i+1:end]
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                parts.append("[" + chars.replace("\\", "\\\\") + "]")
+                i = end
+        elif (c == "\\") and (i + 1 < count):
+            i += 1
+            parts.append(re.escape(glob[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+class IgnoreRule(object):
+    '''One parsed line of a .gitignore or .grepignore file.
+
+    Attributes:
+        line (str): The original line (used for tracing).
+        verb (str): IGNORED, or KEPT if the line starts with "!".
+        dir_only (bool): The line ended with "/" so it only matches
+            directories.
+        anchored (bool): The line started with "/" or had "/" before the
+            end, so it is relative to the ignore file's directory rather
+            than matching at any depth.
+        source (str): The ignore file (or other description) where the
+            line came from, or None.
+    '''
+    def __init__(self, line, source=None):
+        self.line = line
+        self.source = source
+        glob = line
+        self.verb = IGNORED
+        if glob.startswith("!"):
+            self.verb = KEPT
+            glob = glob[1:]
+        self.dir_only = glob.endswith("/")
+        if self.dir_only:
+            glob = glob.rstrip("/")
+        self.anchored = "/" in glob
+        if glob.startswith("/"):
+            glob = glob[1:]
+        self.glob = glob
+        self.regex_source = None
+        if glob:
+            self.regex_source = _ignore_glob_to_regex(glob)
+            if not self.anchored:
+                self.regex_source = "(?:[^/]*/)*" + self.regex_source
+
+    def __repr__(self):
+        return "IgnoreRule({})".format(json.dumps(self.line))
+
+
+class IgnoreRules(object):
+    '''A compiled set of .gitignore (or .grepignore) rules.
+
+    All rules are compiled into one regular expression (one for
+    directories and one for files, since rules ending with "/" only
+    apply to directories) so a path is checked in a single pass instead
+    of once per line. As in the original filter_tree logic, "!" rules
+    are checked before other rules so that a kept path stays kept
+    regardless of where the rule appears in the file.
+
+    Args:
+        lines (Iterable[str]): Ignore patterns. Blank lines and lines
+            starting with "#" are skipped.
+        root (str): The directory containing the ignore file. Patterns
+            that are anchored (See IgnoreRule) are relative to this.
+        source (str, optional): The ignore file path (for tracing
+            invalid patterns back to a file).
+        trace_ignore_files (dict, optional): A pattern to source
+            mapping (overrides source for each pattern in it).
+    '''
+    def __init__(self, lines, root, source=None, trace_ignore_files=None):
+        if root is None:
+            raise ValueError("ignore requires ignore_root")
+        self.root = root
+        self.source = source
+        self.rules = []
+        keeps = []
+        ignores = []
+        for rawL in lines:
+            line = rawL.strip()
+            if (len(line) < 1) or line.startswith("#"):
+                continue
+            rule_source = source
+            if trace_ignore_files:
+                rule_source = trace_ignore_files.get(line, source)
+            try:
+                rule = IgnoreRule(line, source=rule_source)
+            except ValueError:
+                echo0(
+                    'trace_ignore_files[{}] = {}'
+                    ''.format(json.dumps(line), json.dumps(rule_source))
+                )
+                raise
+            if rule.regex_source is None:
+                continue
+            if rule.verb == KEPT:
+                keeps.append(rule)
+            else:
+                ignores.append(rule)
+        self.rules = keeps + ignores
+        # ^ Inverse rules must be checked *first* so that a loose ignore
+        #   can't match first and result in an early ignore.
+        self._dir_rules = self.rules
+        self._file_rules = [rule for rule in self.rules
+                            if not rule.dir_only]
+        self._dir_re = IgnoreRules._compile(self._dir_rules)
+        self._file_re = IgnoreRules._compile(self._file_rules)
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None
+        return re.compile(
+            "(?:" + "|".join("({})".format(rule.regex_source)
+                             for rule in rules) + r")\Z",
+            re.DOTALL,
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        '''Load a .gitignore or .grepignore file.
+
+        Returns:
+            IgnoreRules: Rules relative to the file's directory.
+        '''
+        with open(path, 'r') as ins:
+            return cls(ins, os.path.dirname(path), source=path)
+
+    def relpath(self, path):
+        '''Get path relative to root, using "/" as the separator.'''
+        rel = path
+        if self.root and path.startswith(self.root):
+            rel = path[len(self.root):]
+        if os.path.sep != "/":
+            rel = rel.replace(os.path.sep, "/")
+        return rel.strip("/")
+
+    def match(self, path, is_dir):
+        '''Find the rule that decides whether path is ignored.
+
+        Args:
+            path (str): A path starting with root (or relative to root).
+            is_dir (bool): Whether path is a directory.
+
+        Returns:
+            IgnoreRule: The deciding rule (See its "verb" attribute), or
+                None if no rule matches.
+        '''
+        regex = self._dir_re if is_dir else self._file_re
+        if regex is None:
+            return None
+        rel = self.relpath(path)
+        if not rel:
+            return None
+        match = regex.match(rel)
+        if match is None:
+            return None
+        rules = self._dir_rules if is_dir else self._file_rules
+        return rules[match.lastindex - 1]
+
+    def verdict(self, path, is_dir):
+        '''Check whether path is ignored.
+
+        Returns:
+            str: IGNORED, KEPT, or UNDECIDED (None) if no rule matches.
+        '''
+        rule = self.match(path, is_dir)
+        if rule is None:
+            return UNDECIDED
+        return rule.verb
+
+
 def gitignore_to_rsync_pair(gitignore_path, rsync_from, tmp_dir,
                             ignore_root=None):
     '''Get a pair of include and exclude files
@@ -665,14 +890,624 @@ def gitignore_to_rsync_pair(gitignore_path, rsync_from, tmp_dir,
     return paths[0], paths[1]
 
 
+LITERAL = "literal"
+LITERAL_ICASE = "literal_icase"
+REGEX = "regex"
+REGEX_TEXT = "regex_text"
+
+REGEX_SPECIAL_CHARS = ".^$*+?{}[]\\|()"
+TEXT_ONLY_ESCAPES = "wWbBdDsS"
+# ^ A regex containing one of these after a backslash, or an unescaped
+#   "." or "[^", could match differently in bytes than in decoded text
+#   (such as "." matching one byte of a multi-byte character), so such
+#   a regex is run on decoded text (REGEX_TEXT).
+
+LINE_CONTEXT_TOKENS = ("\\A", "\\Z", "(?<", "(?!")
+# ^ A regex containing one of these could fail to match a line when
+#   searched within the whole file (where "\A" and "\Z" are the ends of
+#   the file, and lookbehind or negative lookahead can see the newline),
+#   so each line is searched separately.
+
+LONE_CR = {b"\n": re.compile(b"\r(?!\n)"), "\n": re.compile("\r(?!\n)")}
+# ^ Find a line ending that is only "\r" (See PatternMatcher.iter_lines),
+#   by the type of the content.
+
+CONTENT_ENCODING = "utf-8"
+# ^ Files are searched as bytes, and matching lines are decoded using
+#   this (A file with a line that can't be decoded is considered binary).
+
+BINARY_SNIFF_SIZE = 8192
+# ^ If there is a NUL byte in this many bytes at the start of a file,
+#   the file is considered binary and is skipped without being read
+#   further.
+
+MMAP_MIN_SIZE = 65536
+# ^ Memory-map files at least this large instead of reading them.
+
+
+class PatternMatcher(object):
+    '''Search file content for a ggrep pattern using the fastest strategy.
+
+    The pattern is classified once:
+    - LITERAL: The pattern has no regex syntax, so it is found using
+      find over the whole file.
+    - LITERAL_ICASE: Same as LITERAL but ignore_case is True (only for
+      ASCII patterns), so it is found using a bytes regex.
+    - REGEX: The pattern is ASCII and has no TEXT_ONLY_REGEX_TOKENS, so
+      it is compiled once as a bytes regex and run over the whole file
+      using re.MULTILINE without decoding.
+    - REGEX_TEXT: Any other regex, which is compiled once and run over
+      the whole file after decoding it.
+
+    Each regex match is re-checked within its first line (excluding any
+    "\r" before the newline), so results are the same as searching line
+    by line.
+    A regex with LINE_CONTEXT_TOKENS (such as "\\Z", which would match
+    only at the end of the file) is instead searched one line at a time.
+    Lines end with "\n", "\r\n" or a lone "\r" (If the file has any
+    lone "\r", it is copied with each line ending changed to "\n").
+    Only lines that match are decoded (except for REGEX_TEXT).
+
+    Args:
+        pattern (str): A regular expression or plain text substring.
+        ignore_case (bool, optional): Ignore case distinctions.
+        allow_non_regex_pattern (bool, optional): Also match lines that
+            contain pattern as plain text. If the pattern is not a valid
+            regular expression, search for it as plain text instead of
+            raising re.error.
+    '''
+    def __init__(self, pattern, ignore_case=False,
+                 allow_non_regex_pattern=True):
+        self.pattern = pattern
+        self.ignore_case = ignore_case
+        self.needle = None
+        self.regex = None
+        self.line_regex = None
+        self.line_by_line = False
+        flags = re.MULTILINE
+        if ignore_case:
+            flags |= re.IGNORECASE
+        is_ascii = PatternMatcher._is_ascii(pattern)
+        source = None
+        if not any(c in REGEX_SPECIAL_CHARS for c in pattern):
+            self.strategy = LITERAL
+            if ignore_case:
+                self.strategy = LITERAL_ICASE
+                source = re.escape(pattern)
+        else:
+            source = pattern
+            global_flags, rest = PatternMatcher._split_global_flags(pattern)
+            if allow_non_regex_pattern:
+                if "x" in global_flags:
+                    rest += "\n"  # End any trailing comment.
+                source = "{}(?:{})|{}".format(global_flags, rest,
+                                              re.escape(pattern))
+                # ^ Global flags such as "(?i)" must stay at the start.
+            try:
+                re.compile(source, flags)
+            except re.error:
+                if not allow_non_regex_pattern:
+                    raise
+                self.strategy = LITERAL
+                source = None
+                if ignore_case:
+                    self.strategy = LITERAL_ICASE
+                    source = re.escape(pattern)
+            else:
+                self.strategy = REGEX
+                if ((not is_ascii) or ("u" in global_flags)
+                        or PatternMatcher._needs_text(pattern)):
+                    self.strategy = REGEX_TEXT
+                self.line_by_line = PatternMatcher._needs_lines(pattern)
+        if (self.strategy == LITERAL_ICASE) and not is_ascii:
+            self.strategy = REGEX_TEXT
+        line_source = source
+        if source is not None:
+            source = PatternMatcher._allow_cr_before_eol(source)
+        if self.strategy == REGEX_TEXT:
+            self.regex = re.compile(source, flags)
+            self.line_regex = re.compile(line_source, flags)
+        elif source is not None:
+            self.regex = re.compile(source.encode(CONTENT_ENCODING), flags)
+            self.line_regex = re.compile(
+                line_source.encode(CONTENT_ENCODING), flags)
+        else:
+            self.needle = pattern.encode(CONTENT_ENCODING)
+
+    @staticmethod
+    def _allow_cr_before_eol(source):
+        '''Make each "$" in a regex also match before "\\r" at the end
+        of a line, since lines were formerly compared without "\\r\\n".
+        '''
+        parts = []
+        in_class = False
+        i = 0
+        while i < len(source):
+            c = source[i]
+            if c == "\\":
+                parts.append(source[i:i+2])
+                i += 2
+                continue
+            if in_class:
+                if c == "]":
+                    in_class = False
+            elif c == "[":
+                in_class = True
+                if source.startswith("[^", i):
+                    parts.append("[^")
+                    i += 2
+                    c = source[i:i+1]
+                else:
+                    i += 1
+                    c = "[" + source[i:i+1]
+                # ^ Also take the next character since "]" right after
+                #   "[" (or "[^") is literal.
+            elif c == "$":
+                c = "(?=\\r*$)"
+            parts.append(c)
+            i += 1
+        return "".join(parts)
+
+    @staticmethod
+    def _split_global_flags(pattern):
+        '''Split leading global inline flags (such as "(?i)") from a
+        regex.
+
+        Returns:
+            tuple[str,str]: The flag groups and the rest of pattern.
+        '''
+        match = re.match(r"(?:\(\?[aiLmsux]+\))+", pattern)
+        if match is None:
+            return "", pattern
+        return match.group(), pattern[match.end():]
+
+    @staticmethod
+    def _needs_text(pattern):
+        '''Check for regex syntax that differs for bytes (See
+        TEXT_ONLY_ESCAPES).
+        '''
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == "\\":
+                i += 1
+                if pattern[i:i+1] in tuple(TEXT_ONLY_ESCAPES):
+                    return True
+            elif (c == ".") or pattern.startswith("[^", i):
+                return True
+            i += 1
+        return False
+
+    @staticmethod
+    def _needs_lines(pattern):
+        '''Check for regex syntax that depends on text outside of the
+        line (See LINE_CONTEXT_TOKENS).
+        '''
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith(LINE_CONTEXT_TOKENS, i):
+                return True
+            if pattern[i] == "\\":
+                i += 1
+            i += 1
+        return False
+
+    @staticmethod
+    def _is_ascii(value):
+        try:
+            value.encode("ascii")
+        except UnicodeError:
+            return False
+        return True
+
+    def iter_lines(self, data, max_count=None, before=0, after=0):
+        '''Find each line that matches.
+
+        Args:
+            data (Union[bytes,mmap.mmap]): The whole content of a file.
+            max_count (int, optional): Stop searching after this many
+                matching lines (The after context of the last one is
+                still yielded).
+            before (int, optional): Also yield up to this many lines of
+                context before each matching line.
+            after (int, optional): Also yield up to this many lines of
+                context after each matching line.
+
+        Returns:
+            Iterator[tuple[int,bytes,int,int]]: The line number
+                (counting from 1), content (excluding the newline), and
+                start and end of the first match (as byte offsets in the
+                line content) of each matching line, or None for start
+                and end if it is a context line. Each line is yielded
+                once, in order, even if contexts overlap.
+
+        Raises:
+            UnicodeDecodeError: The content is not CONTENT_ENCODING
+                (only checked for REGEX_TEXT).
+        '''
+        newline = b"\n"
+        cr = b"\r"
+        haystack = data
+        if self.strategy == REGEX_TEXT:
+            haystack = data[:].decode(CONTENT_ENCODING)
+            newline = "\n"
+            cr = "\r"
+        if LONE_CR[newline].search(haystack):
+            # A "\r" not followed by "\n" (old Mac line ending) ends a
+            #   line, as if read in text mode (universal newlines).
+            haystack = haystack[:].replace(cr + newline, newline)
+            haystack = haystack.replace(cr, newline)
+        search = None
+        if self.regex is not None:
+            search = self.regex.search
+            line_search = self.line_regex.search
+        else:
+            needle = self.needle
+            needle_len = len(needle)
+        size = len(haystack)
+        ends_with_newline = haystack[size-1:size] == newline
+        if ends_with_newline:
+            text_end = size - 1
+            # ^ There is no line after the last newline.
+        else:
+            text_end = size
+        line_n = 1
+        counted_to = 0
+        pos = 0
+        emitted_to = 0
+        # ^ Where the line after the last yielded line starts (so
+        #   context is never yielded twice).
+        emitted_n = 0
+        after_left = 0
+        match_count = 0
+        while pos <= size:
+            if (max_count is not None) and (match_count >= max_count):
+                break
+            if self.line_by_line:
+                start = end = pos  # Check every line (See __init__).
+            elif search is not None:
+                match = search(haystack, pos)
+                if match is None:
+                    break
+                start, end = match.span()
+                match = None
+            else:
+                start = haystack.find(needle, pos)
+                if start < 0:
+                    break
+                end = start + needle_len
+            if (start == size) and (ends_with_newline or size == 0):
+                # There is no line after the last newline.
+                break
+            line_start = haystack.rfind(newline, 0, start) + 1
+            line_end = haystack.find(newline, start)
+            if line_end < 0:
+                line_end = size
+            pos = line_end + 1
+            if search is not None:
+                match = line_search(haystack[line_start:line_end].rstrip(cr))
+                if match is None:
+                    # The match spans lines or includes the "\r" of a
+                    #   "\r\n", so it is not a match for only this line
+                    #   (as in grep).
+                    continue
+                start = line_start + match.start()
+                end = line_start + match.end()
+                match = None
+            line_n += haystack[counted_to:line_start].count(newline)
+            counted_to = line_start
+            match_count += 1
+            while (after_left > 0) and (emitted_to < line_start):
+                # The after context of the previous match
+                context_end = haystack.find(newline, emitted_to)
+                emitted_n += 1
+                yield self._line_result(haystack, emitted_n, emitted_to,
+                                        context_end)
+                emitted_to = context_end + 1
+                after_left -= 1
+            if before > 0:
+                spans = []
+                context_end = line_start - 1
+                while (len(spans) < before) and (context_end >= emitted_to):
+                    context_start = haystack.rfind(newline, emitted_to,
+                                                   context_end) + 1
+                    if context_start == 0:
+                        context_start = emitted_to
+                    spans.append((context_start, context_end))
+                    context_end = context_start - 1
+                for i in range(len(spans) - 1, -1, -1):
+                    yield self._line_result(haystack, line_n - i - 1,
+                                            *spans[i])
+            yield self._line_result(haystack, line_n, line_start, line_end,
+                                    start, end)
+            emitted_to = line_end + 1
+            emitted_n = line_n
+            after_left = after
+        while (after_left > 0) and (emitted_to <= text_end):
+            context_end = haystack.find(newline, emitted_to)
+            if context_end < 0:
+                context_end = size
+            emitted_n += 1
+            yield self._line_result(haystack, emitted_n, emitted_to,
+                                    context_end)
+            emitted_to = context_end + 1
+            after_left -= 1
+
+    @staticmethod
+    def _line_result(haystack, line_n, line_start, line_end, start=None,
+                     end=None):
+        '''Get an iter_lines result from offsets in haystack.'''
+        line = haystack[line_start:line_end]
+        if isinstance(line, str):
+            line = line.rstrip("\r")
+            if start is not None:
+                start = len(line[:start-line_start].encode(CONTENT_ENCODING))
+                end = len(line[:end-line_start].encode(CONTENT_ENCODING))
+            line = line.encode(CONTENT_ENCODING)
+        else:
+            line = line.rstrip(b"\r")
+            if start is not None:
+                start -= line_start
+                end -= line_start
+        if end is not None:
+            end = min(end, len(line))
+        return line_n, line, start, end
+
+
+def is_binary_header(header):
+    '''Check whether the first bytes of a file indicate a binary file.
+
+    Args:
+        header (bytes): The first BINARY_SNIFF_SIZE (or fewer) bytes.
+    '''
+    return b"\0" in header
+
+
+GrepMatch = namedtuple(
+    'GrepMatch',
+    ['path', 'line_n', 'start', 'end', 'line', 'text'],
+)
+# ^ One match yielded by iter_ggrep: The file path, line number
+#   (counting from 1), start and end of the first match as byte offsets
+#   in line (None if it is a context line), the line (bytes excluding
+#   the newline), and the line decoded as CONTENT_ENCODING.
+
+
+def _iter_file_matches(sub, matcher, scan, max_count=None, before=0,
+                       after=0):
+    '''Search one file and yield each GrepMatch.
+
+    A file with a NUL byte near the start is skipped as binary without
+    being read further. Otherwise, a file at least MMAP_MIN_SIZE bytes
+    is memory-mapped and searched without being decoded. If a matching
+    line can't be decoded, the file is considered binary and the rest of
+    it is skipped (Matches already yielded are not retracted).
+
+    Args:
+        matcher (PatternMatcher): The compiled pattern.
+        scan (dict): This is set to the status of the file: 'size' (in
+            bytes), 'read' (False if the file was binary and skipped),
+            'binary' (bool) and 'matched' (bool).
+        max_count, before, after: See PatternMatcher.iter_lines.
+    '''
+    scan['size'] = os.path.getsize(sub)
+    scan['read'] = False
+    scan['binary'] = False
+    scan['matched'] = False
+    echo3('* Checking "{}"'.format(sub))
+    with open(sub, 'rb') as ins:
+        header = ins.read(BINARY_SNIFF_SIZE)
+        if is_binary_header(header):
+            echo3('* ignored binary file "{}" due to a NUL byte'
+                  ''.format(sub))
+            scan['binary'] = True
+            return
+        mapped = None
+        if len(header) < BINARY_SNIFF_SIZE:
+            data = header  # It is the whole file.
+        elif scan['size'] < MMAP_MIN_SIZE:
+            data = header + ins.read()
+        else:
+            mapped = mmap.mmap(ins.fileno(), 0, access=mmap.ACCESS_READ)
+            data = mapped
+        try:
+            for line_n, line, start, end in matcher.iter_lines(
+                    data, max_count=max_count, before=before, after=after):
+                text = line.decode(CONTENT_ENCODING)
+                if start is not None:
+                    scan['matched'] = True
+                yield GrepMatch(sub, line_n, start, end, line, text)
+        except UnicodeDecodeError as ex:
+            # 'utf-8' codec can't decode byte 0x89 in position
+            #  0: invalid start byte
+            echo3('* ignored binary file "{}" due to: {}'
+                  ''.format(sub, str(ex)))
+            scan['binary'] = True
+            return
+        finally:
+            if mapped is not None:
+                mapped.close()
+    scan['read'] = True
+
+
+def _scan_file(sub, matcher, max_count=None, before=0, after=0):
+    '''Search one file (See _iter_file_matches).
+
+    This is a module-level function so it can run in a worker process.
+
+    Returns:
+        dict: The scan status (See _iter_file_matches) and 'matches'
+            (list of GrepMatch).
+    '''
+    scan = {}
+    scan['matches'] = list(_iter_file_matches(
+        sub, matcher, scan, max_count=max_count, before=before, after=after,
+    ))
+    return scan
+
+
+def _add_scan(stats, scan):
+    '''Add the status of one scanned file to the stats of iter_ggrep.'''
+    if scan['binary']:
+        stats['binary_count'] += 1
+    if not scan['read']:
+        return
+    stats['read_count'] += 1
+    if scan['matched']:
+        stats['match_count'] += 1
+    stats['read_mb'] += float(scan['size']) / 1024.0 / 1024.0
+
+
+def iter_ggrep(pattern, path, more_args=None, include=None,
+               exclude=None, ex_by=None, recursive=True, ignore=None,
+               ignore_root=None, gitignore=True, show_args_warnings=True,
+               allow_non_regex_pattern=True, trace_ignore_files={},
+               follow_symlinks=True, followed_targets=None, jobs=None,
+               ignore_case=False, use_index=False, cache_dir=None,
+               max_count=None, before=0, after=0, stats=None):
+    '''Find a pattern within files in a given path
+    (or one file if path is a file) and yield each match as it is found.
+
+    Memory use does not depend on the number of matches (only on
+    PENDING_PER_JOB if jobs > 1), and the search stops as soon as the
+    caller stops iterating (or calls close on the generator).
+
+    For documentation of other arguments, see ggrep.
+
+    Args:
+        max_count (int, optional): Stop reading each file after this
+            many matching lines (as in grep -m).
+        before (int, optional): Also yield this many lines of context
+            before each matching line (as in grep -B).
+        after (int, optional): Also yield this many lines of context
+            after each matching line (as in grep -A).
+        stats (dict, optional): If set, it is updated in place with the
+            counters described in ggrep (all except 'files').
+
+    Returns:
+        Iterator[GrepMatch]: Each matching line (and context line, where
+            start and end are None), in the order that filter_tree
+            yields paths.
+    '''
+    matcher = PatternMatcher(
+        pattern,
+        ignore_case=ignore_case,
+        allow_non_regex_pattern=allow_non_regex_pattern,
+    )
+    if stats is None:
+        stats = {}
+    stats['strategy'] = matcher.strategy
+    stats['read_mb'] = 0.0
+    stats['read_count'] = 0
+    stats['match_count'] = 0
+    stats['binary_count'] = 0
+    index = None
+    needle_trigrams = None
+    if use_index:
+        from hierosoft.ggrepindex import (
+            GrepIndex,
+            get_trigrams,
+        )
+        if isinstance(ignore, IgnoreRules):
+            ignore_lines = [rule.line for rule in ignore.rules]
+        else:
+            ignore_lines = ignore
+        if matcher.strategy in (LITERAL, LITERAL_ICASE):
+            needle_trigrams = get_trigrams(
+                matcher.pattern.encode(CONTENT_ENCODING)
+            )
+        index = GrepIndex(
+            path,
+            options={
+                'include': include,
+                'exclude': exclude,
+                'recursive': recursive,
+                'ignore': ignore_lines,
+                'gitignore': gitignore,
+                'follow_symlinks': follow_symlinks,
+            },
+            cache_dir=cache_dir,
+            needle_trigrams=needle_trigrams,
+        )
+        stats['index_skipped'] = 0
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    executor = None
+    pending = deque()
+    if jobs is not None and jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    completed = False
+    try:
+        for sub, is_file in _filter_tree(
+                path, more_args=more_args, include=include,
+                exclude=exclude, ex_by=ex_by, recursive=recursive,
+                ignore=ignore, ignore_root=ignore_root,
+                gitignore=gitignore,
+                show_args_warnings=show_args_warnings,
+                trace_ignore_files=trace_ignore_files,
+                follow_symlinks=follow_symlinks,
+                followed_targets=followed_targets):
+            if not is_file:
+                # echo3('- not a file: "{}"'.format(sub))
+                continue
+            if index is not None:
+                record = index.refresh(sub)
+                if record.binary:
+                    stats['binary_count'] += 1
+                    continue
+                if not record.candidate:
+                    stats['index_skipped'] += 1
+                    continue
+            if executor is None:
+                scan = {}
+                for match in _iter_file_matches(
+                        sub, matcher, scan, max_count=max_count,
+                        before=before, after=after):
+                    yield match
+                _add_scan(stats, scan)
+                continue
+            pending.append(executor.submit(
+                _scan_file, sub, matcher, max_count=max_count,
+                before=before, after=after,
+            ))
+            while len(pending) > jobs * PENDING_PER_JOB:
+                # Collect in submission order so results are in path
+                # order, and bound memory while the walk continues.
+                scan = pending.popleft().result()
+                for match in scan['matches']:
+                    yield match
+                _add_scan(stats, scan)
+        while pending:
+            scan = pending.popleft().result()
+            for match in scan['matches']:
+                yield match
+            _add_scan(stats, scan)
+        completed = True
+    finally:
+        if executor is not None:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        if index is not None:
+            index.close(prune=completed)
+            # ^ Only remove missing files if the whole tree was walked.
+            stats['index_changed'] = index.changed_count
+
+
 def ggrep(pattern, path, more_args=None, include=None,
           exclude=None, ex_by=None, recursive=True,
           quiet=True, ignore=None, ignore_root=None, gitignore=True,
           show_args_warnings=True, allow_non_regex_pattern=True,
           trace_ignore_files={}, follow_symlinks=True,
-          followed_targets=[], result_file_fmt="{path}:{line_n}:{line}"):
+          followed_targets=None, result_file_fmt="{path}:{line_n}:{line}",
+          jobs=None, ignore_case=False, use_index=False, cache_dir=None,
+          max_count=None, files_with_matches=False, count=False,
+          before=0, after=0, result_context_fmt="{path}-{line_n}-{line}"):
     '''Find a pattern within files in a given path
-    (or one file if path is a file) and yield the next for each.
+    (or one file if path is a file) and collect the results.
+
+    This collects results from iter_ggrep (Use that instead to process
+    each match as soon as it is found, without keeping all of them).
 
     Args:
         path (str): any path or no path that should be the start
@@ -688,96 +1523,129 @@ def ggrep(pattern, path, more_args=None, include=None,
             given as first sequential argument), {line_n} is the line
             number in the file path, and {line} is the string with the
             content (the line data itself excluding the newline
-            character).
+            character). {quoted_path} is path quoted for a command
+            line if necessary (See quoted).
+        jobs (int, optional): Scan file contents in this many worker
+            processes while the main process walks the tree. Results
+            are still collected (and printed unless quiet) in the order
+            filter_tree yields paths. If 0, use os.cpu_count(). If None
+            or 1, scan in the current process.
+        ignore_case (bool, optional): Ignore case distinctions in
+            pattern and data.
+        use_index (bool, optional): Use a persistent index (See
+            hierosoft.ggrepindex) so that files which haven't changed
+            since the last indexed search (by size and mtime) aren't
+            re-read unless they may contain a literal pattern, and
+            binary files aren't opened.
+        cache_dir (str, optional): Where to store the index if use_index
+            (Defaults to ggrepindex.default_cache_dir()).
+        max_count (int, optional): Stop reading each file after this
+            many matching lines (as in grep -m).
+        files_with_matches (bool, optional): Only list the path of each
+            file that matches, reading each only up to its first match
+            (as in grep -l).
+        count (bool, optional): Only list "{path}:{count}" for each file
+            that matches (as in grep -c, except that files without a
+            match are not listed).
+        before (int, optional): Also list this many lines of context
+            before each matching line (as in grep -B).
+        after (int, optional): Also list this many lines of context
+            after each matching line (as in grep -A).
+        result_context_fmt (str, optional): The format for each context
+            line (See result_file_fmt). Each group of lines that isn't
+            adjacent to the previous one is preceded by
+            CONTEXT_SEPARATOR.
 
     Returns:
         dict: various information such as:
             - 'files': The list of results (formatted using
-              result_file_fmt)
+              result_file_fmt, or see files_with_matches and count)
+            - 'strategy': How the content was searched (LITERAL,
+              LITERAL_ICASE, REGEX or REGEX_TEXT; See PatternMatcher)
+            - 'line_count': How many matching lines (or files if
+              files_with_matches or count) were listed
+            - 'binary_count': How many files were skipped as binary
+            - 'index_skipped': How many files were skipped since the
+              index shows they can't contain the pattern
+            - 'index_changed': How many files were (re)indexed
     '''
     results = {}
     results['files'] = []
-    results['read_mb'] = 0.0
-    results['read_count'] = 0
-    results['match_count'] = 0
-    try:
-        for sub in filter_tree(path, more_args=more_args,
-                               include=include,
-                               exclude=exclude, ex_by=ex_by,
-                               recursive=recursive,
-                               quiet=quiet, ignore=ignore,
-                               ignore_root=ignore_root,
-                               gitignore=gitignore,
-                               show_args_warnings=show_args_warnings,
-                               trace_ignore_files=trace_ignore_files,
-                               follow_symlinks=follow_symlinks,
-                               followed_targets=followed_targets):
-            # subPath = os.path.join(path, sub)
-            # if path == "":
-            #     subPath = sub
-            # if not os.path.isfile(subPath):
-
-            if not os.path.isfile(os.path.realpath(sub)):
-                # echo3('- not a file: "{}"'.format(sub))
-                continue
+    results['line_count'] = 0
+    if files_with_matches:
+        max_count = 1
+    if files_with_matches or count:
+        before = 0
+        after = 0
+    counts = {}
+    prev = None
+    for match in iter_ggrep(
+            pattern, path, more_args=more_args, include=include,
+            exclude=exclude, ex_by=ex_by, recursive=recursive,
+            ignore=ignore, ignore_root=ignore_root, gitignore=gitignore,
+            show_args_warnings=show_args_warnings,
+            allow_non_regex_pattern=allow_non_regex_pattern,
+            trace_ignore_files=trace_ignore_files,
+            follow_symlinks=follow_symlinks,
+            followed_targets=followed_targets, jobs=jobs,
+            ignore_case=ignore_case, use_index=use_index,
+            cache_dir=cache_dir, max_count=max_count, before=before,
+            after=after, stats=results):
+        if count:
+            if match.path not in counts:
+                counts[match.path] = 0
+            counts[match.path] += 1
+            continue
+        if files_with_matches:
+            result = match.path
+            results['line_count'] += 1
+        else:
+            if is_context_break(prev, match) and (before or after):
+                results['files'].append(CONTEXT_SEPARATOR)
+                if not quiet:
+                    print(CONTEXT_SEPARATOR)
+            prev = match
+            fmt = result_file_fmt
+            if match.start is None:
+                fmt = result_context_fmt
             else:
-                pass
-                # echo3("- examining file: {}".format(sub))
-
-            size = os.path.getsize(sub)
-            matched = False
-            with open(sub, 'r') as ins:
-                lineN = 0
-                try:
-                    echo3('* Checking "{}"'.format(sub))
-                    for rawL in ins:
-                        lineN += 1
-                        line = rawL.rstrip("\n\r")
-                        if (re.search(pattern, line)
-                                or (allow_non_regex_pattern
-                                    and (pattern in line))):
-                            matched = True
-                            result = result_file_fmt.format(
-                                path=sub,
-                                line_n=lineN,
-                                line=line,
-                            )
-                            results['files'].append(result)
-                            if not quiet:
-                                print(result)
-                        else:
-                            pass
-                            # echo3('  * pattern "{}" is not in line'
-                            #       ' "{}"'.format(pattern, line))
-                    results['read_count'] += 1
-                    if matched:
-                        results['match_count'] += 1
-                    results['read_mb'] += float(size) / 1024.0 / 1024.0
-                except UnicodeDecodeError as ex:
-                    # 'utf-8' codec can't decode byte 0x89 in position
-                    #  0: invalid start byte
-                    echo3('* ignored binary file "{}" due to: {}'
-                          ''.format(sub, str(ex)))
-                    # return results
-                    continue
-    # except DontStopIterationExclusion as ex:
-    #     # TODO: See if this is ok. This occurs since exclusions list is
-    #     #   allowed to be passed recursively for explicitly-included
-    #     #   paths.
-    #     pass
-    except DontStopIteration as ex:
-        raise
-        raise RuntimeError(
-            "An explicitly specified search path itself was filtered"
-            " (This should never happen): {}".format(str(ex))
-        )
-        pass
-        # results['files'].append(sub)
-    # for result in results['files']:
-    #     print(result)
+                results['line_count'] += 1
+            result = fmt.format(
+                path=match.path,
+                quoted_path=quoted(match.path),
+                line_n=match.line_n,
+                line=match.text,
+            )
+        results['files'].append(result)
+        if not quiet:
+            print(result)
+    for path, path_count in counts.items():
+        result = "{}:{}".format(path, path_count)
+        results['line_count'] += 1
+        results['files'].append(result)
+        if not quiet:
+            print(result)
     return results
 
 
+CONTEXT_SEPARATOR = "--"
+
+
+def is_context_break(prev, match):
+    '''Check whether a CONTEXT_SEPARATOR belongs before a match.
+
+    Args:
+        prev (GrepMatch): The previous match or context line (or None).
+        match (GrepMatch): The next match or context line.
+
+    Returns:
+        bool: True if match isn't the line after prev in the same file.
+    '''
+    if prev is None:
+        return False
+    return (match.path != prev.path) or (match.line_n != prev.line_n + 1)
+
+
 TRIVIAL_EXCLUSION_INCLUDES = "is not in includes"
 TRIVIAL_INCLUSION_IN_INCLUDES = "is in includes"
 TRIVIAL_EXCEPTION_FLAGS = [
@@ -790,7 +1658,7 @@ def filter_tree(path, more_args=None, include=None, exclude=None, ex_by=None,
                 recursive=True, quiet=True, ignore=None, ignore_root=None,
                 gitignore=True, show_args_warnings=True,
                 trace_ignore_files={}, follow_symlinks=True,
-                followed_targets=[], root=None):
+                followed_targets=None, root=None):
     '''Find the entire subtree of files and directories in a given path
     and yield the next for each.
 
@@ -813,20 +1681,22 @@ def filter_tree(path, more_args=None, include=None, exclude=None, ex_by=None,
         recursive (bool, optional): Recursively search subdirectories
             (ignored if path is a file).
         quiet (bool, optional): Only return lines, do not print them.
-        ignore (list[str], optional): Ignore a list of files
-            (automatically changed to content of .gitignore or
-            .grepignore if present and path is a directory and gitignore
-            is True). Therefore it is separate from exclude.
+        ignore (Union[list[str],IgnoreRules], optional): Ignore a list
+            of files (automatically changed to the compiled content of
+            .gitignore or .grepignore if present and path is a directory
+            and gitignore is True). Therefore it is separate from
+            exclude. A list is compiled into IgnoreRules once.
         ignore_root (str, optional): This is required when using ignore
             since .gitignore or .grepignore may have paths starting with
             "/" or having "/" before the end and, as per git's
             .gitignore spec, must be a path relative to the gitignore
             file in those two cases.
         gitignore (bool, optional): Set to True to read .gitignore files
-            recursively and to ignore files and directories specified in
-            those files. Git's .gitignore spec (including exclusions
-            using "!") is the format spec used (Report issues where that
-            is not followed).
+            (or .grepignore files) recursively and to ignore files and
+            directories specified in those files. Each one replaces the
+            rules from the parent directory for its own subtree. Git's
+            .gitignore spec (including exclusions using "!") is the
+            format spec used (Report issues where that is not followed).
         show_args_warnings (bool, optional): Show a warning for each
             command switch in more_args that is not implemented. The
             value is True for only one call. It will be automatically be
@@ -840,14 +1710,103 @@ def filter_tree(path, more_args=None, include=None, exclude=None, ex_by=None,
             back to a file for error reporting purposes.
         follow_symlinks (bool, optional): Follow symlinked directories.
         followed_targets (list[str], optional): This is automatically
-            generated. Any symlink target that was followed already
-            won't be followed again, even if relative and recursive.
-        root (str, optional): Set the root directory upon which to add
-            sub (only used for tracking, and automatically set).
+            generated (new for each call if None). Any symlink target
+            that was followed already won't be followed again, even if
+            relative and recursive.
+        root (str, optional): Deprecated (The walk is no longer
+            recursive, so nothing needs to be tracked across calls).
+
+    Raises:
+        DontStopIteration: path itself is filtered or can't be listed
+            (Nothing below path is ever raised; such paths are skipped).
+    '''
+    for this_path, _ in _filter_tree(
+            path, more_args=more_args, include=include, exclude=exclude,
+            ex_by=ex_by, recursive=recursive, ignore=ignore,
+            ignore_root=ignore_root, gitignore=gitignore,
+            show_args_warnings=show_args_warnings,
+            trace_ignore_files=trace_ignore_files,
+            follow_symlinks=follow_symlinks,
+            followed_targets=followed_targets):
+        yield this_path
+
+
+def _skip_reason(path, name, is_dir, is_file, include, exclude, ex_by,
+                 ignore, ig_path):
+    '''Check whether filter_tree should skip a path.
+
+    Returns:
+        tuple(type,str): The DontStopIteration subclass that the
+            recursive version of filter_tree would have raised, and a
+            message explaining why the path is skipped, or None to keep
+            the path.
+    '''
+    if is_dir and (name in DEFAULT_IGNORE_DIRS):
+        return DontStopIteration, '* ignored "{}"'.format(path)
+    if exclude and is_like_any(name, exclude):
+        return (DontStopIterationExclusion,
+                "* excluded {} due to {}".format(path, ex_by))
+    if ignore is not None:
+        rule = ignore.match(path, is_dir)
+        if rule is not None:
+            msg = ("* {} {} due to {}"
+                   "".format(rule.verb, path, rule.source or ig_path))
+            if rule.verb == IGNORED:
+                return DontStopIteration, msg
+            # If inverse and matches, keep it.
+            echo0(msg)
+        elif get_verbosity() >= 4:
+            echo4("- {} not ignored by filter".format(path))
+    if is_file and not is_like_any(name, include):
+        # ^ default is ["*"]
+        return (DontStopIteration,
+                "* {} {} (*not* {} is_like_any of {})"
+                .format(name, TRIVIAL_EXCLUSION_INCLUDES, name, include))
+    return None
+
+
+def _scandir_list(path):
+    '''List a directory for filter_tree.
+
+    Returns:
+        list[os.DirEntry]: The entries, or None if path can't be listed.
+    '''
+    try:
+        with os.scandir(path or ".") as entries:
+            return list(entries)
+    except OSError as ex:
+        echo3('* missing or inaccessible: "{}" ({})'.format(path, ex))
+        return None
+
+
+def _find_ignore_file(path, entries):
+    '''Find the .gitignore or .grepignore in a listed directory.
+
+    Returns:
+        str: The path (joined as by join_if_exists) or None.
+    '''
+    names = set(entry.name for entry in entries)
+    for name in (".gitignore", ".grepignore"):
+        if name in names:
+            return os.path.join(path, name)
+    return None
+
+
+def _filter_tree(path, more_args=None, include=None, exclude=None,
+                 ex_by=None, recursive=True, ignore=None, ignore_root=None,
+                 gitignore=True, show_args_warnings=True,
+                 trace_ignore_files={}, follow_symlinks=True,
+                 followed_targets=None):
+    '''Walk the tree for filter_tree (See filter_tree for documentation).
+
+    This walks using os.scandir and an explicit stack (so there is no
+    recursion limit), and uses the type information cached in each
+    os.DirEntry instead of calling os.path functions for each entry.
+
+    Returns:
+        Iterator[tuple[str,bool]]: Each path that is not filtered, and
+            whether it is a file (following symlinks).
     '''
-    # echo2('filter_tree("{}")'.format(path))
-    if root is None:
-        root = path
     if more_args is not None:
         for arg in more_args:
             if arg == "--include-all":
@@ -869,6 +1828,8 @@ def filter_tree(path, more_args=None, include=None, exclude=None, ex_by=None,
         exclude = []
     elif isinstance(exclude, str):
         exclude = [exclude]
+    if not ex_by:
+        ex_by = "exclude argument"
 
     if isinstance(ignore, str):
         ignore = [ignore]
@@ -876,306 +1837,118 @@ def filter_tree(path, more_args=None, include=None, exclude=None, ex_by=None,
     if ignore is not None:
         if not isinstance(ignore_root, str):
             raise ValueError("ignore requires ignore_root")
-        else:
+        if not isinstance(ignore, IgnoreRules):
             ig_path = join_if_exists(ignore_root,
                                      [".gitignore", ".grepignore"])
-    if exclude is not None:
-        if not isinstance(root, str):
-            raise ValueError("ignore requires ignore_root")
-        else:
-            if not ex_by:
-                ex_by = "exclude argument"
-    sub = os.path.split(path)[1]
-    # Do not ignore if "" even if .git, so let sub  ""--isdir("")==False
-    if os.path.isdir(path):
-        if sub in DEFAULT_IGNORE_DIRS:
-            raise DontStopIteration('* ignored "{}"'.format(path))
-
-    if (exclude is not None) and is_like_any(sub, exclude):
-        verb = "excluded"
-        msg = ("* {} {} due to {}"
-               "".format(verb, path, ex_by))
-        # if verb == "excluded":
-        raise DontStopIterationExclusion(msg)
+            ignore = IgnoreRules(ignore, ignore_root, source=ig_path,
+                                 trace_ignore_files=trace_ignore_files)
+    if followed_targets is None:
+        followed_targets = []
+    trace = get_verbosity() >= 3
 
-    if ignore is not None:
-        before_ignore = []
-        other_ignore = []
-        for rawIgnore in ignore:
-            if rawIgnore.startswith("!"):
-                before_ignore.append(rawIgnore)
-            else:
-                other_ignore.append(rawIgnore)
-        ignore = before_ignore + other_ignore
-        # ^ Inverse operations must happen *first* so that lookahead
-        #   is done, otherwise a loose ignore may match first and
-        #   result in an early return (which means ignore)!
-        for rawIgnore in ignore:
-            ignore_s = rawIgnore
-            checkPath = path
-            absolute = False
-            verb = "ignored"
-            if ignore_s.startswith("!"):
-                verb = "kept"
-                # For this to work, inverse strings must be processed
-                # first!
-                ignore_s = ignore_s[1:]
-            if ignore_s.startswith("/"):
-                absolute = True
-                # ignore_s = [1:]
-                # ^ keep "/" since checkPath will start with "/" after
-                #   ignore_root is removed in the case of a match.
-                checkPath = path
-                assert ignore_root, \
-                    "ignore_root is required when ignore is set"
-                if checkPath.startswith(ignore_root):
-                    checkPath = checkPath[len(ignore_root):]
-                    # ^ Now checkPath starts with "/" like ignore_s
-            try:
-                if ignore_s.endswith("/"):
-                    ignore_s = ignore_s[:-1]
-                    if absolute:
-                        if (os.path.isdir(path)
-                                and is_like(checkPath, ignore_s)):
-                            msg = ("* {} {} due to {}".format(
-                                verb,
-                                path,
-                                ig_path,
-                            ))
-                            if verb == "ignored":
-                                raise DontStopIteration(msg)
-                            else:
-                                echo0(msg)
-                                # If inverse and matches, keep it. Stop
-                                # checking it against ignore strings.
-                                break
-                    else:
-                        if (os.path.isdir(path) and is_like(sub, ignore_s)):
-                            msg = ("* {} {} due to {}"
-                                   "".format(verb, path, ig_path))
-                            if verb == "ignored":
-                                raise DontStopIteration(msg)
-                            else:
-                                echo0(msg)
-                                # If inverse and matches, keep it. Stop
-                                # checking it against ignore strings.
-                                break
-                else:
-                    if absolute:
-                        if (os.path.isfile(os.path.realpath(path))
-                                and is_like(checkPath, ignore_s)):
-                            msg = ("* {} {} due to {}"
-                                   "".format(verb, path, ig_path))
-                            if verb == "ignored":
-                                raise DontStopIteration(msg)
-                            else:
-                                echo0(msg)
-                                # If inverse and matches, keep it. Stop
-                                # checking it against ignore strings.
-                                break
-                    else:
-                        if (os.path.isfile(os.path.realpath(path))
-                                and is_like(sub, ignore_s)):
-                            # ^ ALWAYS use realpath since could be ""
-                            msg = ("* {} {} due to {}"
-                                   "".format(verb, path, ig_path))
-                            if verb == "ignored":
-                                raise DontStopIteration(msg)
-                            else:
-                                echo0(msg)
-                                # If inverse and matches, keep it. Stop
-                                # checking it against ignore strings.
-                                break
-            except ValueError:
-                igs = ignore_s
-                rig = rawIgnore
-                echo0(
-                    'trace_ignore_files[{}] = {}  # effectively {}'
-                    ''.format(json.dumps(rawIgnore),
-                              json.dumps(trace_ignore_files.get(rig)),
-                              json.dumps(igs))
-                )
-                raise
-            if path != checkPath:
-                echo4("- {} ({}) not {} by filter: {}"
-                      "".format(checkPath, path, verb, ignore_s))
-            else:
-                # such as "not ignored by filter"
-                echo4("- {} not {} by filter: {}"
-                      "".format(path, verb, ignore_s))
-
-    if os.path.isfile(os.path.realpath(path)):
-        # ^ ALWAYS do realpath since could be ""
-        # echo1('* checking "{}"'.format(path))
-        if not is_like_any(sub, include):
-            # ^ default is ["*"]
-            raise DontStopIteration(
-                "* {} {} (*not* {} is_like_any of {})"
-                .format(sub, TRIVIAL_EXCLUSION_INCLUDES,
-                        sub, include)
-            )
-        elif exclude and is_like_any(sub, exclude):
-            raise DontStopIterationExclusion(
-                "{} {} ({} is_like_any of {})"
-                .format(path, TRIVIAL_INCLUSION_IN_INCLUDES,
-                        sub, exclude)
-            )
-        else:
-            yield path
-            raise DontStopIteration(
-                "{} {} ({} is_like_any of {}, exclude={})"
-                .format(path, TRIVIAL_INCLUSION_IN_INCLUDES,
-                        sub, include, exclude)
-            )
-        # ^ Either way, do not continue below if it is a file.
-    else:
-        yield path
-
-    if (len(path) != 0) and (not os.path.isdir(path)):
-        # ^ If not checking len 0, use os.path.abspath(path)
-        #   to convert "" to a path.
-        # Dangling symlink in this case probably, so return to avoid:
-        # "FileNotFoundError: [Errno 2] No such file or directory: "
-        # raise DontStopIteration(
-        #     '* The directory "{}" could not be opened'.format(path)
-        # )  # return
-        pass
-    # Even though tryIgnore occurs last, it will happen before any file
-    # in the directory, since path that is dir is in the *same* depth
-    # as the file at that depth and therefore such a .gitignore should
-    # *not* affect any file at that level.
-    tryIgnore = os.path.join(path, ".gitignore")
-    tryIgnore = join_if_exists(path, [".gitignore", ".grepignore"])
-    if gitignore and (tryIgnore is not None):
-        echo1('* setting path filter to "{}"'.format(tryIgnore))
-        ignore = []
-        trace_ignore_files = {}
-        ignore_root = path
-        with open(tryIgnore, 'r') as ins:
-            for rawL in ins:
-                line = rawL.strip()
-                if len(line) < 1:
-                    continue
-                if line.startswith("#"):
-                    continue
-                ignore.append(line)
-                trace_ignore_files[line] = tryIgnore
-    listPath = path
-    if listPath == "":
-        listPath = "."
-    subs = None
-    try:
-        subs = os.listdir(listPath)
-    except FileNotFoundError as ex:
-        msg = ('* missing or inaccessible: "{}" ({})'
-               ''.format(listPath, ex))
-        raise DontStopIteration(msg)
-    except NotADirectoryError as ex:
-        msg = ('* missing or inaccessible'
-               ' (neither a file nor a directory): "{}" ({})'
-               ''.format(listPath, ex))
-        raise DontStopIteration(msg)
-    # echo1("- searching {} sub(s) in {}"
-    #       "".format(len(subs), json.dumps(path)))
-
-    for sub in subs:
-        # The parent path is guaranteed *not* to be a file by now.
-        subPath = os.path.join(path, sub)
-        if path == "":
-            subPath = sub
-        if recursive or not os.path.isdir(subPath):
-            # echo2("  searching {}".format(subPath))
+    # Do not ignore if "" even if .git, so let sub  ""--isdir("")==False
+    is_dir = os.path.isdir(path)
+    is_file = os.path.isfile(os.path.realpath(path))
+    # ^ ALWAYS do realpath since could be ""
+    skip = _skip_reason(path, os.path.split(path)[1], is_dir, is_file,
+                        include, exclude, ex_by, ignore, ig_path)
+    if skip is not None:
+        raise skip[0](skip[1])
+    yield path, is_file
+    if is_file:
+        return
+    entries = _scandir_list(path)
+    if entries is None:
+        raise DontStopIteration(
+            '* missing or inaccessible: "{}"'.format(path)
+        )
+    # Each frame is: directory path, entry iterator, ignore rules.
+    stack = []
+
+    def push(parent, entries, ignore):
+        if gitignore:
+            # Even though the ignore file is read last, it is read
+            # before any file in the directory, since a .gitignore
+            # should *not* affect the directory itself (only deeper).
+            try_ignore = _find_ignore_file(parent, entries)
+            if try_ignore is not None:
+                echo1('* setting path filter to "{}"'.format(try_ignore))
+                ignore = IgnoreRules.from_file(try_ignore)
+        stack.append((parent, iter(entries), ignore))
+
+    push(path, entries, ignore)
+    while stack:
+        parent, entries, ignore = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        sub_path = entry.name
+        if parent != "":
+            sub_path = os.path.join(parent, entry.name)
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir and not recursive:
+            continue
+        if entry.is_symlink():
             # Always avoid recursive symlinks:
-            if os.path.islink(subPath):
-                target = os.readlink(subPath)
-                if not follow_symlinks:
-                    echo0("* follow_symlinks=False, skipping {} -> {}"
-                          "".format(subPath, target))
+            target = os.readlink(sub_path)
+            if not follow_symlinks:
+                echo0("* follow_symlinks=False, skipping {} -> {}"
+                      "".format(sub_path, target))
+                continue
+            if not is_abs_path(target):
+                # The path must be constructed manually because:
+                '''
+                cd ~/Videos
+                cd without-intro
+                ln -s .. Videos
+                cd ..
+                python3
+                os.path.abspath(os.readlink("without-intro/Videos"))
+                # The result is ~ but should be Videos, so:
+                '''
+                target_path = os.path.abspath(os.path.join(parent, target))
+                abs_path = os.path.abspath(parent)
+                if abs_path == target_path:
                     continue
-                # if os.path.abspath(target) != target:
-                if not is_abs_path(target):
-                    # The path must be constructed manually because:
-                    '''
-                    cd ~/Videos
-                    cd without-intro
-                    ln -s .. Videos
-                    cd ..
-                    python3
-                    os.path.abspath(os.readlink("without-intro/Videos"))
-                    # The result is ~ but should be Videos, so:
-                    '''
-                    targetPath = os.path.join(path, target)
-                    targetPath = os.path.abspath(targetPath)
-                    absPath = os.path.abspath(path)
-                    if absPath == targetPath:
-                        continue
-                    targetPathSlash = targetPath
-                    if not targetPathSlash.endswith(os.path.sep):
-                        targetPathSlash += os.path.sep
-                    if absPath.startswith(targetPathSlash):
-                        echo0("* not following recursive (out-of-scope)"
-                              " link {} -> {}"
-                              "".format(subPath, targetPath))
-                        # Don't go backwards to expand the search such
-                        # as: "/opt/something" startswith "/opt/"
-                        continue
-                if target in followed_targets:
-                    echo0("* already followed {} -> {}"
-                          "".format(subPath, target))
+                target_path_slash = target_path
+                if not target_path_slash.endswith(os.path.sep):
+                    target_path_slash += os.path.sep
+                if abs_path.startswith(target_path_slash):
+                    echo0("* not following recursive (out-of-scope)"
+                          " link {} -> {}"
+                          "".format(sub_path, target_path))
+                    # Don't go backwards to expand the search such
+                    # as: "/opt/something" startswith "/opt/"
                     continue
-                followed_targets.append(target)
-                echo2('* only following symlink to "{}" once'
-                      ''.format(target))
-            try:
-                # Without `yield from`, the call never really happens
-                # (since this is a generator)!
-                # yield from is apparently Python 3-only syntax.
-                # `yield from get_all_subclasses(subclass)`
-                # is same as
-                # `for c in get_all_subclasses(subclass): yield c`
-                # and "The advantages of yield from come when you start
-                # to do more complicated things, like two-way
-                # communications between sender and receiver."
-                # according to
-                # <https://www.reddit.com/r/learnpython/comments/4rc15s/comment/d4zuk5l/?utm_source=share&utm_medium=web3x&utm_name=web3xcss&utm_term=1&utm_content=share_button>
-                # yield from filter_tree(
-                for this_sub in filter_tree(
-                        subPath,
-                        more_args=more_args,
-                        include=include,
-                        exclude=exclude,
-                        ex_by=ex_by,
-                        recursive=recursive,
-                        quiet=quiet,
-                        ignore=ignore,
-                        ignore_root=ignore_root,
-                        show_args_warnings=show_args_warnings,
-                        trace_ignore_files=trace_ignore_files,
-                        follow_symlinks=follow_symlinks,
-                        followed_targets=followed_targets,
-                        root=root,
-                ):
-                    yield this_sub
-                # ^ filter the files too
-                # ^ don't yield here, even if directory, since filtering
-                #   must occur (yield path before this loop instead)
-            # except DontStopIterationExclusion as ex:
-            #     # It is an explicit exclusion, so always honor it.
-            #     pass
-            except DontStopIteration as ex:
-                if not contains_any(str(ex), TRIVIAL_EXCEPTION_FLAGS):
-                    echo3(str(ex))
-                    # ^ Show the message explaining why the file or
-                    #   directory was ignored, without interfering with
-                    #   stdout.
-                pass
-        else:
-            pass
-            # echo2('  - skipping {} since isdir (recursive={})'
-            #       ''.format(subPath, recursive))
-
-    # Don't return: It is the Pythonic StopIteration and stops
-    # recursion within a generator!
+            if target in followed_targets:
+                echo0("* already followed {} -> {}"
+                      "".format(sub_path, target))
+                continue
+            followed_targets.append(target)
+            echo2('* only following symlink to "{}" once'
+                  ''.format(target))
+        try:
+            is_file = entry.is_file()
+        except OSError:
+            is_file = False
+        skip = _skip_reason(sub_path, entry.name, is_dir, is_file,
+                            include, exclude, ex_by, ignore, ig_path)
+        if skip is not None:
+            if trace and not contains_any(skip[1], TRIVIAL_EXCEPTION_FLAGS):
+                echo3(skip[1])
+                # ^ Show the message explaining why the file or
+                #   directory was ignored, without interfering with
+                #   stdout.
+            continue
+        yield sub_path, is_file
+        if is_dir:
+            entries = _scandir_list(sub_path)
+            if entries is not None:
+                push(sub_path, entries, ignore)
 
 
 def quoted(path):
@@ -1211,8 +1984,22 @@ def main():
     # ^ defaults
     _n_arg = None
     _include_all = False
-    no_value_args = ("--include-all",)
+    no_value_args = ("--include-all", "--index", "--invalidate-index",
+                     "--ignore-case", "--files-with-matches", "--count")
+    number_args = ("-j", "--jobs", "-m", "--max-count", "-A",
+                   "--after-context", "-B", "--before-context", "-C",
+                   "--context")
     gitignore = True
+    jobs = None
+    max_count = None
+    files_with_matches = False
+    count_only = False
+    before = 0
+    after = 0
+    ignore_case = False
+    use_index = False
+    invalidate_index = False
+    cache_dir = None
     pattern = None
     # path = None
     paths = []
@@ -1234,6 +2021,54 @@ def main():
         if arg == "--help":
             usage()
             return 0
+        elif prev_var in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif inline_k == "--jobs":
+            jobs = int(inline_v)
+        elif prev_var in ("-m", "--max-count"):
+            max_count = int(arg)
+        elif inline_k == "--max-count":
+            max_count = int(inline_v)
+        elif prev_var in ("-A", "--after-context"):
+            after = int(arg)
+        elif inline_k == "--after-context":
+            after = int(inline_v)
+        elif prev_var in ("-B", "--before-context"):
+            before = int(arg)
+        elif inline_k == "--before-context":
+            before = int(inline_v)
+        elif prev_var in ("-C", "--context"):
+            before = after = int(arg)
+        elif inline_k == "--context":
+            before = after = int(inline_v)
+        elif prev_var == "--cache-dir":
+            cache_dir = arg
+        elif inline_k == "--cache-dir":
+            cache_dir = inline_v
+        elif arg == "--cache-dir":
+            pass
+            # prev_var will be checked, so there is nothing to do yet.
+        elif arg == "--index":
+            use_index = True
+        elif arg == "--invalidate-index":
+            invalidate_index = True
+        elif arg in number_args:
+            pass
+            # prev_var will be checked, so there is nothing to do yet.
+        elif arg.startswith("-j") and arg[2:].isdigit():
+            jobs = int(arg[2:])
+        elif arg.startswith("-m") and arg[2:].isdigit():
+            max_count = int(arg[2:])
+        elif arg.startswith("-A") and arg[2:].isdigit():
+            after = int(arg[2:])
+        elif arg.startswith("-B") and arg[2:].isdigit():
+            before = int(arg[2:])
+        elif arg.startswith("-C") and arg[2:].isdigit():
+            before = after = int(arg[2:])
+        elif arg in ("-l", "--files-with-matches"):
+            files_with_matches = True
+        elif arg in ("-c", "--count"):
+            count_only = True
         elif arg == "--include":
             # This alt syntax (instead of --include=)
             #   is allowed by grep, so allow it.
@@ -1251,6 +2086,8 @@ def main():
             _n_arg = "-n"
         elif arg == "--no-ignore":
             gitignore = False
+        elif arg in ("-i", "--ignore-case"):
+            ignore_case = True
         elif arg == "--recursive":
             _recursive_arg = True
             # echo0("* -r (recursive) is already the default.")
@@ -1395,7 +2232,28 @@ def main():
     else:
         echo0("paths={}".format(paths))
 
-    if prev_var in ("--include", "--exclude"):
+    if prev_var in ("-j", "--jobs"):
+        raise ValueError(
+            "Error: You must specify a number of processes after {}."
+            .format(prev_var)
+        )
+    elif prev_var in number_args:
+        raise ValueError(
+            "Error: You must specify a number after {}."
+            .format(prev_var)
+        )
+    elif prev_var == "--cache-dir":
+        raise ValueError(
+            "Error: You must specify a directory after {}."
+            .format(prev_var)
+        )
+
+    if invalidate_index:
+        from hierosoft.ggrepindex import invalidate_indexes
+        invalidate_indexes(cache_dir=cache_dir)
+        if pattern is None:
+            return 0
+    elif prev_var in ("--include", "--exclude"):
         raise ValueError(
             "Error: You must specify a filename pattern after"
             " {} such as \"*.lua\""
@@ -1484,27 +2342,24 @@ def main():
         results = ggrep(pattern, path, more_args=_new_args,
                         include=current_inc,
                         exclude=exclude_args, ex_by=ex_bys,
-                        gitignore=gitignore)
-        files = results.get('files')
+                        gitignore=gitignore, jobs=jobs,
+                        ignore_case=ignore_case, use_index=use_index,
+                        cache_dir=cache_dir, quiet=False,
+                        result_file_fmt=(
+                            "geany {quoted_path} -l {line_n}  # < {line}"
+                        ),
+                        result_context_fmt=(
+                            "geany {quoted_path} -l {line_n}  # - {line}"
+                        ),
+                        max_count=max_count,
+                        files_with_matches=files_with_matches,
+                        count=count_only, before=before, after=after)
+        # ^ Not quiet, so each result is printed as soon as it is found.
         mb = results.get('read_mb')
-        assert files, "files is not set: {}".format(results)
-        for line in files:
-            colon1 = line.find(":")
-            colon2 = line.find(":", colon1+1)
-            if colon2 <= colon1:
-                raise RuntimeError(
-                    "The grep result must have the line for {}"
-                    " to work but doesn't have 2 colons: {}"
-                    "".format(me, line)
-                )
-            _line_n = line[colon1+1:colon2]
-            _file = line[:colon1]
-            print("geany {} -l {}  # < {}"
-                  "".format(quoted(_file), _line_n, line[colon2+1:]))
 
         echo0()
-        echo0("({} match(es))".format(len(files)))
-        total_count += len(files)
+        echo0("({} match(es))".format(results['line_count']))
+        total_count += results['line_count']
 
     if len(paths) > 0:
         echo0()
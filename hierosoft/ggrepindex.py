@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+'''
+Persistent file index for ggrep.
+
+Each index is an sqlite3 database (one per search root and set of
+filter options) in a cache directory (See default_cache_dir). For each
+file that filter_tree yields, it stores the size and mtime (in
+nanoseconds), whether the file is binary, and the set of trigrams (each
+run of 3 bytes, lowercased) in the file. A repeated ggrep call with
+use_index=True still walks the tree and stats each file, but only
+re-reads files whose size or mtime changed, skips binary files without
+opening them, and for a literal pattern only searches files that have
+every trigram in the pattern.
+'''
+from __future__ import print_function
+import hashlib
+import json
+import os
+import sqlite3
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from hierosoft import (
+    echo0,
+    echo1,
+)
+from hierosoft.sysdirs import sysdirs
+from hierosoft.ggrep import (
+    BINARY_SNIFF_SIZE,
+    is_binary_header,
+)
+
+INDEX_MAX_FILE_SIZE = 4 * 1024 * 1024
+# ^ Don't store trigrams for files larger than this (They are always
+#   searched), since finding trigrams is much slower than searching.
+
+INDEX_EXT = ".sqlite3"
+
+IndexedFile = namedtuple(
+    'IndexedFile',
+    ['size', 'mtime_ns', 'binary', 'candidate'],
+)
+# ^ candidate is False only if the file can't contain the needle (See
+#   may_contain).
+
+
+def default_cache_dir():
+    '''Get the default directory for ggrep index files.'''
+    return os.path.join(sysdirs['CACHES'], "hierosoft", "ggrep")
+
+
+def get_trigrams(data):
+    '''Get the trigrams in data, ignoring ASCII case.
+
+    Args:
+        data (bytes): Any content.
+
+    Returns:
+        array: The sorted unique trigrams, each packed into an int as
+            (byte0 << 16) | (byte1 << 8) | byte2.
+    '''
+    data = data.lower()
+    return array('I', sorted(
+        (a << 16) | (b << 8) | c
+        for a, b, c in set(zip(data, data[1:], data[2:]))
+    ))
+
+
+def may_contain(trigrams, needle_trigrams):
+    '''Check whether indexed content may contain a literal needle.
+
+    Args:
+        trigrams (array): The trigrams of the content (See
+            get_trigrams), or None if the content wasn't indexed.
+        needle_trigrams (array): The trigrams of the needle, or None to
+            always return True.
+
+    Returns:
+        bool: False only if the content definitely does not contain the
+            needle (ignoring ASCII case).
+    '''
+    if (needle_trigrams is None) or (trigrams is None):
+        return True
+    count = len(trigrams)
+    for trigram in needle_trigrams:
+        i = bisect_left(trigrams, trigram)
+        if (i == count) or (trigrams[i] != trigram):
+            return False
+    return True
+
+
+class GrepIndex(object):
+    '''An on-disk index of the files under one ggrep search root.
+
+    The whole index is read once (in one query) when opened, keeping
+    only each file's size, mtime, binary flag and whether it may contain
+    the needle, so checking an unchanged file doesn't query the
+    database.
+
+    Args:
+        root (str): The path given to ggrep.
+        options (dict, optional): Any options that affect which files
+            are yielded by filter_tree (such as include and exclude), so
+            that a different set of options uses a different index.
+        cache_dir (str, optional): Where to store index files. Defaults
+            to default_cache_dir().
+        needle_trigrams (array, optional): The trigrams of a literal
+            pattern (See get_trigrams), so that each IndexedFile's
+            candidate attribute can be determined.
+    '''
+    def __init__(self, root, options=None, cache_dir=None,
+                 needle_trigrams=None):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        self.root = root
+        self.cache_dir = cache_dir
+        self.needle_trigrams = needle_trigrams
+        key = json.dumps([os.path.abspath(root), options], sort_keys=True)
+        self.path = os.path.join(
+            cache_dir,
+            hashlib.sha1(key.encode("utf-8")).hexdigest() + INDEX_EXT,
+        )
+        self._conn = None
+        self._records = {}
+        self._seen = set()
+        self.changed_count = 0
+
+    def open(self):
+        if self._conn is not None:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER,"
+            " mtime_ns INTEGER,"
+            " binary INTEGER,"
+            " trigrams BLOB)"
+        )
+        echo1('* using ggrep index "{}"'.format(self.path))
+        self._records = {}
+        needle_trigrams = self.needle_trigrams
+        trigrams = array('I')
+        for path, size, mtime_ns, binary, blob in self._conn.execute(
+                "SELECT path, size, mtime_ns, binary, trigrams FROM files"):
+            candidate = True
+            if (needle_trigrams is not None) and (blob is not None):
+                del trigrams[:]
+                trigrams.frombytes(blob)
+                candidate = may_contain(trigrams, needle_trigrams)
+            self._records[path] = IndexedFile(size, mtime_ns, bool(binary),
+                                              candidate)
+
+    def close(self, prune=True):
+        '''Save the index.
+
+        Args:
+            prune (bool, optional): Remove files not refreshed since the
+                index was opened (Only set this if the whole tree was
+                walked).
+        '''
+        if self._conn is None:
+            return
+        if prune:
+            self._conn.executemany(
+                "DELETE FROM files WHERE path = ?",
+                ((path,) for path in self._records
+                 if path not in self._seen),
+            )
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+        self._records = {}
+        self._seen = set()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(prune=exc_type is None)
+
+    def refresh(self, path):
+        '''Get the record for a file, re-reading it only if changed.
+
+        Args:
+            path (str): A file yielded by filter_tree.
+
+        Returns:
+            IndexedFile: The current record.
+        '''
+        self.open()
+        self._seen.add(path)
+        st = os.stat(path)
+        record = self._records.get(path)
+        if (record is not None) and (record.size == st.st_size) and (
+                record.mtime_ns == st.st_mtime_ns):
+            return record
+        binary, trigrams = GrepIndex._read(path, st)
+        self.changed_count += 1
+        blob = None
+        if trigrams is not None:
+            blob = trigrams.tobytes()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files"
+            " (path, size, mtime_ns, binary, trigrams)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, int(binary), blob),
+        )
+        record = IndexedFile(st.st_size, st.st_mtime_ns, binary,
+                             may_contain(trigrams, self.needle_trigrams))
+        self._records[path] = record
+        return record
+
+    @staticmethod
+    def _read(path, st):
+        '''Get whether a file is binary and its trigrams (or None).'''
+        with open(path, 'rb') as ins:
+            header = ins.read(BINARY_SNIFF_SIZE)
+            if is_binary_header(header):
+                return True, None
+            if st.st_size > INDEX_MAX_FILE_SIZE:
+                return False, None
+            data = header + ins.read()
+        return False, get_trigrams(data)
+
+    def invalidate(self):
+        '''Delete this index (It is rebuilt by the next use).'''
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+            echo1('* removed "{}"'.format(self.path))
+
+
+def invalidate_indexes(cache_dir=None):
+    '''Delete every ggrep index in cache_dir.
+
+    Args:
+        cache_dir (str, optional): Defaults to default_cache_dir().
+
+    Returns:
+        int: How many index files were removed.
+    '''
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    count = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(INDEX_EXT):
+            continue
+        os.remove(os.path.join(cache_dir, name))
+        count += 1
+    echo0('* removed {} ggrep index file(s) from "{}"'
+          ''.format(count, cache_dir))
+    return count
@@ -447,15 +447,22 @@ class HierosoftUpdateFrame(HierosoftUpdate, ttk.Frame):
 
         For the generic event handler, use self.d_progress from superclass
         instead (to append an event to the event queue).
+
+        Events are already rate-limited (See ProgressAggregator) and
+        coalesced by _process_events, so redraw on each.
         """
-        if evt['loaded'] - self.shown_progress > 1000000:
+        if evt['loaded'] != self.shown_progress:
             self.shown_progress = evt['loaded']
+            if evt.get('total_size'):
+                self.pbar['maximum'] = evt['total_size']
             self.pbar['value'] = evt['loaded']
-            # print(evt['loaded'])
-            # evt['total'] is not implemented
-            self.count_label.config(
-                text="downloading...{}MB.".format(int(evt['loaded']/1024/1024))
-            )
+            text = "downloading...{}MB".format(int(evt['loaded']/1024/1024))
+            if evt.get('rate'):
+                text += " ({}MB/s".format(round(evt['rate']/1024/1024, 1))
+                if evt.get('eta') is not None:
+                    text += ", {}s left".format(int(evt['eta']))
+                text += ")"
+            self.count_label.config(text=text+".")
         if evt.get('status') == STATUS_DONE:
             echo0("Warning: Got status={} for progress."
                   " Set cb_done to something else and ensure"
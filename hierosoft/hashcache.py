@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+'''
+Persistent cache of file content hashes.
+
+The cache is an sqlite3 database (See default_cache_path) where each
+hash is keyed by the file's device, inode, size, mtime and ctime (in
+nanoseconds; ctime also changes if a file is rewritten with its old
+mtime restored) and the algorithm, so a file is only read again if it
+changed (or was replaced), and verifying an unchanged tree only stats
+each file. Several processes can use the same cache at once: new hashes
+and use times are kept in memory and written in one short transaction
+(See HashCache.flush), and sqlite3 waits for any other writer. The least
+recently used entries are removed once there are more than max_entries.
+'''
+from __future__ import print_function
+import os
+import sqlite3
+import time
+
+from hierosoft import (
+    echo0,
+    echo1,
+)
+from hierosoft.sysdirs import sysdirs
+from hierosoft.moreplatform import (
+    get_hexdigest,
+    get_hexdigests,
+)
+
+HASH_CACHE_MAX_ENTRIES = 200000
+
+HASH_CACHE_PENDING = 1000
+# ^ Write to the database after this many new hashes (See flush).
+
+HASH_CACHE_RACY_SECONDS = 2
+# ^ Don't cache the hash of a file changed this recently (by ctime),
+#   since it could change again without a different key (on
+#   filesystems with coarse timestamps).
+
+
+def default_cache_path():
+    '''Get the default hash cache database path.'''
+    return os.path.join(sysdirs['CACHES'], "hierosoft", "hashes.sqlite3")
+
+
+class HashCache(object):
+    '''A persistent cache of file hashes (See module documentation).
+
+    If the database can't be opened (such as if the cache directory is
+    read-only), a warning is shown and hashes are computed every time.
+
+    Args:
+        path (str, optional): The database file. Defaults to
+            default_cache_path().
+        max_entries (int, optional): Remove the least recently used
+            entries beyond this many when closed.
+
+    Attributes:
+        hit_count (int): Hashes that were found in the cache.
+        miss_count (int): Hashes that were computed.
+    '''
+    def __init__(self, path=None, max_entries=HASH_CACHE_MAX_ENTRIES):
+        if path is None:
+            path = default_cache_path()
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = None
+        self._disabled = False
+        self._pending = {}
+        self._used = set()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def open(self):
+        if (self._conn is not None) or self._disabled:
+            return
+        try:
+            parent = os.path.dirname(self.path)
+            if parent and not os.path.isdir(parent):
+                os.makedirs(parent)
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # ^ Readers in other processes don't wait for a writer.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                " dev INTEGER,"
+                " ino INTEGER,"
+                " size INTEGER,"
+                " mtime_ns INTEGER,"
+                " ctime_ns INTEGER,"
+                " algorithm TEXT,"
+                " hexdigest TEXT,"
+                " used REAL,"
+                " PRIMARY KEY (dev, ino, size, mtime_ns, ctime_ns,"
+                " algorithm))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS hashes_used ON hashes (used)"
+            )
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as ex:
+            echo0('Warning: hash cache "{}" is not available: {}'
+                  ''.format(self.path, ex))
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._disabled = True
+            return
+        echo1('* using hash cache "{}"'.format(self.path))
+
+    def close(self):
+        '''Save new hashes, evict old ones and close the database.'''
+        if self._conn is None:
+            return
+        self.flush()
+        try:
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM hashes").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM hashes WHERE rowid IN (SELECT rowid"
+                    " FROM hashes ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self._conn.commit()
+        except sqlite3.Error as ex:
+            echo0('Warning: could not evict from hash cache "{}": {}'
+                  ''.format(self.path, ex))
+        self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def flush(self):
+        '''Write new hashes and use times in one transaction.'''
+        if (self._conn is None) or not (self._pending or self._used):
+            return
+        now = time.time()
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO hashes (dev, ino, size,"
+                    " mtime_ns, ctime_ns, algorithm, hexdigest, used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key + (hexdigest, now)
+                     for key, hexdigest in self._pending.items()),
+                )
+                self._conn.executemany(
+                    "UPDATE hashes SET used = ? WHERE dev = ? AND ino = ?"
+                    " AND size = ? AND mtime_ns = ? AND ctime_ns = ?"
+                    " AND algorithm = ?",
+                    ((now,) + key for key in self._used),
+                )
+        except sqlite3.Error as ex:
+            echo0('Warning: could not write hash cache "{}": {}'
+                  ''.format(self.path, ex))
+        self._pending = {}
+        self._used = set()
+
+    @staticmethod
+    def _key(st, algorithm):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                st.st_ctime_ns, algorithm)
+
+    def _lookup(self, key):
+        '''Get the cached hex digest for key, or None.'''
+        hexdigest = self._pending.get(key)
+        if hexdigest is not None:
+            return hexdigest
+        self.open()
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute(
+                "SELECT hexdigest FROM hashes WHERE dev = ? AND ino = ?"
+                " AND size = ? AND mtime_ns = ? AND ctime_ns = ?"
+                " AND algorithm = ?",
+                key,
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        self._used.add(key)
+        return row[0]
+
+    def _store(self, key, hexdigest, st):
+        if self._disabled:
+            return
+        if time.time() - st.st_ctime < HASH_CACHE_RACY_SECONDS:
+            return
+        self._pending[key] = hexdigest
+        if len(self._pending) >= HASH_CACHE_PENDING:
+            self.flush()
+
+    def get_hexdigest(self, path, algorithm="md5", st=None):
+        '''Get a file's hash, only reading the file if not cached.
+
+        Args:
+            path (str): Any file.
+            algorithm (Optional[str]): See moreplatform.HASH_ALGORITHMS.
+            st (Optional[os.stat_result]): The stat of path (if already
+                known).
+
+        Returns:
+            str: The digest hex string.
+        '''
+        if st is None:
+            st = os.stat(path)
+        key = HashCache._key(st, algorithm)
+        hexdigest = self._lookup(key)
+        if hexdigest is not None:
+            self.hit_count += 1
+            return hexdigest
+        self.miss_count += 1
+        hexdigest = get_hexdigest(path, algorithm=algorithm)
+        self._store(key, hexdigest, st)
+        return hexdigest
+
+    def get_hexdigests(self, paths, algorithm="md5", jobs=None):
+        '''Get the hash of several files, reading only uncached ones.
+
+        Uncached files are hashed at once using threads (See
+        moreplatform.get_hexdigests).
+
+        Returns:
+            dict[str, str]: The digest hex string for each path.
+        '''
+        hexdigests = {}
+        misses = {}
+        for path in paths:
+            st = os.stat(path)
+            key = HashCache._key(st, algorithm)
+            hexdigest = self._lookup(key)
+            if hexdigest is not None:
+                self.hit_count += 1
+                hexdigests[path] = hexdigest
+            else:
+                misses[path] = (key, st)
+        self.miss_count += len(misses)
+        for path, hexdigest in get_hexdigests(list(misses),
+                                              algorithm=algorithm,
+                                              jobs=jobs).items():
+            key, st = misses[path]
+            self._store(key, hexdigest, st)
+            hexdigests[path] = hexdigest
+        return hexdigests
+
+    def same_hash(self, path1, path2, algorithm="md5"):
+        '''Check whether two files have the same content.
+
+        Files of different sizes differ without reading either, and the
+        hash of each file is only computed if not cached.
+
+        Returns:
+            bool: True if the hashes match.
+        '''
+        st1 = os.stat(path1)
+        st2 = os.stat(path2)
+        if st1.st_size != st2.st_size:
+            return False
+        return (self.get_hexdigest(path1, algorithm=algorithm, st=st1)
+                == self.get_hexdigest(path2, algorithm=algorithm, st=st2))
@@ -80,7 +80,10 @@ from hierosoft.morelogging import (
     human_readable,
 )
 
-from hierosoft.progresswriter import ProgressWriter
+from hierosoft.progresswriter import (
+    ProgressAggregator,
+    ProgressWriter,
+)
 
 logger = getLogger(__name__)
 
@@ -94,7 +97,8 @@ def decode_safe(b):
     return s
 
 
-def stream_urlopen(outs, ins, total=None, chunk_size=8192):
+def stream_urlopen(outs, ins, total=None, chunk_size=8192,
+                   cb_progress=None):
     """Download incrementally from one stream to another.
 
     Args:
@@ -103,23 +107,34 @@ def stream_urlopen(outs, ins, total=None, chunk_size=8192):
         total (int, optional): total bytes, only for showing progress.
             Defaults to None.
         chunk_size (int, optional): Chunk size. Defaults to 8192.
+        cb_progress (Callable, optional): Receives a progress snapshot
+            (See ProgressAggregator) with 'loaded' and 'total_size' at
+            a limited rate. Defaults to writing progress to stderr.
 
     Returns:
         int: size transferred
     """
-    size = 0
-    pw = ProgressWriter()
-    pw.hr_fn = human_readable
+    if cb_progress is None:
+        pw = ProgressWriter()
+        pw.hr_fn = human_readable
+
+        def cb_progress(evt):
+            pw.write(evt['loaded'], evt['total_size'])
+
+    progress = ProgressAggregator(
+        cb_progress,
+        evt={'loaded': 0, 'total_size': total},
+    )
     while True:
         chunk = ins.read(chunk_size)
         if not chunk:
+            progress.finish()
             sys.stderr.write("\nDone\n")
             sys.stderr.flush()
             break
         outs.write(chunk)
-        size += len(chunk)
-        pw.write(size, total)
-    return size
+        progress.add(len(chunk))
+    return progress.evt['loaded']
 
 
 class RepoState:
@@ -2,13 +2,24 @@
 from __future__ import print_function
 from __future__ import division
 
-from collections import OrderedDict
+from collections import (
+    OrderedDict,
+    deque,
+    namedtuple,
+)
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+)
 import json
 import os
 import platform
+import queue
 import shlex
 import shutil
+import stat
 import sys
+import threading
 import time
 # import uuid
 import zipfile
@@ -26,15 +37,18 @@ from hierosoft import (
     sysdirs,
 )
 
+from hierosoft.hashcache import HashCache
 from hierosoft.moreplatform import (
     # get_digest,
-    get_hexdigest,
+    fast_copy,
+    is_unchanged,
     zip_dir,
 )
 
 from hierosoft.logging2 import (
     utcnow,
 )
+from hierosoft.progresswriter import ProgressAggregator
 
 
 def best_timer_ms():
@@ -57,15 +71,268 @@ def best_timer_sec():
 #         return float(best_timer_ms()) / 1000.0
 
 
+OP_MKDIR = "mkdir"
+OP_COPY = "copy"
+OP_SKIP = "skip"
+OP_UNCHANGED = "unchanged"  # A file already the same in dst
+OP_RM = "rm"  # A file in dst but not src
+OP_RMTREE = "rmtree"  # A directory in dst but not src
+OP_UNLINK = "unlink"  # A symlink in dst but not src
+OP_RMDIR = "rmdir"  # A directory in dst emptied since not in src
+
+InstallOp = namedtuple(
+    'InstallOp',
+    ['op', 'rel', 'size', 'mode', 'note'],
+    defaults=(0, None, None),
+)
+# ^ One step of an install (See HInstaller.manifest): op is an OP_*
+#   constant, rel is relative to both src_root and dst_root (or is an
+#   absolute destination path), size is in bytes, mode is st_mode of the
+#   source (or the destination for OP_RMDIR), and note is the commented
+#   log line for OP_SKIP, the link target for OP_UNLINK or the file count
+#   for OP_RMTREE.
+
+
+PENDING_PER_JOB = 4
+# ^ How many copies (per thread) run_manifest queues ahead of the log.
+
+LOG_BATCH_LINES = 256
+LOG_BATCH_MS = 1000
+# ^ BatchedLog defaults: Write buffered log lines after this many lines
+#   or milliseconds (whichever is first).
+
+UNDO_ZIP = "zip"  # Back up deleted files into a zip file
+UNDO_LINK = "link"  # Hard-link deleted files into a directory
+UNDO_MOVE = "move"  # Rename deleted files into a directory
+UNDO_METHODS = (UNDO_ZIP, UNDO_LINK, UNDO_MOVE)
+
+UNDO_COMPRESSIONS = {
+    'store': (zipfile.ZIP_STORED, None),
+    'deflate': (zipfile.ZIP_DEFLATED, 1),
+    'lzma': (zipfile.ZIP_LZMA, None),
+}
+# ^ (compression, compresslevel) for UndoArchive with UNDO_ZIP
+
+UNDO_QUEUE_SIZE = 64
+# ^ How many removals can wait for the UndoArchive writer thread.
+
+STAGE_SUFFIX = ".staging"
+ROLLBACK_SUFFIX = ".old"
+# ^ For meta['staged']: The new tree is built in dst_root+STAGE_SUFFIX,
+#   and the previous one is kept as dst_root+ROLLBACK_SUFFIX.
+
+
+def link_or_copy(src, dst):
+    '''Hard-link src to dst, or copy it if a link isn't possible.
+
+    Symlinks are linked or copied as symlinks. This can be used as
+    copy_function for shutil.copytree.
+    '''
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except OSError:
+        shutil.copy2(src, dst, follow_symlinks=False)
+    return dst
+
+
+class BatchedLog(object):
+    """Buffer lines for a log and write them in batches.
+
+    Lines are written to the stream after max_lines lines or max_ms
+    milliseconds (checked on each write), or when flush or sync is
+    called, instead of flushing the stream once per line.
+
+    Args:
+        stream (file): An open text file (or other file-like object).
+        max_lines (Optional[int]): Defaults to LOG_BATCH_LINES.
+        max_ms (Optional[float]): Defaults to LOG_BATCH_MS.
+    """
+    def __init__(self, stream, max_lines=LOG_BATCH_LINES,
+                 max_ms=LOG_BATCH_MS):
+        self.stream = stream
+        self.max_lines = max_lines
+        self.max_ms = max_ms
+        self._lines = []
+        self._flushed_ms = best_timer_ms()
+
+    @property
+    def closed(self):
+        return self.stream.closed
+
+    def write(self, line):
+        self._lines.append(line)
+        if ((len(self._lines) >= self.max_lines)
+                or (best_timer_ms() - self._flushed_ms >= self.max_ms)):
+            self.flush()
+
+    def flush(self):
+        '''Write all buffered lines and flush the stream.'''
+        if self._lines:
+            self.stream.write("".join(self._lines))
+            self._lines = []
+        self.stream.flush()
+        self._flushed_ms = best_timer_ms()
+
+    def sync(self):
+        '''Flush, then make sure the OS wrote the file (if it is one).'''
+        self.flush()
+        try:
+            os.fsync(self.stream.fileno())
+        except (AttributeError, OSError):
+            pass  # Not a real file (such as io.StringIO)
+
+
+class UndoArchive(object):
+    """Back up files or directories then delete them.
+
+    With UNDO_ZIP, each removal is queued (up to queue_size, so the
+    caller only waits if the writer falls behind) for a background
+    thread, which writes it to the zip file then deletes it. With
+    UNDO_LINK or UNDO_MOVE, it is hard-linked or renamed into the
+    directory instead, so no bytes are copied if the directory is on the
+    same volume (otherwise it is copied).
+
+    Args:
+        path (str): The zip file (UNDO_ZIP) or the directory (created
+            when first needed).
+        method (Optional[str]): UNDO_ZIP, UNDO_LINK or UNDO_MOVE.
+        compression (Optional[str]): A key in UNDO_COMPRESSIONS (UNDO_ZIP
+            only).
+        queue_size (Optional[int]): Defaults to UNDO_QUEUE_SIZE.
+
+    Raises:
+        ValueError: Unknown method or compression.
+    """
+    def __init__(self, path, method=UNDO_ZIP, compression="store",
+                 queue_size=UNDO_QUEUE_SIZE):
+        if method not in UNDO_METHODS:
+            raise ValueError("method should be one of {} (got {})"
+                             "".format(UNDO_METHODS, repr(method)))
+        if compression not in UNDO_COMPRESSIONS:
+            raise ValueError("compression should be one of {} (got {})"
+                             "".format(list(UNDO_COMPRESSIONS),
+                                       repr(compression)))
+        self.path = path
+        self.method = method
+        self.compression = compression
+        self.queue_size = queue_size
+        self._zip = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+    def __enter__(self):
+        return self  # See open (called by remove when first needed)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if (self.method != UNDO_ZIP) or (self._zip is not None):
+            return
+        compression, level = UNDO_COMPRESSIONS[self.compression]
+        kwargs = {}
+        if level is not None:
+            kwargs['compresslevel'] = level
+        self._zip = zipfile.ZipFile(self.path, 'w', compression=compression,
+                                    **kwargs)
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = threading.Thread(target=self._write_queued,
+                                        name="UndoArchive")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        '''Finish all removals (See wait) and close the zip file.'''
+        if self._zip is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._zip.close()
+        self._zip = None
+        self._raise_error()
+
+    def wait(self):
+        '''Wait until all queued removals are done.'''
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_error()
+
+    def discard(self):
+        '''Delete the archive (such as if nothing was backed up).'''
+        self.close()
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def _raise_error(self):
+        error = self._error
+        if error is not None:
+            self._error = None
+            raise error
+
+    def _write_queued(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    # ^ After an error, keep getting (so put doesn't
+                    #   block) but don't delete anything else.
+                    path, arcname = item
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        zip_dir(self._zip, path, arcname)
+                        shutil.rmtree(path)
+                    else:
+                        self._zip.write(path, arcname)
+                        os.remove(path)
+            except Exception as ex:
+                self._error = ex
+            finally:
+                self._queue.task_done()
+
+    def remove(self, path, arcname):
+        '''Back up a file or directory then delete it.
+
+        With UNDO_ZIP, this may happen later (See wait).
+
+        Args:
+            path (str): The file or directory to delete.
+            arcname (str): The relative path to use in the archive.
+        '''
+        self._raise_error()
+        if self.method == UNDO_ZIP:
+            self.open()
+            self._queue.put((path, arcname))
+            return
+        backup = os.path.join(self.path, arcname)
+        parent = os.path.dirname(backup)
+        os.makedirs(parent, exist_ok=True)  # may race with other threads
+        if self.method == UNDO_MOVE:
+            shutil.move(path, backup)
+            # ^ A rename unless on another volume
+        elif os.path.isdir(path) and not os.path.islink(path):
+            shutil.copytree(path, backup, symlinks=True,
+                            copy_function=link_or_copy)
+            shutil.rmtree(path)
+        else:
+            link_or_copy(path, backup)
+            os.remove(path)
+
+
 def console_callback(evt):
-    count = evt.get('done_bytes')
-    total = evt.get('total_bytes')
+    count = evt.get('bytes_done')
+    total = evt.get('bytes_total')
     sys.stderr.write("\r")
     if total and total > 0 and count:
         ratio = float(count) / float(total)
         sys.stderr.write(
             "{}/{} ({}%) ".format(count, total, round(ratio*100, 1))
         )
+        if evt.get('eta') is not None:
+            sys.stderr.write("{}s left ".format(int(evt['eta'])))
     error = evt.get('error')
     message = evt.get('message')
     if error:
@@ -92,9 +359,51 @@ class HInstaller:
               directories to leave intact if in dst. Each must be
               relative to src (and not start with "/", nor start with
               backslash nor "{}:" on Windows where {} is a letter)!
+            - 'verify_hash' (bool, optional): If a file in dst is the
+              same size as in src but has a different mtime, compare
+              the content to check whether it is unchanged (Defaults
+              to True; If False, it is copied). Unchanged files are not
+              copied but are logged as "# unchanged".
+            - 'hash_cache' (bool, optional): For 'verify_hash',
+              install() looks up and stores hashes in the persistent
+              cache (See hierosoft.hashcache), so re-verifying an
+              unchanged file only stats it (Defaults to True).
+            - 'undo_method' (str, optional): How install() backs up
+              files it deletes (See UndoArchive): UNDO_ZIP (default;
+              into "removed.zip" in undo_root), UNDO_LINK or UNDO_MOVE
+              (into "removed" in undo_root; fastest if on the same
+              volume as dst).
+            - 'undo_compression' (str, optional): A key in
+              UNDO_COMPRESSIONS ("store" (default), "deflate" or
+              "lzma") for UNDO_ZIP.
+            - 'staged' (bool, optional): For the real install (which
+              then requires a simulated one first), build the new tree
+              in dst_root+STAGE_SUFFIX (starting with hard links to the
+              files in dst_root) then swap it into place by renaming,
+              so dst_root is never partly installed. The previous tree
+              is kept as dst_root+ROLLBACK_SUFFIX (See rollback)
+              instead of backing up deleted files.
 
     Attributes:
         undo_root (Optional[str]): Where to place deleted files
+        undo_archive (Optional[UndoArchive]): If not None, deleted files
+            are backed up here (install() sets it).
+        hash_cache (Optional[HashCache]): If not None, used to compare
+            content for 'verify_hash' (install() sets it).
+        stage_root (Optional[str]): The directory being built during a
+            staged install (See 'staged'), otherwise None.
+        manifest (Optional[list[InstallOp]]): Every step of the install,
+            in order, as determined by the simulated install (The real
+            install runs these directly instead of walking src again).
+        progress (Optional[ProgressAggregator]): Sends progress to the
+            callback during _install (at most every PROGRESS_INTERVAL
+            seconds, with 'rate' and 'eta' added).
+        ops_log (Optional[BatchedLog]): If not None, each step is also
+            written here (once done) as one line of JSON with 'op',
+            'path' (in dst), 'size' and (for a copy) 'strategy' (See
+            fast_copy), so that uninstall tools can read the steps
+            without parsing the shell-style log (install() writes it to
+            meta['install_manifest']).
 
     Raises:
         ValueError: Blank value or absolute path in keeps
@@ -104,10 +413,11 @@ class HInstaller:
         self.finalized = False
         self.started = False
         self.simulate = True
-        self.last_update_sec = None
         self.finalized_simulated = False
         self.luid_meta_dir = None
         self.undo_root = None
+        self.ops_log = None
+        self.progress = None
         # self.parent_estimates = OrderedDict()
         # self.estimates = OrderedDict()
         self.delete_bytes_total = 0
@@ -170,7 +480,16 @@ class HInstaller:
         self.dst_root = roots['dst']
         self.keeps = keeps
         self.rmdir_lines = None
-        self.undo_zip = None
+        self.undo_archive = None
+        self.hash_cache = None
+        self.stage_root = None
+        self.src_listings = {}
+        self.queued_removals = set()
+        self.manifest = None
+
+    @property
+    def rollback_root(self):
+        return self.dst_root + ROLLBACK_SUFFIX
 
     @property
     def src_root_slash(self):
@@ -184,7 +503,7 @@ class HInstaller:
             return self.dst_root
         return self.dst_root + os.path.sep
 
-    def install(self, callback=None, evt=None):
+    def install(self, callback=None, evt=None, simulate=True, jobs=None):
         """Install the program.
 
         Uses self.meta['organization'] as parent dir for luid and
@@ -196,9 +515,19 @@ class HInstaller:
                 set, assume a failure. Defaults to None.
             evt (Optional[str]): Template for events sent to callback
                 (also returned such as for synchronous operation).
+            simulate (bool, optional): Only determine what to do (and
+                the total size) and write logs. Run again with False
+                to install (using self.manifest if already simulated).
+            jobs (Optional[int]): How many files to copy at once if
+                already simulated (See run_manifest).
 
         Returns:
             dict: same dict sent to callback if, with ['status'] = "done"
+                and 'bytes_copied' (or to copy, if simulate),
+                'bytes_unchanged' and 'unchanged_count' (See
+                'verify_hash' in the class documentation), and
+                'copy_strategies' (how many files were copied using each
+                fast_copy strategy).
         """
         luid = self.meta.get('luid')
         if not luid:
@@ -253,18 +582,41 @@ class HInstaller:
         install_log = self.undo_root + ".log"
         uninstall_script = self.undo_root + "-uninstall.sh"
         self.meta['uninstall_script'] = uninstall_script
-        self.undo_zip = None
-        self.undo_arc_path = os.path.join(self.undo_root, "removed.zip")
+        self.meta['install_manifest'] = self.undo_root + ".jsonl"
+        undo_method = self.meta.get('undo_method', UNDO_ZIP)
+        if undo_method == UNDO_ZIP:
+            self.undo_arc_path = os.path.join(self.undo_root, "removed.zip")
+        else:
+            self.undo_arc_path = os.path.join(self.undo_root, "removed")
+        self.undo_archive = UndoArchive(
+            self.undo_arc_path,
+            method=undo_method,
+            compression=self.meta.get('undo_compression', "store"),
+        )
         with open(install_log, 'w') as redo:
             with open(uninstall_script, 'w') as undo:
-                with zipfile.ZipFile(self.undo_arc_path, 'w') as self.undo_zip:
-                    result = self._install(
-                        undo=undo,
-                        redo=redo,
-                        callback=callback,
-                        evt=evt,
-                    )
-        if 'size' not in self.meta:
+                with open(self.meta['install_manifest'], 'w') as ops_log:
+                    self.ops_log = BatchedLog(ops_log)
+                    if self.meta.get('hash_cache', True):
+                        self.hash_cache = HashCache()
+                    with self.undo_archive:
+                        try:
+                            result = self._install(
+                                undo=undo,
+                                redo=redo,
+                                callback=callback,
+                                evt=evt,
+                                simulate=simulate,
+                                jobs=jobs,
+                            )
+                        finally:
+                            self.ops_log = None
+                            if self.hash_cache is not None:
+                                self.hash_cache.close()
+                                self.hash_cache = None
+        if simulate:
+            pass  # Nothing was installed yet.
+        elif 'size' not in self.meta:
             self.meta['size'] = self.bytes_total
         else:
             # It must be an upgrade, so calculate delta
@@ -274,12 +626,12 @@ class HInstaller:
         if self.deletes_total < 1:
             # There were no files to backup, so delete backup archive
             # (even if simulate since it is a zip of files to delete):
-            os.remove(self.undo_arc_path)
+            self.undo_archive.discard()
         # Do *not* run after_install until *2nd* run (simulate=False)
         return result
 
     def _install(self, undo=None, redo=None, evt=None, simulate=True,
-                 callback=None):
+                 callback=None, jobs=None):
         '''
         See "install" method documentation for more information.
 
@@ -297,6 +649,7 @@ class HInstaller:
                 open if undo_root.
             simulate (bool, optional): Skip actual file operations (only
                 write install script). Defaults to True!
+            jobs (Optional[int]): See run_manifest.
         '''
 
         if self.started:
@@ -313,10 +666,14 @@ class HInstaller:
         #  size (of delete) doesn't matter for calculating progress
         self.bytes_done = 0
         self.deletes_done = 0
-        self.last_update_sec = None
         self.match_count = 0
         self.add_count = 0
         self.file_count = 0
+        self.unchanged_count = 0
+        self.unchanged_bytes = 0
+        self.copy_strategies = {}
+        self.src_listings = {}
+        self.queued_removals = set()
         if simulate:
             self.matches = set()
             self.bytes_total = 0
@@ -334,9 +691,29 @@ class HInstaller:
                                  ''.format(evt.get('bytes_total')))
 
         self.undo = undo
+        if (undo is not None) and not isinstance(undo, BatchedLog):
+            self.undo = BatchedLog(undo)
         self.redo = redo
+        if (redo is not None) and not isinstance(redo, BatchedLog):
+            self.redo = BatchedLog(redo)
         self.simulate = simulate
         self.callback = callback
+        try:
+            return self._install_steps(evt, simulate, callback, jobs)
+        finally:
+            self.progress = None
+            self.sync_logs()
+            # ^ A phase boundary (or an error), so make sure the logs
+            #   are complete on disk.
+
+    def sync_logs(self):
+        '''Write any buffered log lines to disk (See BatchedLog.sync).'''
+        for log in (self.redo, self.undo, self.ops_log):
+            if (log is not None) and not log.closed:
+                log.sync()
+
+    def _install_steps(self, evt, simulate, callback, jobs):
+        '''Do the part of _install that uses the logs.'''
 
         result_path = None
         warning = None
@@ -367,6 +744,7 @@ class HInstaller:
         # ^ max 32-bit signed int is ~ 1.9999 Gigabytes if unit is bytes
         if simulate:
             callback({'message': "Estimating size..."})
+            self.manifest = []
 
         # self.copytree(src, dst)
 
@@ -374,7 +752,27 @@ class HInstaller:
             'bytes_done': self.bytes_done,
             'bytes_total': self.bytes_total,
         })
-        results = self.copytree(src, dst, callback=callback, evt=evt)
+        self.progress = ProgressAggregator(
+            callback,
+            evt=evt,
+            done_key='bytes_done',
+            total_key='bytes_total',
+            refresh=self._refresh_event,
+        )
+        if (not simulate) and self.meta.get('staged'):
+            if self.manifest is None:
+                raise RuntimeError("A staged install must be simulated"
+                                   " first (run with simulate=True).")
+            results = self.run_staged(callback=callback, evt=evt,
+                                      jobs=jobs)
+        elif (not simulate) and (self.manifest is not None):
+            # Already simulated, so don't walk src (nor stat) again.
+            results = self.run_manifest(callback=callback, evt=evt,
+                                        jobs=jobs)
+        else:
+            if not os.path.isdir(dst):
+                self._apply(InstallOp(OP_MKDIR, ""), evt=evt)
+            results = self.copytree(src, dst, callback=callback, evt=evt)
         if results.get('error'):
             evt.update(results)
             callback(evt)
@@ -413,10 +811,15 @@ class HInstaller:
                     warning += "; " + sc_warning
                 else:
                     warning = sc_warning
+        self.update_event(evt, "bytes")
         evt.update({
             'dst': dst,
             'warning': warning,
             'status': "done",
+            'bytes_copied': self.get_size(),
+            'bytes_unchanged': self.unchanged_bytes,
+            'unchanged_count': self.unchanged_count,
+            'copy_strategies': dict(self.copy_strategies),
         })
 
         callback(evt)
@@ -454,8 +857,9 @@ class HInstaller:
             self.bytes_total += byte_count
         else:
             self.bytes_done += byte_count
-        if evt:
+        if evt and ((self.progress is None) or (evt is not self.progress.evt)):
             self.update_event(evt, "bytes")
+            # ^ Otherwise self.progress does it only when sending.
 
     def get_removed(self):
         return self.deletes_total if self.simulate else self.deletes_done
@@ -479,7 +883,8 @@ class HInstaller:
         return evt
 
     def install_file(self, src_path, dst_path, allow_external_src=False,
-                     allow_external_dst=False, evt=None):
+                     allow_external_dst=False, evt=None, size=None,
+                     mode=None, copied=False, strategy=None):
         '''Handle a directory listing during install.
         This must be compatible with the "ignore" option of
         shutil.copytree
@@ -496,11 +901,29 @@ class HInstaller:
             dst_path (str): The full destination file path.
             allow_external_src (Optional[bool]): Whether to allow
                 installing files not in self.src_root
+            size (Optional[int]): The size of src_path if already known
+                (such as from self.manifest).
+            mode (Optional[int]): The st_mode of src_path (without
+                following symlinks) if already known.
+            copied (Optional[bool]): The file was already copied (such
+                as by a worker thread in run_manifest), so only log it
+                and count its size.
+            strategy (Optional[str]): How it was copied if copied (See
+                fast_copy).
+
+        Returns:
+            Optional[str]: How it was copied (a COPY_* constant from
+                moreplatform; None if simulate). Each is also counted
+                in self.copy_strategies.
         '''
         cmd = "cp"
         path1 = src_path
         args = "-f"
-        if os.path.islink(src_path):
+        if mode is None:
+            is_link = os.path.islink(src_path)
+        else:
+            is_link = stat.S_ISLNK(mode)
+        if is_link:
             # path1 = os.readlink(src_path)
             # cmd = "ln"
             # args = "--preserve=links"
@@ -513,10 +936,14 @@ class HInstaller:
             path1,
             dst_path
         ]))
-        if not self.simulate:
-            shutil.copy2(src_path, dst_path, follow_symlinks=False)
-            # follow_symlinks=False copies symlinks as symlinks
-        self.increment_size(os.path.getsize(src_path), evt=evt)
+        if not (self.simulate or copied):
+            strategy = self._copy_file(src_path, dst_path)
+        if strategy is not None:
+            self.copy_strategies[strategy] = \
+                self.copy_strategies.get(strategy, 0) + 1
+        if size is None:
+            size = os.path.getsize(src_path)
+        self.increment_size(size, evt=evt)
         # if callback:
         #     callback(evt)
 
@@ -536,13 +963,11 @@ class HInstaller:
         if not line.endswith("\n"):
             line += "\n"
         self.redo.write(line)
-        self.redo.flush()
 
     def append_undo(self, line):
         if not line.endswith("\n"):
             line += "\n"
         self.undo.write(line)
-        self.undo.flush()
 
     def get_op_vars(self, src_root, dst_root, rel=None,
                     allow_external_src=False, allow_external_dst=False,
@@ -664,34 +1089,28 @@ class HInstaller:
                 if (os.path.isfile(vars['src_path'])
                         and os.path.isfile(vars['dst_path'])
                         and not os.path.islink(vars['src_path'])):
-                    if vars['dst_rel'] not in self.matches:
-                        src_size = os.path.getsize(vars['src_path'])
-                        dst_size = os.path.getsize(vars['dst_path'])
-                        # src_ts = os.path.getmtime(vars['src_path'])
-                        # dst_ts = os.path.getmtime(vars['dst_path'])
-                        # ^ varies (extraction changes time)
-                        # src_time = time.ctime(src_ts)
-                        # src_dt = datetime.fromtimestamp(src_ts)
-                        # ct is ctime, as in datetime.from
-                        src_hash = get_hexdigest(vars['src_path'])
-                        dst_hash = get_hexdigest(vars['dst_path'])
-                    else:
+                    if vars['dst_rel'] in self.matches:
                         # force a match (simulate mode already matched it)
-                        src_size = None
-                        dst_size = None
-                        src_hash = None
-                        dst_hash = None
-                    if (src_size == dst_size) and (src_hash == dst_hash):
-                        # and (src_ts == dst_ts):
+                        unchanged = True
+                    else:
+                        unchanged = is_unchanged(
+                            vars['src_path'],
+                            vars['dst_path'],
+                            verify_hash=self.meta.get('verify_hash', True),
+                            hash_cache=self.hash_cache,
+                        )
+                        # ^ mtime is compared first, but it varies
+                        #   (extraction changes time), so the content is
+                        #   compared if mtime doesn't match.
+                    if unchanged:
                         if self.simulate:
                             self.matches.add(vars['dst_rel'])
                         vars['mode'] = "skip"
                         vars['hide'] = True
+                        vars['unchanged'] = True
                         self.match_count += 1
                         if 'warning' in vars:
                             del vars['warning']
-                        # vars['src_ts'] = src_ts
-                        # vars['dst_ts'] = dst_ts
         return vars
 
     def copytree(self, src_root, dst_root, rel=None, symlinks=True,
@@ -744,8 +1163,6 @@ class HInstaller:
         dir_count = 0
         folder_size = 0
 
-        update_delay = 0.5  # seconds
-
         for sub in os.listdir(src_parent_path):
             sub_rel = sub
             if rel is not None:
@@ -774,11 +1191,7 @@ class HInstaller:
                     callback=callback,
                 )
 
-            if ((self.last_update_sec is None)
-                    or (best_timer_sec() - self.last_update_sec
-                        > update_delay)):
-                callback(evt)  # auto-updated by self.increment_*
-                self.last_update_sec = best_timer_sec()
+            self._progress(callback, evt)
             vars = self.get_op_vars(
                 src_root,
                 dst_root,
@@ -796,6 +1209,10 @@ class HInstaller:
                 if not self.finalized_simulated:
                     self.issues.append(vars)
             pre = ""
+            if vars.get('unchanged'):
+                self._apply(InstallOp(OP_UNCHANGED, sub_rel,
+                                      vars['src_size']), evt=evt)
+                continue
             if vars.get('hide'):
                 # Do not log, copy, nor recurse.
                 continue
@@ -823,23 +1240,35 @@ class HInstaller:
                     cmd = "ln"
                     args = "-s"
                     path1 = os.readlink(src_path)
-                self.append_install(pre+shlex.join([
-                    cmd,
-                    args,
-                    path1,
-                    vars['dst_path'],
-                ])+'  # {}'.format(msg))
+                self._apply(InstallOp(OP_SKIP, sub_rel, note=(
+                    pre+shlex.join([
+                        cmd,
+                        args,
+                        path1,
+                        vars['dst_path'],
+                    ])+'  # {}'.format(msg)
+                )))
                 # Do *not* call self.increment_size
                 continue
 
             if os.path.isfile(src_path):
                 prev_done = self.get_size()
-                copy_function(src_path, dst_path, evt=evt)
+                if copy_function == self.install_file:
+                    self._apply(InstallOp(
+                        OP_COPY,
+                        sub_rel,
+                        os.path.getsize(src_path),
+                        os.lstat(src_path).st_mode,
+                    ), evt=evt)
+                else:
+                    copy_function(src_path, dst_path, evt=evt)
                 folder_size += self.get_size() - prev_done
 
                 # ^ writes redo line, and if copies (or simulation), undo line
                 file_count += 1
                 continue
+            if not os.path.isdir(dst_path):
+                self._apply(InstallOp(OP_MKDIR, sub_rel), evt=evt)
             self.copytree(src_root, dst_root, sub_rel, symlinks=symlinks,
                           ignore=ignore, copy_function=copy_function,
                           ignore_dangling_symlinks=ignore_dangling_symlinks,
@@ -850,6 +1279,403 @@ class HInstaller:
         return evt
         # self
 
+    def _progress(self, callback, evt):
+        '''Send a snapshot of evt to callback if it is time.
+
+        See self.progress (It is replaced if callback or evt differ).
+        '''
+        progress = self.progress
+        if ((progress is None) or (progress.callback is not callback)
+                or (progress.evt is not evt)):
+            progress = ProgressAggregator(
+                callback,
+                evt=evt,
+                done_key='bytes_done',
+                total_key='bytes_total',
+                refresh=self._refresh_event,
+            )
+            self.progress = progress
+        progress.update()
+
+    def _refresh_event(self, evt):
+        '''Copy the byte counters to evt (See ProgressAggregator).'''
+        self.update_event(evt, "bytes")
+
+    def _apply(self, op, evt=None, copied=False, strategy=None):
+        '''Log one step of the install and, unless simulate, do it.
+
+        If simulate, the step is also added to self.manifest (if not
+        None) so the real install can run it without scanning again.
+
+        Args:
+            op (InstallOp): The step, relative to self.src_root and
+                self.dst_root.
+            evt (Optional[dict]): The event template to update.
+            copied (Optional[bool]): The file operation was already done
+                (such as by a worker thread in run_manifest; See
+                install_file and _remove), so only log and count it.
+            strategy (Optional[str]): For OP_COPY, how it was copied if
+                copied (See install_file).
+        '''
+        if self.simulate and (self.manifest is not None):
+            self.manifest.append(op)
+        dst_path = os.path.join(self.dst_root, op.rel)
+        path = self._staged_path(dst_path)  # where to actually do it
+        if (op.op in (OP_COPY, OP_MKDIR)) and not (self.simulate or copied):
+            self._wait_for_removal(dst_path)
+        if op.op == OP_COPY:
+            strategy = self.install_file(
+                os.path.join(self.src_root, op.rel),
+                dst_path,
+                evt=evt,
+                size=op.size,
+                mode=op.mode,
+                copied=copied,
+                strategy=strategy,
+            )
+        elif op.op == OP_MKDIR:
+            self.append_install(shlex.join(["mkdir", "-p", dst_path]))
+            if not self.simulate:
+                os.makedirs(path, exist_ok=True)
+            self.rmdir_lines.append(shlex.join(["rmdir", dst_path])+"\n")
+        elif op.op == OP_SKIP:
+            self.append_install(op.note)
+        elif op.op == OP_UNCHANGED:
+            self.append_install("# "+shlex.join([
+                "cp",
+                "-f",
+                os.path.join(self.src_root, op.rel),
+                dst_path,
+            ])+"  # unchanged")
+            self.unchanged_count += 1
+            self.unchanged_bytes += op.size
+        elif op.op == OP_RM:
+            self.append_install(shlex.join(["rm", "-f", dst_path]))
+            self.increment_removed(byte_count=op.size, evt=evt)
+            if not (self.simulate or copied):
+                self._remove(op)
+        elif op.op == OP_RMTREE:
+            self.append_install(shlex.join(["rm", "-rf", dst_path]))
+            count = op.note
+            if not (self.simulate or copied):
+                self._remove(op)
+            self.increment_removed(count=count, evt=evt,
+                                   byte_count=op.size)
+        elif op.op == OP_UNLINK:
+            self.append_install(shlex.join(["rm", "-f", dst_path]))
+            self.increment_removed(evt=evt)
+            # ^ byte_count=0
+            if not (self.simulate or copied):
+                self._remove(op)
+            self.append_undo(shlex.join(["ln", "-s", op.note, dst_path]))
+        elif op.op == OP_RMDIR:
+            if not stat.S_ISLNK(op.mode):
+                self.append_install(shlex.join(["rmdir", dst_path]))
+            else:
+                self.append_install(shlex.join([
+                    "rm",
+                    "-f",
+                    dst_path,
+                ])+"  # directory symlink (*not* recursive delete!)")
+            if not (self.simulate or copied):
+                self._remove(op)
+            self.increment_removed(evt=evt)
+            # ^ byte_count=0
+        else:
+            raise ValueError("Unknown install op: {}".format(op.op))
+        if self.ops_log is not None:
+            record = {'op': op.op, 'path': dst_path, 'size': op.size}
+            if strategy is not None:
+                record['strategy'] = strategy
+            self.ops_log.write(json.dumps(record, separators=(",", ":"))
+                               + "\n")
+
+    def _remove(self, op):
+        '''Do the file operation of a delete step (See _apply).
+
+        This is thread-safe except for OP_RMDIR (which must wait for
+        other removals in its directory).
+        '''
+        dst_path = os.path.join(self.dst_root, op.rel)
+        path = self._staged_path(dst_path)
+        if op.op == OP_UNLINK:
+            os.unlink(path)  # deletes link *not* target
+        elif op.op == OP_RMDIR:
+            if self.undo_archive:
+                self.undo_archive.wait()
+                # ^ Ensure queued removals emptied it.
+            if stat.S_ISLNK(op.mode):
+                os.unlink(path)
+            else:
+                os.rmdir(path)
+        elif self.undo_archive and (self.stage_root is None):
+            self.undo_archive.remove(dst_path, self._undo_sub(dst_path))
+            if self.undo_archive.method == UNDO_ZIP:
+                self.queued_removals.add(dst_path)  # See _wait_for_removal
+        elif op.op == OP_RMTREE:
+            shutil.rmtree(path)
+        elif op.op == OP_RM:
+            os.remove(path)
+        else:
+            raise ValueError("Not a delete op: {}".format(op.op))
+
+    def _wait_for_removal(self, dst_path):
+        '''Wait for queued removals if dst_path is or is under one.
+
+        A path in src can be deleted from dst if its type changed (such
+        as a file that is now a directory), so it must be gone before
+        the step that creates it again.
+        '''
+        if not self.queued_removals:
+            return
+        for removed in self.queued_removals:
+            if (dst_path == removed) or dst_path.startswith(
+                    removed + os.path.sep):
+                self.undo_archive.wait()
+                self.queued_removals.clear()
+                return
+
+    def run_manifest(self, callback=None, evt=None, jobs=None):
+        '''Run each step in self.manifest (See _apply).
+
+        If jobs > 1, files are deleted by a pool of threads (See
+        _run_removals), then all directories are created (in order),
+        then files are copied by the pool. Deletes must finish first
+        since a path in src is also deleted from dst if its type changed
+        (such as a file that is now a directory). Only the file
+        operations are done by the threads: Each step is logged (and
+        each copy's size counted) by this thread in manifest order once
+        it is done, so the logs are the same as if jobs were 1, and
+        progress is only updated by this thread.
+
+        Args:
+            callback (Optional[callable]): Called with a snapshot of
+                evt at most every PROGRESS_INTERVAL seconds (See
+                self.progress).
+            evt (Optional[dict]): The event template to update.
+            jobs (Optional[int]): How many files to copy at once. If 0,
+                use os.cpu_count(). If None or 1, copy one at a time.
+
+        Returns:
+            dict: evt
+        '''
+        if callback is None:
+            callback = self.callback
+        if evt is None:
+            evt = {}
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        if (jobs is None) or (jobs < 2):
+            for op in self.manifest:
+                self._progress(callback, evt)
+                self._apply(op, evt=evt)
+            return evt
+        pending = deque()
+
+        def finish_one():
+            op, future = pending.popleft()
+            strategy = None
+            if future is not None:
+                strategy = future.result()
+                # ^ Raise any exception from the thread.
+            self._progress(callback, evt)
+            self._apply(op, evt=evt, copied=True, strategy=strategy)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            self._run_removals(executor, evt=evt)
+            for op in self.manifest:
+                if op.op == OP_MKDIR:
+                    os.makedirs(
+                        self._staged_path(os.path.join(self.dst_root,
+                                                       op.rel)),
+                        exist_ok=True,
+                    )
+            try:
+                for op in self.manifest:
+                    if op.op != OP_COPY:
+                        pending.append((op, None))  # Only log it in order.
+                        continue
+                    future = executor.submit(
+                        self._copy_file,
+                        os.path.join(self.src_root, op.rel),
+                        os.path.join(self.dst_root, op.rel),
+                    )
+                    pending.append((op, future))
+                    if len(pending) > jobs * PENDING_PER_JOB:
+                        finish_one()
+                while pending:
+                    finish_one()
+            finally:
+                for _, future in pending:
+                    if future is not None:
+                        future.cancel()
+        return evt
+
+    def _run_removals(self, executor, evt=None):
+        '''Do the file operation of each delete step in self.manifest.
+
+        Each OP_RMDIR waits for the removals before it (so its directory
+        is empty). Removals queued by self.undo_archive are also done
+        before this returns. The steps are not logged (See run_manifest)
+        unless one fails.
+
+        Args:
+            executor (ThreadPoolExecutor): The pool to use.
+            evt (Optional[dict]): The event template to update.
+
+        Raises:
+            Exception: The error from the first failed step (in
+                manifest order), once every step that was started is
+                done and each one that succeeded is logged.
+        '''
+        futures = OrderedDict()
+        for i, op in enumerate(self.manifest):
+            if op.op == OP_RMDIR:
+                wait(futures.values())
+                if any(future.exception() is not None
+                       for future in futures.values()):
+                    break
+            elif op.op not in (OP_RM, OP_RMTREE, OP_UNLINK):
+                continue
+            futures[i] = executor.submit(self._remove, op)
+        wait(futures.values())
+        errors = [future.exception() for future in futures.values()
+                  if future.exception() is not None]
+        if not errors:
+            if self.undo_archive:
+                self.undo_archive.wait()  # See _wait_for_removal
+                self.queued_removals.clear()
+            return
+        for i, future in futures.items():
+            if future.exception() is None:
+                self._apply(self.manifest[i], evt=evt, copied=True)
+        raise errors[0]
+
+    def run_staged(self, callback=None, evt=None, jobs=None):
+        '''Run self.manifest in a staging directory then swap it in.
+
+        The staging directory (self.stage_root) starts as a copy of
+        dst_root where each file is a hard link (so only new or changed
+        files are written; See _copy_file). Then dst_root is renamed to
+        self.rollback_root (replacing any older one) and the staging
+        directory is renamed to dst_root, so dst_root is either the
+        old or the new tree. If anything fails before that, the staging
+        directory is deleted and dst_root is unchanged.
+
+        Args:
+            callback (Optional[callable]): See run_manifest.
+            evt (Optional[dict]): The event template to update.
+            jobs (Optional[int]): See run_manifest.
+
+        Returns:
+            dict: evt
+        '''
+        stage_root = self.dst_root + STAGE_SUFFIX
+        if os.path.lexists(stage_root):
+            shutil.rmtree(stage_root)  # left by an interrupted install
+        if os.path.isdir(self.dst_root):
+            echo0('* staging "{}" in "{}"'.format(self.dst_root, stage_root))
+            shutil.copytree(self.dst_root, stage_root, symlinks=True,
+                            copy_function=link_or_copy)
+        self.stage_root = stage_root
+        try:
+            results = self.run_manifest(callback=callback, evt=evt,
+                                        jobs=jobs)
+            if results.get('error'):
+                shutil.rmtree(stage_root)
+                return results
+            self._swap_in(stage_root)
+        except BaseException:
+            if os.path.isdir(stage_root):
+                shutil.rmtree(stage_root)
+            raise
+        finally:
+            self.stage_root = None
+        return results
+
+    def _swap_in(self, stage_root):
+        '''Replace dst_root with stage_root, keeping the old one.'''
+        rollback_root = self.rollback_root
+        if not os.path.lexists(self.dst_root):
+            os.rename(stage_root, self.dst_root)
+            return
+        if os.path.lexists(rollback_root):
+            shutil.rmtree(rollback_root)
+        os.rename(self.dst_root, rollback_root)
+        try:
+            os.rename(stage_root, self.dst_root)
+        except OSError:
+            os.rename(rollback_root, self.dst_root)
+            raise
+        echo0('* kept the previous install as "{}"'.format(rollback_root))
+
+    def rollback(self):
+        '''Restore the tree replaced by the last staged install.
+
+        Raises:
+            FileNotFoundError: There is no self.rollback_root.
+        '''
+        rollback_root = self.rollback_root
+        if not os.path.isdir(rollback_root):
+            raise FileNotFoundError('There is no "{}" to roll back to.'
+                                    ''.format(rollback_root))
+        failed_root = self.dst_root + STAGE_SUFFIX
+        if os.path.lexists(failed_root):
+            shutil.rmtree(failed_root)
+        if os.path.lexists(self.dst_root):
+            os.rename(self.dst_root, failed_root)
+        os.rename(rollback_root, self.dst_root)
+        if os.path.lexists(failed_root):
+            shutil.rmtree(failed_root)
+
+    def _staged_path(self, dst_path):
+        '''Get where to write dst_path (in stage_root if staging).'''
+        if self.stage_root is None:
+            return dst_path
+        if dst_path == self.dst_root:
+            return self.stage_root
+        if dst_path.startswith(self.dst_root_slash):
+            return os.path.join(self.stage_root,
+                                dst_path[len(self.dst_root_slash):])
+        return dst_path
+
+    def _copy_file(self, src_path, dst_path):
+        '''Copy a file (or symlink as a symlink) for install_file.
+
+        If staging, the destination is in stage_root and any hard link
+        there is removed first (so the file in dst_root isn't changed).
+
+        Returns:
+            str: How it was copied (See fast_copy).
+        '''
+        path = self._staged_path(dst_path)
+        if (path != dst_path) and os.path.lexists(path):
+            os.remove(path)
+        return fast_copy(src_path, path)
+
+    def _undo_sub(self, dst_path):
+        '''Get the path of dst_path within the undo archive.'''
+        undo_parent_rel = "system"
+        if dst_path.startswith(self.dst_root_slash):
+            undo_parent_rel = "program"
+            sub_rel = dst_path[len(self.dst_root_slash):]
+        elif dst_path == self.dst_root:
+            undo_parent_rel = "program"
+            sub_rel = ""
+        else:
+            # it is an absolute path, so make up a relative path
+            # (ok since goes in "system" not "program")
+            sub_rel = dst_path
+            if platform.system() == "Windows":
+                if len(sub_rel) > 2 and sub_rel[1] == ":":
+                    sub_rel = sub_rel[0] + sub_rel[2:]
+                    # ^ use subdir such as C\users under undo_parent_rel
+                    #   (Remove colon to make C folder)
+        while sub_rel.startswith(os.path.sep):
+            # Remove / or \\ (prevents relative os.path.join)
+            sub_rel = sub_rel[1:]
+        return os.path.join(undo_parent_rel, sub_rel)
+
     def after_install(self):
         '''Finalize logs.
         - Write self.rmdir_lines (saved via install_file), longest first.
@@ -910,7 +1736,10 @@ class HInstaller:
                            callback=None):
         """Delete files/dirs in dest *only if* not in src.
 
-        Remember to add all args *above* to recursive call(s)!
+        The dst tree is walked once (using os.scandir and a stack, not
+        recursion), and each directory in src is only listed once (See
+        _list_src), so no entry in src is stat'ed. A directory not in
+        src is deleted as one OP_RMTREE step.
 
         If self.simulate, self.delete_count is incremented but no file
         operations should be done.
@@ -938,41 +1767,15 @@ class HInstaller:
         #                      ' "{}"'.format(sub))
         undo = self.undo
         redo = self.redo
-        # undo_root = self.undo_dir
-        # undo_dir = None
-        undo_parent_rel = "system"
 
         dst = os.path.join(dst_parent, sub)
         src = os.path.join(src_parent, sub)
 
-        if dst.startswith(self.dst_root_slash):
-            undo_parent_rel = "program"
-            sub_rel = dst[len(self.dst_root_slash):]
-        elif dst == self.dst_root:
-            undo_parent_rel = "program"
-            sub_rel = ""
-        else:
-            # it is an absolute path, so make up a relative path
-            # (ok since goes in "system" not "program")
-            sub_rel = dst
-            if platform.system() == "Windows":
-                if len(sub_rel) > 2 and sub_rel[1] == ":":
-                    sub_rel = sub_rel[0] + sub_rel[2:]
-                    # ^ use subdir such as C\users under undo_parent_rel
-                    #   (Remove colon to make C folder)
-        while sub_rel.startswith(os.path.sep):
-            # Remove / or \\ (prevents relative os.path.join)
-            sub_rel = sub_rel[1:]
-        # if undo_root:
-        #     undo_dir = os.path.join(undo_root, undo_parent_rel, sub_rel)
-        undo_zip_sub = os.path.join(undo_parent_rel, sub_rel)
-
         if callback is None:
             callback = console_callback
-        count = 0
         if evt is None:
             evt = {}
-        if self.undo_zip:
+        if self.undo_archive:
             if not undo or undo.closed:
                 raise ValueError(
                     "undo (uninstall script) must be open if using undo_dir"
@@ -986,142 +1789,86 @@ class HInstaller:
         if evt['tmp'].get('md_lines') is None:
             evt['tmp']['md_lines'] = set()
         deleted = 0
+        if not os.path.lexists(dst):
+            return evt, deleted
         if os.path.isfile(dst):
-            # if os.path.islink(dst_path):
-            #     link_dst = os.readlink(dst_path)
             if not os.path.isfile(src):
-                self.append_install(shlex.join([
-                    "rm",
-                    "-f",
-                    dst
-                ]))
-                byte_count = os.path.getsize(dst)
-                self.increment_removed(byte_count=byte_count, evt=evt)
-                # if undo_dir:
-                #     # if un_path, undo_dir is already set
-                #     move = True
-                # else:
-                if not self.simulate:
-                    if self.undo_zip:
-                        self.undo_zip.write(
-                            dst,
-                            os.path.join(undo_zip_sub)
-                        )
-                    os.remove(dst)
+                self._apply(InstallOp(OP_RM, self._dst_rel(dst),
+                                      os.path.getsize(dst)), evt=evt)
                 deleted += 1
-            # if not move:
-            # evt['this_count'] = deleted
             return evt, deleted
 
-        for subsub in os.listdir(dst):
-            count += 1
-            src_path = os.path.join(src, subsub)
-            dst_path = os.path.join(dst, subsub)
-            subsub_rel = os.path.join(sub, subsub)
-            # un_path = None
-            # link_dst = None
-            # move = False
-            # if undo_dir:
-            #     un_path = os.path.join(undo_dir, subsub)
-            if os.path.isfile(dst_path):
-                _, _del = self._delete_not_in_src(src, dst, subsub,
-                                                  depth=depth+1,
-                                                  delete0=delete0, evt=evt,
-                                                  callback=callback)
-                count -= _del
-                del _
-                del _del
-                continue
-            if not os.path.isdir(src_path):
-                # is dir & not on src.
-                # if ((undo_dir not in self.undo_mkdir_lines)
-                #         and not os.path.isdir(undo_dir)):
-                #     # Make *parent*
-                #     if not self.simulate:
-                #         os.makedirs(undo_dir)
-                #     self.undo_mkdir_lines.add(undo_dir)
-
-                if not os.path.islink(dst_path):
-                    self.append_install(shlex.join([
-                        "rm",
-                        "-rf",
-                        dst_path
-                    ]))
-                    # if not undo_dir:
-                    byte_count = 0
-                    byte_count = get_dir_size(dst_path)
-                    self.increment_removed(
-                        count=zip_dir(self.undo_zip, dst_path, undo_zip_sub,
-                                      simulate=self.simulate),
-                        evt=evt,
-                        byte_count=byte_count,
-                    )
-                    if not self.simulate:
-                        shutil.rmtree(dst_path)
-                    # else:
-                    #     move = True
+        top_kept = 0
+        stack = [(src, dst)]
+        while stack:
+            src_dir, dst_dir = stack.pop()
+            src_kinds = self._list_src(src_dir)
+            kept = 0
+            with os.scandir(dst_dir) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            for entry in entries:
+                in_src = src_kinds.get(entry.name)
+                # ^ None if not in src, otherwise whether it is a dir
+                if entry.is_file():
+                    if in_src is False:
+                        kept += 1
+                        continue
+                    self._apply(InstallOp(OP_RM, self._dst_rel(entry.path),
+                                          entry.stat().st_size), evt=evt)
+                elif in_src and entry.is_dir():
+                    kept += 1
+                    stack.append((os.path.join(src_dir, entry.name),
+                                  entry.path))
+                elif entry.is_symlink():
+                    self._apply(InstallOp(
+                        OP_UNLINK,
+                        self._dst_rel(entry.path),
+                        note=os.readlink(entry.path),
+                    ), evt=evt)
                 else:
-                    # is link
-                    self.append_install(shlex.join([
-                        "rm",
-                        "-f",
-                        dst_path
-                    ]))
-                    link_dst = os.readlink(dst_path)
-                    # if not undo_dir:
-                    self.increment_removed(evt=evt)
-                    # ^ byte_count=0
-                    if not self.simulate:
-                        os.unlink(dst_path)
-                        # ^ unlink deletes link *not* target
-                    # else:
-                    #     move = True
-                    self.append_undo(shlex.join([
-                        "ln",
-                        "-s",
-                        link_dst,
-                        dst_path
-                    ]))
-                count -= 1
-                # if not move:
-                continue  # no recursion (no longer exists)!
-            _, _del = self._delete_not_in_src(
-                src_parent,
-                dst_parent,
-                subsub_rel,
-                depth=depth+1,
-                delete0=delete0,
-                evt=evt,
-                callback=callback,
-            )
-            # if not os.path.exists(dst_path):
-            if _del:
-                count -= 1
-        if ((count == 0) and (depth > 0 or delete0)
+                    self._apply(InstallOp(
+                        OP_RMTREE,
+                        self._dst_rel(entry.path),
+                        get_dir_size(entry.path),
+                        note=zip_dir(None, entry.path, entry.name,
+                                     simulate=True),
+                    ), evt=evt)
+            if dst_dir == dst:
+                top_kept = kept
+        if ((top_kept == 0) and (depth > 0 or delete0)
                 and not os.path.exists(src)):
             # Remove empty directory *if* not in src & not top level.
+            # (Only dst itself can be emptied this way, since any other
+            # directory not in src was removed by OP_RMTREE.)
             deleted = 1
-            if not os.path.islink(dst):
-                self.append_install(shlex.join([
-                    "rmdir",
-                    dst_parent
-                ]))
-                if not self.simulate:
-                    os.rmdir(dst)
-                self.increment_removed(evt=evt)
-                # ^ byte_count=0
-            else:
-                if redo:
-                    self.append_install(shlex.join([
-                        "rm",
-                        "-f",
-                        dst_parent,
-                    ])+"  # directory symlink (*not* recursive delete!)")
-                if not self.simulate:
-                    os.unlink(dst)
-                self.increment_removed(evt=evt)
-                # ^ byte_count = 0
+            self._apply(InstallOp(OP_RMDIR, self._dst_rel(dst),
+                                  mode=os.lstat(dst).st_mode), evt=evt)
         # callback(evt)
         # Do not set evt['status'] = "done"
         #   because the caller (usually install_minetest) may not be done!
         return evt, deleted
+
+    def _list_src(self, src_dir):
+        '''Get {name: is_dir} for src_dir (empty if not a directory).
+
+        Each listing is cached (in self.src_listings) so deciding what
+        is not in src is a lookup instead of a stat per entry.
+        '''
+        kinds = self.src_listings.get(src_dir)
+        if kinds is not None:
+            return kinds
+        kinds = {}
+        try:
+            with os.scandir(src_dir) as it:
+                for entry in it:
+                    kinds[entry.name] = entry.is_dir()
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        self.src_listings[src_dir] = kinds
+        return kinds
+
+    def _dst_rel(self, dst_path):
+        '''Get dst_path relative to dst_root (or as is if not in it).'''
+        if dst_path.startswith(self.dst_root_slash):
+            return dst_path[len(self.dst_root_slash):]
+        return dst_path
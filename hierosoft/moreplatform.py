@@ -2,7 +2,10 @@
 from __future__ import print_function
 
 import copy
+import errno
 import hashlib
+import json
+import lzma
 import os
 import platform
 import shutil
@@ -11,9 +14,12 @@ import sys
 import subprocess
 import tarfile
 import tempfile
+import threading
 import zipfile
+import zlib
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable  # noqa: F401
 from zipfile import ZipFile
 
@@ -30,6 +36,7 @@ from hierosoft.morebytes import (
     rewrite_conf,
     rewrite_conf_str,
 )
+from hierosoft.progresswriter import ProgressAggregator
 
 
 DEFAULT_SIZE_SUB = "48x48"
@@ -57,6 +64,53 @@ if sys.version_info.major < 3:
     FileExistsError = IOError
     ModuleNotFoundError = ImportError
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows
+
+COPY_REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+COPY_SENDFILE = "sendfile"
+COPY_COPY2 = "copy2"
+# ^ Strategies returned by fast_copy, fastest first
+
+FICLONE = 0x40049409
+# ^ The Linux ioctl (_IOW(0x94, 9, int)) that makes dst share src's
+#   extents (copy-on-write) on filesystems such as btrfs and XFS.
+
+FAST_COPY_ERRNOS = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+    errno.EOPNOTSUPP, errno.EBADF, errno.EPERM,
+}
+# ^ Errors that mean a strategy isn't supported (so try the next one).
+
+JOURNAL_SUFFIX = ".journal"
+# ^ With event_template['resume_extract'], install_streamed lists each
+#   extracted member in dst+EXTRACT_SUFFIX+JOURNAL_SUFFIX.
+
+ZIP_JOBS_MIN_BYTES = 4 * 1024 * 1024
+# ^ extract_zip_streamed uses one thread for less content than this.
+
+ZIP_SYSTEM_UNIX = 3
+# ^ ZipInfo.create_system for an archive made on Unix (whose
+#   external_attr has the st_mode in the upper 16 bits).
+
+EXTRACT_SUFFIX = ".extracting"
+# ^ install_streamed extracts into dst+EXTRACT_SUFFIX (on the same
+#   volume as dst, so moving it into place is a rename).
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# ^ Bytes read at a time by get_digest, get_hexdigest and same_hash.
+
+HASH_ALGORITHMS = ("md5", "sha256", "blake2b")
+# ^ Algorithms for get_digest, get_hexdigest and get_hexdigests (any
+#   other name hashlib.new accepts also works).
+
+_unsupported_copies = set()
+# ^ (strategy, src st_dev, dst st_dev) that failed, so fast_copy doesn't
+#   retry a strategy for each file.
+
 try:
     import gi
     gi.require_version('Gtk', '3.0')
@@ -197,15 +251,114 @@ def which_pixmap(name, context=DEFAULT_CONTEXT, size=48, refresh=True):
     return None
 
 
+def _copy_fds(src_fd, dst_fd, strategy, size):
+    '''Copy size bytes from src_fd to dst_fd in the kernel.
+
+    Returns:
+        bool: False if the strategy is not supported (nothing was
+            copied), otherwise True.
+    '''
+    if strategy == COPY_REFLINK:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    if strategy == COPY_FILE_RANGE:
+        fn = os.copy_file_range
+    else:
+        def fn(src_fd, dst_fd, count):
+            return os.sendfile(dst_fd, src_fd, None, count)
+    done = 0
+    while done < size:
+        try:
+            count = fn(src_fd, dst_fd, size - done)
+        except OSError as ex:
+            if (done == 0) and (ex.errno in FAST_COPY_ERRNOS):
+                return False
+            raise
+        if count == 0:
+            if done == 0:
+                return False  # Some filesystems copy nothing this way.
+            break  # The file was truncated meanwhile.
+        done += count
+    return True
+
+
+def fast_copy(src, dst):
+    '''Copy a file and its metadata (like shutil.copy2) quickly.
+
+    Strategies are tried in order: COPY_REFLINK (a copy-on-write clone,
+    nearly instant regardless of size), COPY_FILE_RANGE, COPY_SENDFILE
+    (both copy in the kernel, without reading into Python), then
+    COPY_COPY2 (shutil.copy2, also used for symlinks, which are copied
+    as symlinks, and on platforms other than Linux). A strategy that
+    fails as unsupported is not tried again for the same pair of
+    devices.
+
+    Args:
+        src (str): The source file.
+        dst (str): The destination file path (overwritten if exists).
+
+    Returns:
+        str: The strategy used (a COPY_* constant).
+    '''
+    if os.path.islink(src) and os.path.lexists(dst):
+        os.remove(dst)  # copy2 can't replace it with a symlink.
+    if (not sys.platform.startswith("linux")) or os.path.islink(src):
+        shutil.copy2(src, dst, follow_symlinks=False)
+        return COPY_COPY2
+    strategies = [COPY_FILE_RANGE, COPY_SENDFILE]
+    if fcntl is not None:
+        strategies.insert(0, COPY_REFLINK)
+    if not hasattr(os, 'copy_file_range'):  # Python < 3.8
+        strategies.remove(COPY_FILE_RANGE)
+    with open(src, 'rb') as ins:
+        src_st = os.fstat(ins.fileno())
+        with open(dst, 'wb') as outs:
+            dst_dev = os.fstat(outs.fileno()).st_dev
+            for strategy in strategies:
+                key = (strategy, src_st.st_dev, dst_dev)
+                if key in _unsupported_copies:
+                    continue
+                try:
+                    done = _copy_fds(ins.fileno(), outs.fileno(), strategy,
+                                     src_st.st_size)
+                except OSError as ex:
+                    if ex.errno not in FAST_COPY_ERRNOS:
+                        raise
+                    done = False
+                if done:
+                    break
+                _unsupported_copies.add(key)
+            else:
+                strategy = COPY_COPY2
+    if strategy == COPY_COPY2:
+        shutil.copy2(src, dst)
+    else:
+        shutil.copystat(src, dst)
+    return strategy
+
+
 def copytree(src, dst, **kwargs):
+    '''Copy or move each file from src into dst, creating directories.
+
+    Args:
+        move (Optional[bool]): Move instead of copy.
+        overwrite (Optional[bool]): Remove each destination file first.
+        skip_unchanged (Optional[bool]): Skip each file that is already
+            the same in dst (See is_unchanged; ignored if move).
+    '''
     move = kwargs.get('move')
     overwrite = kwargs.get('overwrite')
+    skip_unchanged = kwargs.get('skip_unchanged')
     dirs = []
     for sub in os.listdir(src):
         src_sub_path = os.path.join(src, sub)
         dst_sub_path = os.path.join(dst, sub)
         if (os.path.islink(src_sub_path)
                 or os.path.isfile(src_sub_path)):
+            if (skip_unchanged and not move
+                    and not os.path.islink(src_sub_path)
+                    and is_unchanged(src_sub_path, dst_sub_path)):
+                continue
             if overwrite:
                 if os.path.exists(dst_sub_path):
                     os.remove(dst_sub_path)
@@ -219,7 +372,7 @@ def copytree(src, dst, **kwargs):
             if move:
                 shutil.move(src_sub_path, dst_sub_path)
             else:
-                shutil.copy2(src_sub_path, dst_sub_path)
+                fast_copy(src_sub_path, dst_sub_path)
         else:
             dirs.append(sub)
 
@@ -316,6 +469,7 @@ def install_folder(src, dst, event_template=None):
         copytree(
             src,
             dst,
+            skip_unchanged=True,
         )
     else:
         shutil.move(src, dst)
@@ -418,17 +572,436 @@ def get_tar_mode(archive, event_template):
     return evt
 
 
-def install_tar(archive, dst, remove_archive=False,
-                event_template=None):
-    """Install a tar-compatible file such as .bz2, .gz, .xz.
+def _is_relative_name(name):
+    """Check that a path has no root, drive or ".." part."""
+    name = name.replace("\\", "/")
+    if name.startswith("/") or (":" in name.split("/")[0]):
+        return False
+    return ".." not in name.split("/")
+
+
+def _member_is_safe(member):
+    """Check that a tar member stays inside the extract directory.
+
+    Only used if tarfile has no extraction filters (older Python). The
+    target of a symlink or hard link must also be relative without
+    "..", so a later member can't be written through it.
+
+    Args:
+        member (tarfile.TarInfo): Any member.
+    """
+    if not _is_relative_name(member.name):
+        return False
+    if member.issym() or member.islnk():
+        return _is_relative_name(member.linkname)
+    return True
+
+
+class ExtractJournal(object):
+    """A list of archive members already extracted (to resume).
+
+    The first line is JSON identifying the archive (path, size and
+    mtime), and each other line is the name of a member that was
+    completely written. A journal for a different or changed archive is
+    ignored (See open). Lines are flushed (not fsynced), so this
+    survives the process being interrupted or killed, but not
+    necessarily a power loss.
+
+    Args:
+        path (str): The journal file.
+        archive (str): The archive being extracted.
+
+    Attributes:
+        done (set[str]): Names of members already extracted.
+    """
+    def __init__(self, path, archive):
+        self.path = path
+        self.archive = archive
+        self.done = set()
+        self._stream = None
+
+    def _header(self):
+        st = os.stat(self.archive)
+        return {'archive': os.path.abspath(self.archive),
+                'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def open(self, resume=True):
+        """Load the journal if it is for this archive, else start one.
+
+        Args:
+            resume (Optional[bool]): If False, start one even if the
+                journal is for this archive (such as if the extracted
+                members are gone).
+
+        Returns:
+            bool: True if resuming (the extract directory should be
+                kept), False if starting over.
+        """
+        header = self._header()
+        self.done = set()
+        resuming = False
+        if resume and os.path.isfile(self.path):
+            with open(self.path, 'r') as ins:
+                lines = ins.read().split("\n")
+            try:
+                resuming = json.loads(lines[0]) == header
+            except ValueError:
+                resuming = False
+            if resuming:
+                self.done = set(line for line in lines[1:-1])
+                # ^ Skip the last (incomplete or blank) line.
+        if resuming:
+            self._stream = open(self.path, 'a')
+        else:
+            self._stream = open(self.path, 'w')
+            self._stream.write(json.dumps(header, sort_keys=True) + "\n")
+            self._stream.flush()
+        return resuming
+
+    def add(self, name):
+        """Record that a member was completely extracted."""
+        self.done.add(name)
+        self._stream.write(name + "\n")
+        self._stream.flush()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def discard(self):
+        """Close and delete the journal (such as once installed)."""
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def verify_zip(archive, progress=None):
+    """Check every member's CRC without writing anything.
+
+    Args:
+        archive (str): A zip file.
+        progress (Optional[ProgressAggregator]): See
+            extract_zip_streamed.
+
+    Returns:
+        Optional[str]: An error message, or None if the zip is ok.
+    """
+    try:
+        with ZipFile(archive, 'r') as this_zip:
+            infos = this_zip.infolist()  # the central directory
+            if progress is not None:
+                progress.evt['bytes_total'] = sum(info.compress_size
+                                                  for info in infos)
+            for info in infos:
+                with this_zip.open(info) as ins:
+                    while ins.read(HASH_CHUNK_SIZE):
+                        pass  # ZipExtFile checks the CRC at the end.
+                if progress is not None:
+                    progress.evt['member'] = info.filename
+                    progress.add(info.compress_size)
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as ex:
+        return "%s: %s (%s)" % (type(ex).__name__, ex, archive)
+    return None
+
+
+def verify_tar(archive, mode="r|*", progress=None):
+    """Decompress and read every member without writing anything.
+
+    Args:
+        archive (str): A tar file (compressed or not).
+        mode (Optional[str]): See extract_tar_streamed.
+        progress (Optional[ProgressAggregator]): See
+            extract_tar_streamed.
+
+    Returns:
+        Optional[str]: An error message, or None if the tar is ok.
+    """
+    try:
+        with open(archive, 'rb') as raw:
+            if progress is not None:
+                progress.refresh = lambda evt: evt.update(
+                    bytes_done=raw.tell())
+            try:
+                with tarfile.open(fileobj=raw, mode=mode) as archive_handle:
+                    for member in archive_handle:
+                        if progress is not None:
+                            progress.evt['member'] = member.name
+                            progress.update()
+                        if not member.isfile():
+                            continue
+                        ins = archive_handle.extractfile(member)
+                        while ins.read(HASH_CHUNK_SIZE):
+                            pass
+            finally:
+                if progress is not None:
+                    progress.refresh = None  # raw is about to be closed
+    except EOFError:
+        return "Incomplete %s archive: %s" % (mode.split("|")[-1], archive)
+    except (tarfile.TarError, zlib.error, lzma.LZMAError, OSError) as ex:
+        return "%s: %s (%s)" % (type(ex).__name__, ex, archive)
+    return None
+
+
+def extract_tar_streamed(archive, path, mode="r|*", progress=None,
+                         journal=None):
+    """Extract a tar file member by member in one sequential read.
+
+    Args:
+        archive (str): A tar file (compressed or not).
+        path (str): The directory to extract into.
+        mode (Optional[str]): A tarfile stream mode (such as "r|xz";
+            the default detects the compression).
+        progress (Optional[ProgressAggregator]): If not None, evt
+            'member' is set to each member name and 'bytes_done' to how
+            much of the (compressed) archive was read, and 'bytes_total'
+            should be the archive size.
+        journal (Optional[ExtractJournal]): If not None, members in
+            journal.done are skipped (The archive is still decompressed
+            up to the last one, but nothing is written), and each
+            extracted member (other than directories, which are cheap
+            and have their attributes set last) is added.
+    """
+    with open(archive, 'rb') as raw:
+        if progress is not None:
+            progress.refresh = lambda evt: evt.update(bytes_done=raw.tell())
+        with tarfile.open(fileobj=raw, mode=mode) as archive_handle:
+            previous = []
+
+            def members():
+                for member in archive_handle:
+                    if previous:
+                        # extractall wrote it before asking for the next
+                        journal.add(previous.pop())
+                    if (not hasattr(tarfile, 'data_filter')
+                            and not _member_is_safe(member)):
+                        echo0('Warning: skipped unsafe "{}" in "{}"'
+                              ''.format(member.name, archive))
+                        continue
+                    if progress is not None:
+                        progress.evt['member'] = member.name
+                        progress.update()
+                    if journal is not None and not member.isdir():
+                        if member.name in journal.done:
+                            continue
+                        previous.append(member.name)
+                    yield member
+
+            if hasattr(tarfile, 'data_filter'):
+                archive_handle.extractall(path, members=members(),
+                                          filter='data')
+            else:
+                archive_handle.extractall(path, members=members())
+            if previous:
+                journal.add(previous.pop())
+        if progress is not None:
+            progress.refresh = None  # raw is about to be closed
+            progress.evt['bytes_done'] = os.fstat(raw.fileno()).st_size
+            # ^ Done even if trailing padding wasn't read.
+
+
+def zip_member_path(path, info):
+    """Get where ZipFile.extract writes a member (with ".." removed).
+
+    Args:
+        path (str): The directory to extract into.
+        info (zipfile.ZipInfo): Any member.
+
+    Returns:
+        str: The destination path (The same as ZipFile.extract uses).
+    """
+    arcname = info.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    arcname = os.path.sep.join(
+        part for part in arcname.split(os.path.sep)
+        if part not in ('', os.path.curdir, os.path.pardir)
+    )
+    if os.path.sep == "\\":
+        arcname = ZipFile._sanitize_windows_name(arcname, os.path.sep)
+    return os.path.join(path, arcname)
+
+
+def _is_within(sub, path):
+    """Check whether sub is path or inside it (following symlinks)."""
+    root = os.path.realpath(path)
+    sub = os.path.realpath(sub)
+    return (sub == root) or sub.startswith(root.rstrip(os.path.sep)
+                                           + os.path.sep)
+
+
+def extract_zip_member(this_zip, info, path):
+    """Extract a member, keeping its Unix permissions and symlinks.
+
+    Unlike ZipFile.extract, a member created on Unix keeps its
+    permission bits (such as executable), and a symlink member is
+    extracted as a symlink (unless it points outside of path, in which
+    case it is skipped with a warning). Symlinks already extracted are
+    followed for that check, and a member whose directory is outside of
+    path (through such a symlink) is also skipped.
+
+    Args:
+        this_zip (ZipFile): The open archive.
+        info (zipfile.ZipInfo): The member.
+        path (str): The directory to extract into.
+    """
+    mode = 0
+    if info.create_system == ZIP_SYSTEM_UNIX:
+        mode = info.external_attr >> 16
+    target = zip_member_path(path, info)
+    if not _is_within(os.path.dirname(target), path):
+        # A symlink extracted earlier is in its path.
+        echo0('Warning: skipped "{}" (outside of the archive)'
+              ''.format(info.filename))
+        return
+    if stat.S_ISLNK(mode):
+        link = this_zip.read(info).decode("utf-8")
+        if (os.path.isabs(link) or not _is_within(
+                os.path.join(os.path.dirname(target), link), path)):
+            echo0('Warning: skipped symlink "{}" -> "{}" (outside of'
+                  ' the archive)'.format(info.filename, link))
+            return
+        if os.path.isdir(target) and not os.path.islink(target):
+            echo0('Warning: skipped symlink "{}" (a directory is already'
+                  ' there)'.format(info.filename))
+            return
+        if os.path.lexists(target):
+            os.remove(target)
+        elif not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        try:
+            os.symlink(link, target)
+        except (OSError, NotImplementedError) as ex:
+            echo0('Warning: skipped symlink "{}": {}'
+                  ''.format(info.filename, ex))
+        return
+    target = this_zip.extract(info, path)
+    if (mode & 0o777) and not info.is_dir():
+        os.chmod(target, mode & 0o777)
+
+
+def extract_zip_streamed(archive, path, progress=None, jobs=None,
+                         journal=None):
+    """Extract a zip file member by member (See extract_tar_streamed).
+
+    Each member is compressed separately, so with jobs, members are
+    decompressed in a pool of threads (zlib and the other decompressors
+    release the GIL), each thread reading through its own ZipFile.
+    Every directory is created first (so threads don't race to create
+    one).
+
+    Args:
+        progress (Optional[ProgressAggregator]): If not None, evt
+            'member' is set to each member name and 'bytes_done' and
+            'bytes_total' are in compressed bytes (updated in member
+            order).
+        jobs (Optional[int]): How many members to extract at once (None
+            or 0 for os.cpu_count()). Archives with less than
+            ZIP_JOBS_MIN_BYTES of content are extracted by one thread.
+        journal (Optional[ExtractJournal]): If not None, members in
+            journal.done are skipped and each extracted member is added
+            (in member order).
+    """
+    with ZipFile(archive, 'r') as this_zip:
+        infos = this_zip.infolist()
+        if progress is not None:
+            progress.evt['bytes_total'] = sum(info.compress_size
+                                              for info in infos)
+        if journal is not None:
+            done_size = sum(info.compress_size for info in infos
+                            if info.filename in journal.done)
+            infos = [info for info in infos
+                     if info.filename not in journal.done]
+            if progress is not None:
+                progress.add(done_size)
+        if not jobs:
+            jobs = os.cpu_count() or 1
+        if ((jobs < 2) or (len(infos) < 2) or (
+                sum(info.file_size for info in infos)
+                < ZIP_JOBS_MIN_BYTES)):
+            for info in infos:
+                extract_zip_member(this_zip, info, path)
+                if journal is not None:
+                    journal.add(info.filename)
+                if progress is not None:
+                    progress.evt['member'] = info.filename
+                    progress.add(info.compress_size)
+            return
+    dirs = set()
+    for info in infos:
+        target = zip_member_path(path, info)
+        dirs.add(target if info.is_dir() else os.path.dirname(target))
+    for sub in sorted(dirs):
+        if not os.path.isdir(sub):
+            os.makedirs(sub)
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_one(info):
+        handle = getattr(local, 'zip', None)
+        if handle is None:
+            handle = ZipFile(archive, 'r')
+            local.zip = handle
+            with handles_lock:
+                handles.append(handle)
+        extract_zip_member(handle, info, path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(extract_one, info) for info in infos]
+            try:
+                for info, future in zip(infos, futures):
+                    future.result()  # Raise any exception from the thread.
+                    if journal is not None:
+                        journal.add(info.filename)
+                    if progress is not None:
+                        progress.evt['member'] = info.filename
+                        progress.add(info.compress_size)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def install_streamed(archive, dst, extract, event_template=None,
+                     remove_archive=False, progress_cb=None, verify=None):
+    """Extract an archive next to dst then install it.
+
+    The archive is extracted (read once, sequentially) into
+    dst+EXTRACT_SUFFIX, so it is on the same volume as dst and
+    install_extracted can rename it (or its single top-level folder)
+    into place, instead of writing every byte again. Anything left
+    there (such as hidden files beside a single top-level folder) is
+    then deleted.
+
+    Args:
+        extract (Callable): Called with (directory, progress, journal)
+            to write the members (See extract_tar_streamed).
+        event_template (Optional[dict]): See install_folder. Also:
+            - 'verify_archive' (bool, optional): First check the whole
+              archive (using verify) without writing anything, and if
+              it is damaged, set 'error' and 'archive_corrupt' (The
+              archive is kept, such as to download it again).
+            - 'resume_extract' (bool, optional): Keep a journal of
+              extracted members (See ExtractJournal), and if the
+              extraction is interrupted (by an exception or by the
+              process ending), keep the extract directory so that the
+              next call for the same unchanged archive skips the
+              members already extracted.
+        progress_cb (Optional[Callable]): If not None, receives
+            progress snapshots (See ProgressAggregator) with 'member',
+            'bytes_done', 'bytes_total' and 'ratio' (and 'verifying'
+            while verifying).
+        verify (Optional[Callable]): Called with progress for
+            'verify_archive' (See verify_zip).
 
     For returns and other documentation, see install_extracted.
     """
-    mode_args = get_tar_mode(archive, remove_archive=False,
-                             event_template=event_template)
-    if 'error' in mode_args:
-        return mode_args
-    mode = mode_args['tar.mode']
     if event_template is None:
         evt = OrderedDict()
     else:
@@ -438,80 +1011,142 @@ def install_tar(archive, dst, remove_archive=False,
         evt = copy.deepcopy(event_template)
     if not os.path.isfile(archive):
         evt['error'] = "The file doesn't exist: %s" % hr_repr(archive)
+        return evt
+
+    def new_progress(**kwargs):
+        if progress_cb is None:
+            return None
+        kwargs['archive'] = archive
+        kwargs['bytes_total'] = os.path.getsize(archive)
+        return ProgressAggregator(progress_cb, evt=kwargs,
+                                  done_key='bytes_done',
+                                  total_key='bytes_total')
+
+    if evt.get('verify_archive') and (verify is not None):
+        progress = new_progress(verifying=True)
+        error = verify(progress)
+        if progress is not None:
+            progress.finish()
+        if error:
+            echo0("Error verifying %s: %s" % (hr_repr(archive), error))
+            evt['error'] = error
+            evt['archive_corrupt'] = True
+            return evt
+    extracted_path = os.path.normpath(dst) + EXTRACT_SUFFIX
+    journal = None
+    resuming = False
+    if evt.get('resume_extract'):
+        journal = ExtractJournal(extracted_path + JOURNAL_SUFFIX, archive)
+        resuming = journal.open(resume=os.path.isdir(extracted_path))
+        if resuming:
+            echo0("Resuming extraction of %s (%s member(s) done)"
+                  % (hr_repr(archive), len(journal.done)))
+    if os.path.lexists(extracted_path) and not resuming:
+        shutil.rmtree(extracted_path)  # from an interrupted install
+    programs_dir = os.path.dirname(extracted_path)
+    if programs_dir and not os.path.isdir(programs_dir):
+        os.makedirs(programs_dir)
+    progress = new_progress()
+    extracted = False
     try:
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            extracted_path = os.path.join(tmpdirname, "extracted")
-            with tarfile.open(archive, mode) as archive_handle:
-                # for i in archive_handle:
-                #     archive_handle.extractfile(i)
-                archive_handle.extractall(extracted_path)
-            installed = install_extracted(
-                extracted_path,
-                dst,
-                event_template=evt,
-            )
-            if not installed.get('error'):
-                if remove_archive:
-                    print("rm {}".format(hr_repr(archive)))
-                    os.remove(archive)
-                else:
-                    echo2("[install_zip] Keeping archive.")
+        extract(extracted_path, progress, journal)
+        extracted = True
+        if progress is not None:
+            progress.finish()
+        installed = install_extracted(
+            extracted_path,
+            dst,
+            event_template=evt,
+        )
+    finally:
+        if journal is not None:
+            if extracted:
+                journal.discard()
             else:
-                if remove_archive:
-                    echo2("[install_tar] Warning:"
-                          " not removing archive due to: {}"
-                          .format(installed.get('error')))
-            evt.update(installed)
-    except EOFError:
-        fmt = mode.split(":")[-1]
+                journal.close()  # Keep it (and extracted_path) to resume.
+        if (journal is None) or extracted:
+            if os.path.lexists(extracted_path):
+                shutil.rmtree(extracted_path)
+    if not installed.get('error'):
+        if remove_archive:
+            print("rm {}".format(hr_repr(archive)))
+            os.remove(archive)
+        else:
+            echo2("[install_streamed] Keeping archive.")
+    else:
+        if remove_archive:
+            echo2("[install_streamed] Warning:"
+                  " not removing archive due to: {}"
+                  .format(installed.get('error')))
+    evt.update(installed)
+    return evt
+
+
+def install_tar(archive, dst, remove_archive=False,
+                event_template=None, progress_cb=None):
+    """Install a tar-compatible file such as .bz2, .gz, .xz.
+
+    The archive is decompressed and written once (See
+    install_streamed).
+
+    For returns and other documentation, see install_extracted.
+    """
+    mode_args = get_tar_mode(archive, event_template=event_template)
+    if 'error' in mode_args:
+        return mode_args
+    mode = mode_args['tar.mode'].replace(":", "|")  # stream mode
+    try:
+        return install_streamed(
+            archive,
+            dst,
+            lambda path, progress, journal: extract_tar_streamed(
+                archive, path, mode=mode, progress=progress,
+                journal=journal),
+            event_template=event_template,
+            remove_archive=remove_archive,
+            progress_cb=progress_cb,
+            verify=lambda progress: verify_tar(archive, mode=mode,
+                                               progress=progress),
+        )
+    except (EOFError, tarfile.TarError) as ex:
+        if event_template is None:
+            evt = OrderedDict()
+        else:
+            evt = copy.deepcopy(event_template)
+        fmt = mode.split("|")[-1]
         msg = "Incomplete %s archive: %s" % (fmt, archive)
+        if not isinstance(ex, EOFError):
+            msg = "%s: %s (%s)" % (type(ex).__name__, ex, archive)
         evt['error'] = msg
         return evt
-    # finally:
-    #     if archive_handle is not None:
-    #         archive_handle.close()
-    #         archive_handle = None
-    return evt
 
 
 def install_zip(archive, dst, remove_archive=False,
-                event_template=None):
+                event_template=None, progress_cb=None, jobs=None):
     """Install a zip file. Automatically use subdir from zip if 1 & no file.
 
+    Each member is written once (See install_streamed), using jobs
+    threads (See extract_zip_streamed).
+
     For returns and other documentation, see install_extracted.
     """
-    if event_template is None:
-        evt = OrderedDict()
-    else:
-        if 'error' in event_template:
-            raise ValueError("Calls continued after error but should not."
-                             " Previous error: %s" % event_template['error'])
-        evt = copy.deepcopy(event_template)
-    if not os.path.isfile(archive):
-        evt['error'] = "The file doesn't exist: %s" % hr_repr(archive)
     try:
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            extracted_path = os.path.join(tmpdirname, "extracted")
-            with ZipFile(archive, 'r') as this_zip:
-                this_zip.extractall(extracted_path)
-            installed = install_extracted(
-                extracted_path,
-                dst,
-                event_template=evt,
-            )
-            if not installed.get('error'):
-                if remove_archive:
-                    print("rm {}".format(hr_repr(archive)))
-                    os.remove(archive)
-                else:
-                    echo2("[install_zip] Keeping archive.")
-            else:
-                if remove_archive:
-                    echo2("[install_zip] Warning:"
-                          " not removing archive due to: {}"
-                          .format(installed.get('error')))
-            evt.update(installed)
+        return install_streamed(
+            archive,
+            dst,
+            lambda path, progress, journal: extract_zip_streamed(
+                archive, path, progress=progress, jobs=jobs,
+                journal=journal),
+            event_template=event_template,
+            remove_archive=remove_archive,
+            progress_cb=progress_cb,
+            verify=lambda progress: verify_zip(archive, progress=progress),
+        )
     except zipfile.BadZipFile as ex:
+        if event_template is None:
+            evt = OrderedDict()
+        else:
+            evt = copy.deepcopy(event_template)
         evt['error'] = "%s: %s" % (type(ex).__name__, ex)
         echo0("Error extracting %s: %s" % (hr_repr(archive), ex))
         delete_msg = "Deleting %s" % hr_repr(archive)
@@ -524,16 +1159,21 @@ def install_zip(archive, dst, remove_archive=False,
                               " Delete the faulty file manually."
                               % archive)
             echo0(permission_msg)
-            evt['error'] + "\n" + permission_msg
+            evt['error'] += "\n" + permission_msg
     return evt
 
 
 def install_archive(archive, dst, remove_dst=False,
                     remove_archive=True, event_template=None,
-                    status_cb=None):
-    # type: (str, str, bool, bool, dict, Callable) -> dict[str,str]
+                    status_cb=None, jobs=None):
+    # type: (str, str, bool, bool, dict, Callable, int) -> dict[str,str]
     """Extract and install an archive file to dst directory.
 
+    A zip file is extracted using jobs threads (See
+    extract_zip_streamed). Set event_template 'verify_archive' to check
+    the archive before writing anything, or 'resume_extract' to resume
+    an interrupted extraction (See install_streamed).
+
     For returns and other documentation, see install_extracted.
     """
     def local_status_cb(e):
@@ -560,13 +1200,16 @@ def install_archive(archive, dst, remove_dst=False,
             dst,
             remove_archive=remove_archive,
             event_template=evt,
+            progress_cb=status_cb,
+            jobs=jobs,
         )
-    elif tar_args.get('mode') and not tar_args.get('error'):
+    elif tar_args.get('tar.mode') and not tar_args.get('error'):
         installed = install_tar(
             archive,
             dst,
             remove_archive=remove_archive,
             event_template=evt,
+            progress_cb=status_cb,
         )
     else:
         evt['error'] = "Unknown archive extension: %s" % hr_repr(archive)
@@ -930,7 +1573,8 @@ def _zip_dir(zipfile, src, dst, simulate=False):
         # is already known to be a dir
         src_sub_path = os.path.join(src, sub)
         dst_sub_path = os.path.join(dst, sub)
-        count += zip_dir(zipfile, src_sub_path, dst_sub_path)
+        count += _zip_dir(zipfile, src_sub_path, dst_sub_path,
+                          simulate=simulate)
     return count
 
 
@@ -942,53 +1586,162 @@ def zip_dir(zipfile, src, dst, simulate=False):
         if ":" in dst:
             raise ValueError('dst may not contain ":": "{}"'
                              ''.format(dst))
-    return _zip_dir(zipfile, src, dst)
+    return _zip_dir(zipfile, src, dst, simulate=simulate)
+
 
+def hash_file(path, algorithm="md5", chunk_size=HASH_CHUNK_SIZE):
+    """Hash a file a chunk at a time (so memory use doesn't grow).
 
-def get_digest(path):
-    """Get MD5 digest bytes.
+    Each chunk is read into the same buffer (using readinto), and
+    hashlib releases the GIL while hashing a large chunk, so several
+    files can be hashed at once in threads (See get_hexdigests).
 
     Args:
         path (str): Any file.
+        algorithm (Optional[str]): See HASH_ALGORITHMS.
+        chunk_size (Optional[int]): Bytes to read at a time.
 
     Returns:
-        bytes: md5 digest bytes
+        hashlib hash object: Call digest() or hexdigest() on it.
     """
-    hasher = hashlib.md5()
+    hasher = hashlib.new(algorithm)
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
     with open(path, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-        return hasher.digest()
+        while True:
+            count = f.readinto(buf)
+            if not count:
+                break
+            hasher.update(view[:count])
+    return hasher
 
 
-def get_hexdigest(path):
-    """Get MD5 digest hex-encoded string.
+def get_digest(path, algorithm="md5"):
+    """Get digest bytes.
 
     Args:
         path (str): Any file.
+        algorithm (Optional[str]): See HASH_ALGORITHMS.
 
     Returns:
-        str: md5 digest hex string.
+        bytes: digest bytes
     """
-    hasher = hashlib.md5()
-    with open(path, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-        return hasher.hexdigest()
-
-
-def same_hash(path1, path2):
-    # Based on https://stackoverflow.com/a/36873550/4541104 by unutbu
-    digests = []
-    for path in (path1, path2):
-        hasher = hashlib.md5()
-        with open(path, 'rb') as f:
-            buf = f.read()
-            hasher.update(buf)
-            a = hasher.hexdigest()
-            digests.append(a)
-
-    return digests[0] == digests[1]
+    return hash_file(path, algorithm=algorithm).digest()
+
+
+def get_hexdigest(path, algorithm="md5"):
+    """Get digest hex-encoded string.
+
+    Args:
+        path (str): Any file.
+        algorithm (Optional[str]): See HASH_ALGORITHMS.
+
+    Returns:
+        str: digest hex string.
+    """
+    return hash_file(path, algorithm=algorithm).hexdigest()
+
+
+def get_hexdigests(paths, algorithm="md5", jobs=None):
+    """Get the digest hex string of several files using threads.
+
+    Args:
+        paths (Iterable[str]): Any files.
+        algorithm (Optional[str]): See HASH_ALGORITHMS.
+        jobs (Optional[int]): Hash this many files at once (None or 0
+            for os.cpu_count()).
+
+    Returns:
+        OrderedDict[str, str]: The digest hex string for each path (in
+            the order of paths).
+    """
+    paths = list(paths)
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    hexdigests = OrderedDict()
+    if (jobs < 2) or (len(paths) < 2):
+        for path in paths:
+            hexdigests[path] = get_hexdigest(path, algorithm=algorithm)
+        return hexdigests
+    with ThreadPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        results = executor.map(
+            lambda path: get_hexdigest(path, algorithm=algorithm),
+            paths,
+        )
+        for path, hexdigest in zip(paths, results):
+            hexdigests[path] = hexdigest
+    return hexdigests
+
+
+def is_unchanged(src_path, dst_path, verify_hash=True, hash_cache=None):
+    '''Check whether dst_path already has the content of src_path.
+
+    The size and mtime are compared first, so the content is only read
+    if the size matches but mtime doesn't (such as after extracting an
+    archive again).
+
+    Args:
+        src_path (str): Any file.
+        dst_path (str): Any path (False if it isn't a file).
+        verify_hash (Optional[bool]): Compare the content if mtime
+            differs. If False, a different mtime means changed.
+        hash_cache (Optional[HashCache]): If not None, compare cached
+            hashes (See hierosoft.hashcache) instead of reading both
+            files every time.
+
+    Returns:
+        bool: True if the size and either mtime or content match.
+    '''
+    try:
+        src_stat = os.stat(src_path)
+        dst_stat = os.stat(dst_path)
+    except OSError:
+        return False
+    if not stat.S_ISREG(dst_stat.st_mode):
+        return False
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    if not verify_hash:
+        return False
+    if hash_cache is not None:
+        return (hash_cache.get_hexdigest(src_path, st=src_stat)
+                == hash_cache.get_hexdigest(dst_path, st=dst_stat))
+    return same_hash(src_path, dst_path)
+
+
+def same_hash(path1, path2, chunk_size=HASH_CHUNK_SIZE):
+    """Check whether two files have the same content.
+
+    Files of different sizes differ without reading either. Otherwise
+    the files are compared a chunk at a time (which is faster than
+    hashing both), stopping at the first chunk that differs.
+
+    Args:
+        path1 (str): Any file.
+        path2 (str): Any file.
+        chunk_size (Optional[int]): Bytes to read at a time.
+
+    Returns:
+        bool: True if the content is the same.
+    """
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    buf1 = bytearray(chunk_size)
+    buf2 = bytearray(chunk_size)
+    view1 = memoryview(buf1)
+    view2 = memoryview(buf2)
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        while True:
+            count1 = f1.readinto(buf1)
+            count2 = f2.readinto(buf2)
+            if count1 != count2:
+                return False  # The file changed meanwhile.
+            if not count1:
+                return True
+            if view1[:count1] != view2[:count2]:
+                return False
 
 
 def os_version_info():
@@ -106,6 +106,7 @@ from hierosoft import (  # noqa F401
     write2,
     number_to_place,
 )
+from hierosoft.progresswriter import ProgressAggregator
 
 
 def valid_ip_address(value, allow_broadcast=False, allow_netmask=False):
@@ -606,7 +607,10 @@ def download(stream, url, cb_progress=None, cb_done=None,
         url (str): The internet address to read.
         cb_progress (Callable, optional): The callback (function) that
             receives the amount of data read so far. It must receive an
-            event in the form of a dictionary as the only argument.
+            event in the form of a dictionary as the only argument. It
+            is called at most every PROGRESS_INTERVAL seconds with a
+            snapshot (See ProgressAggregator) including 'loaded',
+            'rate' and 'eta'.
         cb_done (Callable, optional): The callback (function) that is
             called when the download has completed. It must receive an
             event in the form of a dictionary as the only argument.
@@ -617,7 +621,8 @@ def download(stream, url, cb_progress=None, cb_done=None,
             callbacks. It can also have special keys such as:
             - total_size (int): If not None, the callbacks will not only
               receive the number of bytes written ('loaded') but also
-              'ratio' based on this denominator.
+              'ratio' based on this denominator. Defaults to the
+              Content-Length of the response, if any.
         path (str, optional): Provide the path to the file that is
             equivalent to the content, for logging purposes only.
 
@@ -665,19 +670,20 @@ def download(stream, url, cb_progress=None, cb_done=None,
     #    getaddrinfo failed")
     # ^ raises urllib.error.HTTPError (or Python 2 urllib2.HTTPError)
     #   in case of "HTTP Error 404: Not Found"
-    # evt['total'] is not implemented (would be from contentlength
-    # aka content-length)
+    if evt.get('total_size') is None:
+        length = response.info().get('Content-Length')
+        if length and length.isdigit():
+            evt['total_size'] = int(length)
+    progress = ProgressAggregator(cb_progress, evt=evt)
     # with open(file_path, 'wb') as f:
     while True:
         chunk = response.read(chunk_size)
         if not chunk:
             break
-        evt['loaded'] += chunk_size
-        if evt.get('total_size') is not None:
-            evt['ratio'] = float(evt['loaded']) / float(evt['total_size'])
-        cb_progress(evt)
         # echo0("* writing")
         stream.write(chunk)
+        progress.add(len(chunk))
+    progress.finish()
     evt['status'] = STATUS_DONE
     # if evt.get('status') != STATUS_DONE:
     #     evt['status'] = "failed"
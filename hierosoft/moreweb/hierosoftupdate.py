@@ -350,6 +350,10 @@ class HierosoftUpdate(object):
         message = event.get('message')
         if message:
             self.set_status_after(message)
+        elif event.get('ratio') is not None:
+            # progress from install_archive (See install_streamed)
+            self.set_status_after("Installing... {}%".format(
+                int(round(event['ratio'] * 100))))
         else:
             self.set_status_after("Unknown event: {}".format(event))
 
@@ -947,10 +951,16 @@ class HierosoftUpdate(object):
         Before adding an event to self.events, making a deepcopy is
         recommended (especially before adding 'command' where
         applicable).
+
+        Consecutive "d_progress" events are coalesced (only the newest
+        is processed), so the GUI doesn't redraw for stale progress.
         '''
         while len(self.events) > 0:
-            event = self.events[0]
-            del self.events[0]
+            event = self.events.pop(0)
+            # ^ pop is atomic, so another thread may append meanwhile.
+            if ((event.get('command') == "d_progress") and self.events
+                    and (self.events[0].get('command') == "d_progress")):
+                continue
             try:
                 self._process_event(event)
             except Exception as ex:
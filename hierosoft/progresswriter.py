@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
+from __future__ import division
 import sys
 
+from timeit import default_timer
+
+PROGRESS_INTERVAL = .25
+# ^ ProgressAggregator default: Send at most one snapshot per this many
+#   seconds (not counting forced ones).
+
 
 class ProgressWriter:
     cli_print_delta = 1024 * 400  # 1024 * 400 is 400K
@@ -45,3 +52,102 @@ class ProgressWriter:
                 "\rsize={}  ".format(hr)
             )
         sys.stderr.flush()
+
+
+class ProgressAggregator(object):
+    """Coalesce progress updates into snapshots sent at a limited rate.
+
+    The producer (such as a download loop or an installer) updates the
+    counters as often as it wants (add is only an addition and a clock
+    check), and callback receives a snapshot (a new dict copied from
+    evt, so it can be queued for another thread without a lock) at most
+    once per interval, plus once when finish is called. Only the
+    producer's thread should call add, update or finish.
+
+    Each snapshot has the keys of evt, plus:
+    - 'ratio': done / total (only if total is known).
+    - 'rate': Bytes per second since the first update (or None).
+    - 'eta': Estimated seconds remaining (None if total or rate is
+      unknown).
+
+    Args:
+        callback (Callable): Receives each snapshot (dict).
+        evt (Optional[dict]): The event template, updated in place
+            (done_key is added to by add).
+        interval (Optional[float]): Minimum seconds between snapshots.
+            Defaults to PROGRESS_INTERVAL.
+        done_key (Optional[str]): The key in evt for bytes done.
+        total_key (Optional[str]): The key in evt for total bytes
+            (None or missing if unknown).
+        refresh (Optional[Callable]): If not None, called with evt
+            before each snapshot, so a producer can store its counters
+            in evt only when a snapshot is needed.
+    """
+    def __init__(self, callback, evt=None, interval=PROGRESS_INTERVAL,
+                 done_key='loaded', total_key='total_size', refresh=None):
+        if evt is None:
+            evt = {}
+        self.callback = callback
+        self.evt = evt
+        self.interval = interval
+        self.done_key = done_key
+        self.total_key = total_key
+        self.refresh = refresh
+        self.start_sec = None
+        self.start_done = 0
+        self.last_sec = None
+        self.emit_count = 0
+
+    def add(self, byte_count):
+        """Add to evt[done_key] then send a snapshot if it is time."""
+        self.evt[self.done_key] = self.evt.get(self.done_key, 0) + byte_count
+        return self.update()
+
+    def update(self, force=False):
+        """Send a snapshot if interval passed since the last one.
+
+        Args:
+            force (bool, optional): Send one either way.
+
+        Returns:
+            bool: True if a snapshot was sent.
+        """
+        now = default_timer()
+        if self.start_sec is None:
+            self.start_sec = now
+            if self.refresh is not None:
+                self.refresh(self.evt)
+            self.start_done = self.evt.get(self.done_key) or 0
+        elif ((not force) and (self.last_sec is not None)
+                and (now - self.last_sec < self.interval)):
+            return False
+        self.last_sec = now
+        self.emit_count += 1
+        self.callback(self.snapshot(now))
+        return True
+
+    def finish(self):
+        """Send a final snapshot (even if one was just sent)."""
+        return self.update(force=True)
+
+    def snapshot(self, now=None):
+        """Get a copy of evt with 'ratio', 'rate' and 'eta' added."""
+        if now is None:
+            now = default_timer()
+        if self.refresh is not None:
+            self.refresh(self.evt)
+        snapshot = dict(self.evt)
+        done = snapshot.get(self.done_key) or 0
+        total = snapshot.get(self.total_key)
+        rate = None
+        eta = None
+        elapsed = now - self.start_sec if self.start_sec is not None else 0
+        if elapsed > 0:
+            rate = (done - self.start_done) / elapsed
+        if total:
+            snapshot['ratio'] = done / total
+            if rate:
+                eta = max(total - done, 0) / rate
+        snapshot['rate'] = rate
+        snapshot['eta'] = eta
+        return snapshot
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for hierosoft.ggrep (not run by the test suite).
+
+A synthetic tree is generated (See make_tree) with nested .gitignore
+files (including "!" and "**" rules), binary blobs and symlink loops,
+then filter_tree, is_like_any and ggrep are timed and the results are
+written as JSON, so regressions in the walker or matcher show up as
+numbers.
+
+Usage:
+    python tests/bench_ggrep.py [--depth N] [--fanout N] [--files N]
+        [--size BYTES] [--jobs N] [--repeat N] [--root DIR]
+
+Each benchmark reports:
+- 'seconds': The fastest of --repeat runs.
+- 'files_per_sec': Paths yielded (filter_tree) or files read (ggrep).
+- 'mb_per_sec': MB read per second (ggrep only).
+- 'read_syscalls', 'write_syscalls': From /proc/self/io (Linux only,
+  otherwise None; worker processes are not counted).
+- 'peak_rss_kb': The peak resident set size of this process (and of
+  worker processes for ggrep with --jobs) so far (None if the resource
+  module isn't available).
+'''
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+from hierosoft.ggrep import (  # noqa: E402
+    default_excludes,
+    default_includes,
+    filter_tree,
+    ggrep,
+    is_like_any,
+)
+
+BENCH_NAMES = [
+    "main.py", "readme.md", "ggrep.cpython-38.pyc", "index.html",
+    "CMakeLists.txt", "libfoo.so.1", "node_modules", "player_anim.lua",
+    "a_much_longer_file_name_without_an_extension",
+]
+
+BENCH_GITIGNORE = """*.log
+!keep.log
+**/build/
+/generated_*
+"""
+
+BENCH_WORDS = ["alpha", "beta", "gamma", "delta", "def", "return",
+               "self", "value", "index", "path"]
+
+BENCH_NEEDLE = "needle_42"
+
+
+def make_tree(root, depth=3, fanout=4, files=8, size=4096, seed=0):
+    '''Generate a synthetic tree to search.
+
+    Each directory gets files text files (.py and .txt, about size bytes
+    each, where about one in four contains BENCH_NEEDLE), a binary blob
+    with an included extension, .log files (one of them kept by a "!"
+    rule), a "build" directory (ignored by a "**" rule) and, below the
+    root, a symlink to its parent (a loop that filter_tree must not
+    follow forever). Each directory at depth 1 gets a .gitignore.
+
+    The walk is iterative so that deep trees don't hit the recursion
+    limit.
+
+    Args:
+        root (str): An existing empty directory.
+        depth (int, optional): How many levels of directories.
+        fanout (int, optional): Subdirectories per directory.
+        files (int, optional): Text files per directory.
+        size (int, optional): Approximate bytes per text file.
+        seed (int, optional): The random seed (so trees are
+            reproducible).
+    '''
+    rand = random.Random(seed)
+    stack = [(root, 0)]
+    while stack:
+        parent, level = stack.pop()
+        for i in range(files):
+            ext = ".py" if (i % 2 == 0) else ".txt"
+            lines = []
+            length = 0
+            while length < size:
+                line = " ".join(rand.choice(BENCH_WORDS) for _ in range(8))
+                lines.append(line)
+                length += len(line) + 1
+            if i % 4 == 0:
+                lines[rand.randrange(len(lines))] += " " + BENCH_NEEDLE
+            with open(os.path.join(parent, "file{}{}".format(i, ext)),
+                      'w') as outs:
+                outs.write("\n".join(lines) + "\n")
+        with open(os.path.join(parent, "blob.txt"), 'wb') as outs:
+            outs.write(b"\0" + bytes(bytearray(
+                rand.randrange(256) for _ in range(size)
+            )))
+        for name in ("debug.log", "keep.log", "generated_1.txt"):
+            with open(os.path.join(parent, name), 'w') as outs:
+                outs.write(BENCH_NEEDLE + "\n")
+        build = os.path.join(parent, "build")
+        os.mkdir(build)
+        with open(os.path.join(build, "out.txt"), 'w') as outs:
+            outs.write(BENCH_NEEDLE + "\n")
+        if level == 1:
+            with open(os.path.join(parent, ".gitignore"), 'w') as outs:
+                outs.write(BENCH_GITIGNORE)
+        if level > 0:
+            try:
+                os.symlink("..", os.path.join(parent, "loop"))
+            except (OSError, NotImplementedError):
+                pass  # Symlinks may require privileges on Windows.
+        if level >= depth:
+            continue
+        for i in range(fanout):
+            sub = os.path.join(parent, "dir{}".format(i))
+            os.mkdir(sub)
+            stack.append((sub, level + 1))
+
+
+def _io_counts():
+    '''Get (read syscalls, write syscalls) so far, or (None, None).'''
+    try:
+        with open("/proc/self/io", 'r') as ins:
+            counts = {}
+            for line in ins:
+                key, _, value = line.partition(":")
+                counts[key] = int(value)
+        return counts['syscr'], counts['syscw']
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss_kb(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        peak = max(peak,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == "darwin":
+        peak //= 1024  # It is in bytes on macOS.
+    return peak
+
+
+def measure(fn, repeat=3, children=False):
+    '''Run fn repeat times and keep the fastest.
+
+    Args:
+        fn (Callable): A function that returns a dict with 'files'
+            (count) and optionally 'mb'.
+        children (bool, optional): Include the peak RSS of worker
+            processes.
+
+    Returns:
+        dict: The benchmark results (See the module documentation).
+    '''
+    best = None
+    for _ in range(repeat):
+        reads, writes = _io_counts()
+        start = time.perf_counter()
+        done = fn()
+        seconds = time.perf_counter() - start
+        reads2, writes2 = _io_counts()
+        if (best is not None) and (seconds >= best['seconds']):
+            continue
+        best = {
+            'seconds': seconds,
+            'files': done['files'],
+            'files_per_sec': done['files'] / seconds,
+            'read_syscalls': None,
+            'write_syscalls': None,
+        }
+        if 'mb' in done:
+            best['mb'] = done['mb']
+            best['mb_per_sec'] = done['mb'] / seconds
+        if reads is not None:
+            best['read_syscalls'] = reads2 - reads
+            best['write_syscalls'] = writes2 - writes
+    best['peak_rss_kb'] = _peak_rss_kb(children=children)
+    return best
+
+
+def bench_is_like(number=2000):
+    '''Time is_like_any for typical names against the default filters.
+
+    Args:
+        number (int, optional): How many times to check every name.
+
+    Returns:
+        dict: 'calls' (the number of is_like_any calls) and 'per_sec'.
+    '''
+    needles = default_includes + default_excludes
+
+    def check_all():
+        for name in BENCH_NAMES:
+            is_like_any(name, needles)
+
+    seconds = timeit.timeit(check_all, number=number)
+    calls = number * len(BENCH_NAMES)
+    return {
+        'calls': calls,
+        'per_sec': calls / seconds,
+    }
+
+
+def bench_tree(root, jobs=None, repeat=3):
+    '''Time filter_tree and ggrep on a tree (See make_tree).
+
+    Returns:
+        dict: The results of measure for each benchmark.
+    '''
+    def walk():
+        return {'files': sum(1 for _ in filter_tree(root))}
+
+    def search(jobs=None):
+        results = ggrep(BENCH_NEEDLE, root, jobs=jobs)
+        return {'files': results['read_count'], 'mb': results['read_mb']}
+
+    report = {
+        'filter_tree': measure(walk, repeat=repeat),
+        'ggrep': measure(search, repeat=repeat),
+    }
+    if jobs is not None:
+        report['ggrep_jobs'] = measure(lambda: search(jobs=jobs),
+                                       repeat=repeat, children=True)
+        report['ggrep_jobs']['jobs'] = jobs
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark ggrep on a synthetic tree.'
+    )
+    parser.add_argument('--depth', type=int, default=3,
+                        help='Levels of directories (default: 3)')
+    parser.add_argument('--fanout', type=int, default=4,
+                        help='Subdirectories per directory (default: 4)')
+    parser.add_argument('--files', type=int, default=8,
+                        help='Text files per directory (default: 8)')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='Approximate bytes per file (default: 4096)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Also time ggrep with this many processes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Keep the fastest of this many runs')
+    parser.add_argument('--root', type=str, default=None,
+                        help=('Generate the tree in this (empty or new)'
+                              ' directory and keep it (default: a'
+                              ' temporary directory)'))
+    args = parser.parse_args()
+    root = args.root
+    tmp = None
+    if root is None:
+        tmp = tempfile.mkdtemp(prefix="bench_ggrep-")
+        root = tmp
+    elif not os.path.isdir(root):
+        os.makedirs(root)
+    try:
+        start = time.perf_counter()
+        make_tree(root, depth=args.depth, fanout=args.fanout,
+                  files=args.files, size=args.size)
+        report = {
+            'tree': {
+                'depth': args.depth,
+                'fanout': args.fanout,
+                'files': args.files,
+                'size': args.size,
+                'seconds_to_generate': time.perf_counter() - start,
+            },
+            'is_like_any': bench_is_like(),
+        }
+        report.update(bench_tree(root, jobs=args.jobs, repeat=args.repeat))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
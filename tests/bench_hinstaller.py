@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for the install path (not run by the test suite).
+
+A synthetic package tree is generated (See make_package) with many tiny
+files (of varied sizes), a few huge files, a deep chain of directories
+and symlinks, then each phase below is timed in a tmpfs directory (such
+as /dev/shm, if any) and in a disk-backed temporary directory:
+- 'simulate': HInstaller._install(simulate=True) into an empty dst.
+- 'install': The real install (running the simulated manifest).
+- 'sync': Simulate and install again (every file is unchanged).
+- 'uninstall': Run the generated uninstall script with sh (None if
+  there is no sh).
+- 'install_folder': moreplatform.install_folder with "sync" into an
+  empty dst.
+- 'install_archive': moreplatform.install_archive of a zip of the
+  package (extract, then move) into an empty dst.
+
+The HInstaller phases write the install log, uninstall script and JSONL
+manifest to files (as install() does, but not the metadata files that
+install() writes under the user's LOCALAPPDATA).
+
+Usage:
+    python tests/bench_hinstaller.py [--tiny N] [--tiny-size BYTES]
+        [--huge N] [--huge-size MB] [--depth N] [--symlinks N]
+        [--jobs N] [--repeat N] [--disk-dir DIR] [--tmpfs-dir DIR]
+
+Each phase reports (See also bench_ggrep.measure):
+- 'seconds': The fastest of --repeat runs.
+- 'files_per_sec', 'mb_per_sec': Files and MB in the package per
+  second.
+- 'read_syscalls', 'write_syscalls': From /proc/self/io (Linux only,
+  otherwise None).
+- 'logging_seconds': Time in HInstaller's log writers (install log,
+  uninstall script and JSONL manifest).
+- 'copying_seconds': Time in HInstaller._copy_file (summed over threads
+  if --jobs).
+- 'manifest_copies': Files the manifest copies ('simulate' and 'sync'
+  only, so a sync that copies unchanged files shows up).
+'''
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from bench_ggrep import (  # noqa: E402
+    _io_counts,
+)
+from hierosoft.hinstaller import (  # noqa: E402
+    BatchedLog,
+    HInstaller,
+    OP_COPY,
+)
+from hierosoft.moreplatform import (  # noqa: E402
+    install_archive,
+    install_folder,
+)
+
+TMPFS_DIRS = ["/dev/shm", "/run/user/{}".format(getattr(os, 'getuid',
+                                                        lambda: 0)())]
+
+
+def make_package(root, tiny=2000, tiny_size=512, huge=2, huge_size=32,
+                 depth=8, symlinks=20, fanout=8, seed=0):
+    '''Generate a synthetic package tree.
+
+    Args:
+        root (str): A directory to create.
+        tiny (int, optional): How many small files (spread over fanout
+            directories, each with fanout subdirectories).
+        tiny_size (int, optional): The mean size of small files (each is
+            0 to 2 times this).
+        huge (int, optional): How many huge files.
+        huge_size (int, optional): Size of each huge file in MB.
+        depth (int, optional): How deep a chain of nested directories
+            (with a file in each) to add.
+        symlinks (int, optional): How many (relative) symlinks to small
+            files to add.
+        fanout (int, optional): See tiny.
+        seed (int, optional): The random seed (so trees are
+            reproducible).
+
+    Returns:
+        dict: 'files' (count, including symlinks) and 'bytes'.
+    '''
+    rand = random.Random(seed)
+    os.makedirs(root)
+    files = 0
+    total = 0
+    tiny_rels = []
+    for i in range(tiny):
+        parent = os.path.join("lib{}".format(i % fanout),
+                              "mod{}".format((i // fanout) % fanout))
+        if not os.path.isdir(os.path.join(root, parent)):
+            os.makedirs(os.path.join(root, parent))
+        rel = os.path.join(parent, "file{}.py".format(i))
+        size = rand.randrange(2 * tiny_size + 1)
+        with open(os.path.join(root, rel), 'wb') as outs:
+            outs.write(bytes(bytearray(rand.randrange(32, 127)
+                                       for _ in range(size))))
+        tiny_rels.append(rel)
+        files += 1
+        total += size
+    block = os.urandom(1024 * 1024)
+    os.makedirs(os.path.join(root, "data"))
+    for i in range(huge):
+        with open(os.path.join(root, "data", "blob{}.bin".format(i)),
+                  'wb') as outs:
+            for _ in range(huge_size):
+                outs.write(block)
+        files += 1
+        total += huge_size * len(block)
+    parent = root
+    for i in range(depth):
+        parent = os.path.join(parent, "level{}".format(i))
+        os.mkdir(parent)
+        with open(os.path.join(parent, "readme.txt"), 'w') as outs:
+            outs.write("level {}\n".format(i))
+        files += 1
+        total += os.path.getsize(os.path.join(parent, "readme.txt"))
+    if tiny_rels:
+        os.makedirs(os.path.join(root, "links"))
+    for i in range(symlinks if tiny_rels else 0):
+        target = os.path.join("..", rand.choice(tiny_rels))
+        try:
+            os.symlink(target,
+                       os.path.join(root, "links", "link{}.py".format(i)))
+        except (OSError, NotImplementedError):
+            break  # Symlinks may require privileges on Windows.
+        files += 1
+    return {'files': files, 'bytes': total}
+
+
+class Timer(object):
+    '''Total the time spent in wrapped functions (from any thread).'''
+    def __init__(self):
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def wrap(self, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.seconds += elapsed
+        return timed
+
+
+def no_callback(evt):
+    pass
+
+
+class InstallRun(object):
+    '''Run HInstaller passes on one dst, timing logging and copying.
+
+    Args:
+        src (str): The package.
+        dst (str): Where to install.
+        work (str): Where to write the logs.
+        jobs (Optional[int]): See HInstaller.run_manifest.
+    '''
+    def __init__(self, src, dst, work, jobs=None):
+        self.src = src
+        self.dst = dst
+        self.work = work
+        self.jobs = jobs
+        self.logging = Timer()
+        self.copying = Timer()
+        self.installer = HInstaller(src, dst, {
+            'keeps': [],
+            'replaces': [],
+            'shortcut_exe_relpaths': [],
+            'version_path': None,
+        })
+        installer = self.installer
+        installer._copy_file = self.copying.wrap(installer._copy_file)
+        installer.append_install = \
+            self.logging.wrap(installer.append_install)
+        installer.append_undo = self.logging.wrap(installer.append_undo)
+        self.uninstall_script = os.path.join(work, "uninstall.sh")
+
+    def run(self, simulate):
+        '''Run one pass (The logs are rewritten each time).'''
+        installer = self.installer
+        with open(os.path.join(self.work, "install.log"), 'w') as redo, \
+                open(self.uninstall_script, 'w') as undo, \
+                open(os.path.join(self.work, "install.jsonl"), 'w') as ops:
+            logs = [BatchedLog(redo), BatchedLog(undo), BatchedLog(ops)]
+            for log in logs:
+                log.write = self.logging.wrap(log.write)
+                log.sync = self.logging.wrap(log.sync)
+            installer.ops_log = logs[2]
+            results = installer._install(undo=logs[1], redo=logs[0],
+                                         evt={}, callback=no_callback,
+                                         simulate=simulate, jobs=self.jobs)
+            if not simulate:
+                for line in sorted(installer.rmdir_lines, key=len,
+                                   reverse=True):
+                    logs[1].write(line)  # as after_install does
+                logs[1].flush()
+        installer.ops_log = None
+        if results.get('error'):
+            raise RuntimeError(results['error'])
+        return results
+
+
+def timed(fn, package, run=None):
+    '''Run fn once and get the phase results (See module docs).
+
+    Args:
+        run (Optional[InstallRun]): Report its logging and copying time.
+    '''
+    if run is not None:
+        run.logging.seconds = run.copying.seconds = 0.0
+    reads, writes = _io_counts()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    reads2, writes2 = _io_counts()
+    result = {
+        'seconds': seconds,
+        'files_per_sec': package['files'] / seconds,
+        'mb_per_sec': package['bytes'] / 1024 / 1024 / seconds,
+        'read_syscalls': None,
+        'write_syscalls': None,
+    }
+    if reads is not None:
+        result['read_syscalls'] = reads2 - reads
+        result['write_syscalls'] = writes2 - writes
+    if run is not None:
+        result['logging_seconds'] = run.logging.seconds
+        result['copying_seconds'] = run.copying.seconds
+    return result
+
+
+def bench_target(base, src, archive, package, jobs=None):
+    '''Time each phase once in base (a new empty directory).
+
+    Returns:
+        dict: The results of timed for each phase.
+    '''
+    report = {}
+    dst = os.path.join(base, "dst")
+    work = os.path.join(base, "work")
+    os.mkdir(work)
+    first = InstallRun(src, dst, work, jobs=jobs)
+    report['simulate'] = timed(lambda: first.run(True), package, first)
+    report['install'] = timed(lambda: first.run(False), package, first)
+
+    sync_work = os.path.join(base, "sync_work")
+    os.mkdir(sync_work)
+    sync = InstallRun(src, dst, sync_work, jobs=jobs)
+
+    def run_sync():
+        sync.run(True)
+        sync.run(False)
+
+    report['sync'] = timed(run_sync, package, sync)
+    report['simulate']['manifest_copies'] = sum(
+        1 for op in first.installer.manifest if op.op == OP_COPY)
+    report['sync']['manifest_copies'] = sum(
+        1 for op in sync.installer.manifest if op.op == OP_COPY)
+
+    sh = shutil.which("sh")
+    report['uninstall'] = None
+    if sh is not None:
+        report['uninstall'] = timed(
+            lambda: subprocess.check_call([sh, first.uninstall_script],
+                                          stderr=subprocess.DEVNULL),
+            package,
+        )
+    shutil.rmtree(dst, ignore_errors=True)
+
+    folder_dst = os.path.join(base, "folder_dst")
+    report['install_folder'] = timed(
+        lambda: install_folder(src, folder_dst, {'exists_action': "sync"}),
+        package,
+    )
+    shutil.rmtree(folder_dst)
+
+    archive_dst = os.path.join(base, "archive_dst")
+    report['install_archive'] = timed(
+        lambda: install_archive(archive, archive_dst, remove_archive=False,
+                                status_cb=no_callback),
+        package,
+    )
+    shutil.rmtree(archive_dst)
+    return report
+
+
+def get_fs_type(path):
+    '''Get the filesystem type of path from /proc/mounts (or None).'''
+    path = os.path.realpath(path)
+    best = ""
+    fs_type = None
+    try:
+        with open("/proc/mounts", 'r') as ins:
+            for line in ins:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount = parts[1]
+                if ((path == mount or path.startswith(mount.rstrip("/")+"/"))
+                        and len(mount) > len(best)):
+                    best = mount
+                    fs_type = parts[2]
+    except (IOError, OSError):
+        return None
+    return fs_type
+
+
+def find_tmpfs():
+    for path in TMPFS_DIRS:
+        if os.path.isdir(path) and os.access(path, os.W_OK):
+            return path
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark installing a synthetic package.'
+    )
+    parser.add_argument('--tiny', type=int, default=2000,
+                        help='Small files (default: 2000)')
+    parser.add_argument('--tiny-size', type=int, default=512,
+                        help='Mean bytes per small file (default: 512)')
+    parser.add_argument('--huge', type=int, default=2,
+                        help='Huge files (default: 2)')
+    parser.add_argument('--huge-size', type=int, default=32,
+                        help='MB per huge file (default: 32)')
+    parser.add_argument('--depth', type=int, default=8,
+                        help='Nested directory levels (default: 8)')
+    parser.add_argument('--symlinks', type=int, default=20,
+                        help='Symlinks (default: 20)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Copy this many files at once')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Keep the fastest of this many runs')
+    parser.add_argument('--disk-dir', type=str, default=None,
+                        help=('Parent for the disk-backed temporary'
+                              ' directory (default: the system default)'))
+    parser.add_argument('--tmpfs-dir', type=str, default=None,
+                        help=('Parent for the tmpfs temporary directory'
+                              ' (default: the first of {} that exists)'
+                              ''.format(TMPFS_DIRS)))
+    args = parser.parse_args()
+    targets = [('disk', args.disk_dir or tempfile.gettempdir())]
+    tmpfs = args.tmpfs_dir or find_tmpfs()
+    if tmpfs is not None:
+        targets.append(('tmpfs', tmpfs))
+    report = {'package': None, 'jobs': args.jobs, 'targets': {}}
+    for name, parent in targets:
+        tmp = tempfile.mkdtemp(prefix="bench_hinstaller-", dir=parent)
+        try:
+            src = os.path.join(tmp, "package")
+            start = time.perf_counter()
+            package = make_package(
+                src, tiny=args.tiny, tiny_size=args.tiny_size,
+                huge=args.huge, huge_size=args.huge_size, depth=args.depth,
+                symlinks=args.symlinks,
+            )
+            package['seconds_to_generate'] = time.perf_counter() - start
+            report['package'] = package
+            archive = os.path.join(tmp, "package.zip")
+            with zipfile.ZipFile(archive, 'w') as outs:
+                for parent_path, _, names in os.walk(src):
+                    for file_name in names:
+                        path = os.path.join(parent_path, file_name)
+                        outs.write(path, os.path.relpath(path, src))
+            best = None
+            for i in range(args.repeat):
+                base = os.path.join(tmp, "run{}".format(i))
+                os.mkdir(base)
+                results = bench_target(base, src, archive, package,
+                                       jobs=args.jobs)
+                shutil.rmtree(base)
+                if best is None:
+                    best = results
+                    continue
+                for phase, result in results.items():
+                    if (result is not None) and (
+                            result['seconds'] < best[phase]['seconds']):
+                        best[phase] = result
+            best['dir'] = parent
+            best['fs_type'] = get_fs_type(parent)
+            report['targets'][name] = best
+        finally:
+            shutil.rmtree(tmp)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
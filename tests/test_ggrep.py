@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import mmap
 import unittest
 import sys
 import os
+import tempfile
 
 TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
 # MODULE_DIR = os.path.dirname(MY_DIR)
@@ -22,7 +24,20 @@ from hierosoft import (
 from hierosoft.ggrep import (
     is_like,
     is_like_any,
+    compile_like,
     filter_tree,
+    ggrep,
+    iter_ggrep,
+    GrepMatch,
+    IgnoreRules,
+    IGNORED,
+    KEPT,
+    PatternMatcher,
+    LITERAL,
+    LITERAL_ICASE,
+    REGEX,
+    REGEX_TEXT,
+    MMAP_MIN_SIZE,
 )
 
 class TestGrepStringMethods(unittest.TestCase):
@@ -65,6 +80,12 @@ class TestGrepStringMethods(unittest.TestCase):
         self.assertEqual(is_like("abcdecde", "*cde"), True)
         self.assertEqual(is_like("abcabcde", "abc*"), True)
         self.assertEqual(is_like("/home/foo", "*/foo"), True)
+        self.assertEqual(is_like("abbb", "*?"), True)
+        self.assertEqual(is_like("aabab/", "a*?"), True)
+        self.assertEqual(is_like("abc.tar.gz", "*.t?r.*"), True)
+        self.assertEqual(is_like("abc.tar", "*.t?r.*"), False)
+        self.assertEqual(is_like("", "*"), True)
+        self.assertIs(compile_like("*.py"), compile_like("*.py"))
         # As per <https://git-scm.com/docs/gitignore#:~:
         # text=Two%20consecutive%20asterisks%20(%22%20**%20%22,
         # means%20match%20in%20all%20directories.>:
@@ -186,6 +207,284 @@ class TestGrepStringMethods(unittest.TestCase):
         assert found_not_filtered_file
         assert found_exclusion
 
+    def test_ignore_rules(self):
+        root = os.path.join(TEST_DATA_DIR, "ignore_root")
+        rules = IgnoreRules(
+            [
+                "# comment",
+                "*.bin",
+                "/abs_only",
+                "dir_only/",
+                "Examples/d/**/example.d",
+                "**/anywhere.txt",
+                "docs/**",
+                "!keep.bin",
+            ],
+            root,
+        )
+
+        def verdict(rel, is_dir=False):
+            return rules.verdict(os.path.join(root, rel), is_dir)
+
+        self.assertEqual(verdict("a.bin"), IGNORED)
+        self.assertEqual(verdict(os.path.join("sub", "a.bin")), IGNORED)
+        self.assertEqual(verdict("keep.bin"), KEPT)
+        self.assertEqual(verdict("abs_only", is_dir=True), IGNORED)
+        self.assertEqual(verdict("abs_only"), IGNORED)
+        self.assertIsNone(verdict(os.path.join("sub", "abs_only")))
+        self.assertEqual(
+            verdict(os.path.join("sub", "dir_only"), is_dir=True),
+            IGNORED,
+        )
+        self.assertIsNone(verdict(os.path.join("sub", "dir_only")))
+        self.assertEqual(
+            verdict(os.path.join("Examples", "d", "example.d")),
+            IGNORED,
+        )
+        self.assertEqual(
+            verdict(os.path.join("Examples", "d", "foo", "example.d")),
+            IGNORED,
+        )
+        self.assertIsNone(verdict(".gitattributes"))
+        self.assertEqual(verdict("anywhere.txt"), IGNORED)
+        self.assertEqual(
+            verdict(os.path.join("a", "b", "anywhere.txt")),
+            IGNORED,
+        )
+        self.assertIsNone(verdict("docs", is_dir=True))
+        self.assertEqual(verdict(os.path.join("docs", "index.md")),
+                         IGNORED)
+        self.assertIsNone(verdict(""))
+
+        got_the_right_error = False
+        try:
+            IgnoreRules(["a/***/b"], root)
+        except ValueError:
+            got_the_right_error = True
+        self.assertEqual(got_the_right_error, True)
+
+    def test_ggrep_jobs(self):
+        serial = ggrep("def test_", TESTS_DIR, include="*.py")
+        self.assertGreater(serial['match_count'], 0)
+        parallel = ggrep("def test_", TESTS_DIR, include="*.py", jobs=2)
+        self.assertEqual(parallel['files'], serial['files'])
+        self.assertEqual(parallel['read_count'], serial['read_count'])
+        self.assertEqual(parallel['match_count'], serial['match_count'])
+        self.assertAlmostEqual(parallel['read_mb'], serial['read_mb'])
+
+    def test_iter_ggrep(self):
+        stats = {}
+        matches = iter_ggrep("def test_", TESTS_DIR, include="*.py",
+                             stats=stats)
+        first = next(matches)
+        self.assertIsInstance(first, GrepMatch)
+        self.assertEqual(
+            first.line[first.start:first.end].decode("utf-8"),
+            "def test_",
+        )
+        matches.close()  # Stop early (The walk isn't finished).
+        self.assertLessEqual(stats['read_count'], 1)
+        for jobs in (None, 2):
+            results = ggrep("def test_", TESTS_DIR, include="*.py",
+                            jobs=jobs)
+            self.assertEqual(
+                ["{}:{}:{}".format(m.path, m.line_n, m.text)
+                 for m in iter_ggrep("def test_", TESTS_DIR,
+                                     include="*.py", jobs=jobs)],
+                results['files'],
+            )
+
+    def test_pattern_matcher(self):
+        data = b"a foo\r\nbar\n\nFoo(\nfoo bar\n"
+        matcher = PatternMatcher("foo")
+        self.assertEqual(matcher.strategy, LITERAL)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"a foo", 2, 5), (5, b"foo bar", 0, 3)])
+        matcher = PatternMatcher("foo", ignore_case=True)
+        self.assertEqual(matcher.strategy, LITERAL_ICASE)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"a foo", 2, 5), (4, b"Foo(", 0, 3),
+                          (5, b"foo bar", 0, 3)])
+        matcher = PatternMatcher("foo$")
+        self.assertEqual(matcher.strategy, REGEX)
+        self.assertEqual(PatternMatcher(r"a\.b").strategy, REGEX)
+        self.assertEqual(PatternMatcher("a.b").strategy, REGEX_TEXT)
+        self.assertEqual(PatternMatcher(r"\bfoo").strategy, REGEX_TEXT)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"a foo", 2, 5)])
+        # A match can't span lines (as in grep):
+        matcher = PatternMatcher(r"foo\s+bar")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(5, b"foo bar", 0, 7)])
+        # An invalid regex is plain text if allow_non_regex_pattern:
+        matcher = PatternMatcher("Foo(")
+        self.assertEqual(matcher.strategy, LITERAL)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(4, b"Foo(", 0, 4)])
+        # Offsets are in bytes even if the line is decoded to search:
+        matcher = PatternMatcher("b.r")
+        data = "\u00e9 bar\n".encode("utf-8")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, "\u00e9 bar".encode("utf-8"), 3, 6)])
+
+    def test_pattern_matcher_crlf(self):
+        # The "\r" of a "\r\n" is not part of the line (as in grep):
+        data = b"trailing \r\nnone\r\nlast\n"
+        matcher = PatternMatcher(r"\s+$")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"trailing ", 8, 9)])
+        matcher = PatternMatcher(r".$")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"trailing ", 8, 9), (2, b"none", 3, 4),
+                          (3, b"last", 3, 4)])
+        matcher = PatternMatcher(r"[^a-z]")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"trailing ", 8, 9)])
+        matcher = PatternMatcher(r"e$")
+        self.assertEqual(matcher.strategy, REGEX)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(2, b"none", 3, 4)])
+
+    def test_pattern_matcher_lone_cr(self):
+        # A lone "\r" ends a line (as when files were read in text mode):
+        data = b"alpha\rbeta\r\ngamma\r"
+        matcher = PatternMatcher("gamma")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(3, b"gamma", 0, 5)])
+        matcher = PatternMatcher("^beta$")
+        self.assertEqual(list(matcher.iter_lines(data, before=1)),
+                         [(1, b"alpha", None, None), (2, b"beta", 0, 4)])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "f.txt")
+            with open(path, 'wb') as outs:
+                outs.write(b"alpha\rbeta\rgamma\r")
+            results = ggrep("gamma", tmp)
+            self.assertEqual(results['files'],
+                             ["{}:3:gamma".format(path)])
+
+    def test_pattern_matcher_line_context(self):
+        # Anchors and lookaround apply to the line, not the file:
+        data = b"foo\r\nbar\n x\n"
+        with tempfile.TemporaryFile() as outs:
+            outs.write(data)
+            outs.flush()
+            mapped = mmap.mmap(outs.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for haystack in (data, mapped):
+                    matcher = PatternMatcher(r"o\Z")
+                    self.assertEqual(matcher.strategy, REGEX)
+                    self.assertEqual(list(matcher.iter_lines(haystack)),
+                                     [(1, b"foo", 2, 3)])
+                    matcher = PatternMatcher(r"\Abar")
+                    self.assertEqual(list(matcher.iter_lines(haystack)),
+                                     [(2, b"bar", 0, 3)])
+                    matcher = PatternMatcher(r"(?<!\n)[a-z]+")
+                    self.assertEqual(list(matcher.iter_lines(haystack)),
+                                     [(1, b"foo", 0, 3), (2, b"bar", 0, 3),
+                                      (3, b" x", 1, 2)])
+                    matcher = PatternMatcher(r"[a-z](?![^\n])")
+                    self.assertEqual(list(matcher.iter_lines(haystack)),
+                                     [(1, b"foo", 2, 3), (2, b"bar", 2, 3),
+                                      (3, b" x", 1, 2)])
+            finally:
+                mapped.close()
+
+    def test_pattern_matcher_flags(self):
+        data = b"a FOO\nfoo\nbar\n"
+        # Leading global flags still apply (they can't be wrapped):
+        matcher = PatternMatcher("(?i)foo")
+        self.assertEqual(matcher.strategy, REGEX)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(1, b"a FOO", 2, 5), (2, b"foo", 0, 3)])
+        matcher = PatternMatcher("(?i)^foo", allow_non_regex_pattern=False)
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(2, b"foo", 0, 3)])
+        matcher = PatternMatcher("(?x) b a r  # comment")
+        self.assertEqual(list(matcher.iter_lines(data)),
+                         [(3, b"bar", 0, 3)])
+
+
+    def test_ggrep_limits(self):
+        data = b"a\nfoo 1\nb\nc\nd\nfoo 2\ne\n"
+        matcher = PatternMatcher("foo")
+        self.assertEqual(
+            list(matcher.iter_lines(data, max_count=1, after=1)),
+            [(2, b"foo 1", 0, 3), (3, b"b", None, None)],
+        )
+        self.assertEqual(
+            [line_n for line_n, _, _, _
+             in matcher.iter_lines(data, before=3, after=2)],
+            [1, 2, 3, 4, 5, 6, 7],
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "x.py")
+            with open(path, 'wb') as outs:
+                outs.write(data)
+            results = ggrep("foo", tmp, files_with_matches=True)
+            self.assertEqual(results['files'], [path])
+            results = ggrep("foo", tmp, count=True)
+            self.assertEqual(results['files'], [path+":2"])
+            results = ggrep("foo", tmp, max_count=1)
+            self.assertEqual(results['files'], [path+":2:foo 1"])
+            results = ggrep("foo", tmp, before=1, after=0)
+            self.assertEqual(results['files'], [
+                path+"-1-a", path+":2:foo 1", "--",
+                path+"-5-d", path+":6:foo 2",
+            ])
+            self.assertEqual(results['line_count'], 2)
+
+    def test_ggrep_binary_and_mmap(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "asset.bin"), 'wb') as outs:
+                outs.write(b"PNG\0 needle\n")
+            big_path = os.path.join(tmp, "big.txt")
+            with open(big_path, 'wb') as outs:
+                line = b"x" * 99 + b"\n"
+                for _ in range(MMAP_MIN_SIZE // len(line) + 1):
+                    outs.write(line)
+                outs.write("needle \u00e9\n".encode("utf-8"))
+            for pattern in ("needle", r"^needle\s"):
+                results = ggrep(pattern, tmp)
+                self.assertEqual(results['binary_count'], 1)
+                self.assertEqual(results['read_count'], 1)
+                self.assertEqual(results['files'], [
+                    "{}:{}:needle \u00e9".format(
+                        big_path,
+                        MMAP_MIN_SIZE // len(line) + 2,
+                    )
+                ])
+
+
+    def test_filter_tree_walk(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, ".gitignore"), 'w') as outs:
+                outs.write("*.log\n")
+            deep = tmp
+            for _ in range(sys.getrecursionlimit() + 10):
+                # ^ Not os.makedirs, since it is recursive.
+                deep = os.path.join(deep, "d")
+                os.mkdir(deep)
+            for parent in (tmp, deep):
+                for name in ("a.txt", "a.log"):
+                    with open(os.path.join(parent, name), 'w') as outs:
+                        outs.write("a\n")
+            os.symlink("..", os.path.join(tmp, "d", "loop"))
+            paths = list(filter_tree(tmp))
+            self.assertIn(os.path.join(deep, "a.txt"), paths)
+            self.assertNotIn(os.path.join(deep, "a.log"), paths)
+            self.assertNotIn(os.path.join(tmp, "a.log"), paths)
+            self.assertNotIn(os.path.join(tmp, "d", "loop"), paths)
+            self.assertEqual(len(paths), len(set(paths)))
+            paths = list(filter_tree(tmp, gitignore=False))
+            self.assertIn(os.path.join(deep, "a.log"), paths)
+            os.remove(os.path.join(tmp, "d", "loop"))
+            while deep != tmp:
+                # ^ Not shutil.rmtree, since it is recursive.
+                for name in os.listdir(deep):
+                    os.remove(os.path.join(deep, name))
+                os.rmdir(deep)
+                deep = os.path.dirname(deep)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from hierosoft.ggrep import ggrep  # noqa: E402
+from hierosoft.ggrepindex import (  # noqa: E402
+    get_trigrams,
+    invalidate_indexes,
+    may_contain,
+)
+
+
+class TestGrepIndex(unittest.TestCase):
+
+    def test_may_contain(self):
+        trigrams = get_trigrams(b"def Hello_World():\n")
+        self.assertTrue(may_contain(trigrams, get_trigrams(b"hello")))
+        self.assertTrue(may_contain(trigrams, get_trigrams(b"o_W")))
+        self.assertFalse(may_contain(trigrams, get_trigrams(b"goodbye")))
+        self.assertTrue(may_contain(trigrams, get_trigrams(b"xy")))
+        # ^ A needle shorter than 3 bytes has no trigrams.
+        self.assertTrue(may_contain(None, get_trigrams(b"goodbye")))
+
+    def test_ggrep_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tree = os.path.join(tmp, "tree")
+            cache_dir = os.path.join(tmp, "cache")
+            os.mkdir(tree)
+            paths = []
+            for i in range(3):
+                paths.append(os.path.join(tree, "{}.txt".format(i)))
+                with open(paths[-1], 'w') as outs:
+                    outs.write("line {}\n".format(i))
+            with open(os.path.join(tree, "blob.bin"), 'wb') as outs:
+                outs.write(b"\0needle\n")
+
+            results = ggrep("needle", tree, use_index=True,
+                            cache_dir=cache_dir)
+            self.assertEqual(results['index_changed'], 4)
+            self.assertEqual(results['files'], [])
+            self.assertEqual(results['read_count'], 0)
+            self.assertEqual(results['index_skipped'], 3)
+            self.assertEqual(results['binary_count'], 1)
+
+            with open(paths[1], 'a') as outs:
+                outs.write("Needle\n")
+            st = os.stat(paths[1])
+            os.utime(paths[1], ns=(st.st_atime_ns,
+                                   st.st_mtime_ns + 1000000000))
+            # ^ Ensure mtime differs even on a coarse filesystem clock.
+            results = ggrep("needle", tree, use_index=True,
+                            cache_dir=cache_dir, ignore_case=True)
+            self.assertEqual(results['files'],
+                             ["{}:2:Needle".format(paths[1])])
+            self.assertEqual(results['read_count'], 1)
+            self.assertEqual(results['index_skipped'], 2)
+
+            results = ggrep("needle", tree, use_index=True,
+                            cache_dir=cache_dir, ignore_case=True)
+            self.assertEqual(results['index_changed'], 0)
+            self.assertEqual(len(results['files']), 1)
+
+            self.assertEqual(invalidate_indexes(cache_dir=cache_dir), 1)
+            results = ggrep("needle", tree, use_index=True,
+                            cache_dir=cache_dir)
+            self.assertEqual(results['index_changed'], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from hierosoft.hashcache import (  # noqa: E402
+    HashCache,
+)
+from hierosoft.moreplatform import (  # noqa: E402
+    is_unchanged,
+)
+
+
+def write_old(path, data):
+    with open(path, 'wb') as outs:
+        outs.write(data)
+    os.utime(path, (1, 1))
+
+
+@mock.patch("hierosoft.hashcache.HASH_CACHE_RACY_SECONDS", 0)
+# ^ Cache files changed just now (by the test).
+class TestHashCache(unittest.TestCase):
+
+    def test_hash_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "cache", "hashes.sqlite3")
+            paths = [os.path.join(tmp, "{}.bin".format(i)) for i in range(3)]
+            for i, path in enumerate(paths):
+                write_old(path, b"data" * (i + 1))
+            expected = {path: hashlib.md5(b"data" * (i + 1)).hexdigest()
+                        for i, path in enumerate(paths)}
+            with HashCache(db) as cache:
+                self.assertEqual(cache.get_hexdigests(paths, jobs=2),
+                                 expected)
+                self.assertEqual(cache.miss_count, 3)
+
+            def fail(*args, **kwargs):
+                raise AssertionError("The cache should be used.")
+
+            with HashCache(db) as cache:
+                with mock.patch("hierosoft.hashcache.get_hexdigest", fail):
+                    self.assertEqual(cache.get_hexdigest(paths[0]),
+                                     expected[paths[0]])
+                    self.assertFalse(cache.same_hash(paths[0], paths[1]))
+                self.assertEqual(cache.hit_count, 1)
+                write_old(paths[0], b"DATA")  # same size, replaced
+                os.utime(paths[0], (2, 2))
+                self.assertEqual(cache.get_hexdigest(paths[0]),
+                                 hashlib.md5(b"DATA").hexdigest())
+                self.assertEqual(
+                    cache.get_hexdigest(paths[1], algorithm="sha256"),
+                    hashlib.sha256(b"datadata").hexdigest(),
+                )
+
+            with HashCache(db, max_entries=2) as cache:
+                cache.get_hexdigest(paths[2])  # most recently used
+            with HashCache(db) as cache:
+                with mock.patch("hierosoft.hashcache.get_hexdigest", fail):
+                    cache.get_hexdigest(paths[2])
+
+    def test_is_unchanged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src.bin")
+            dst = os.path.join(tmp, "dst.bin")
+            write_old(src, b"same")
+            write_old(dst, b"same")
+            os.utime(dst, (2, 2))  # so the content must be compared
+            with HashCache(os.path.join(tmp, "hashes.sqlite3")) as cache:
+                self.assertTrue(is_unchanged(src, dst, hash_cache=cache))
+                self.assertTrue(is_unchanged(src, dst, hash_cache=cache))
+                self.assertEqual(cache.miss_count, 2)
+                write_old(dst, b"diff")
+                os.utime(dst, (2, 2))
+                self.assertFalse(is_unchanged(src, dst, hash_cache=cache))
+
+    def test_unavailable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a.bin")
+            write_old(path, b"a")
+            blocker = os.path.join(tmp, "file")
+            write_old(blocker, b"")
+            with HashCache(os.path.join(blocker, "hashes.sqlite3")) as cache:
+                # ^ Its parent is a file, so it can't be created.
+                self.assertEqual(cache.get_hexdigest(path),
+                                 hashlib.md5(b"a").hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
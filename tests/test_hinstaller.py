@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from hierosoft.hinstaller import (  # noqa: E402
+    BatchedLog,
+    HInstaller,
+    OP_COPY,
+    OP_MKDIR,
+    OP_RM,
+    OP_RMDIR,
+    OP_RMTREE,
+    OP_UNCHANGED,
+    STAGE_SUFFIX,
+    UNDO_LINK,
+    UNDO_MOVE,
+    UNDO_ZIP,
+    UndoArchive,
+)
+
+
+def write_file(path, content):
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    with open(path, 'w') as outs:
+        outs.write(content)
+
+
+def read_file(path):
+    with open(path, 'r') as ins:
+        return ins.read()
+
+
+def no_callback(evt):
+    pass
+
+
+class TestHInstaller(unittest.TestCase):
+
+    def make_trees(self, tmp):
+        src = os.path.join(tmp, "src")
+        dst = os.path.join(tmp, "dst")
+        write_file(os.path.join(src, "a.txt"), "a new\n")
+        write_file(os.path.join(src, "same.txt"), "same\n")
+        write_file(os.path.join(src, "sub", "b.txt"), "b\n")
+        write_file(os.path.join(src, "sub", "deep", "c.txt"), "c\n")
+        write_file(os.path.join(dst, "a.txt"), "a old\n")
+        write_file(os.path.join(dst, "same.txt"), "same\n")
+        write_file(os.path.join(dst, "sub", "old.txt"), "old\n")
+        write_file(os.path.join(dst, "sub", "olddir", "x.txt"), "x\n")
+        return src, dst
+
+    def make_installer(self, src, dst):
+        installer = HInstaller(src, dst, {
+            'keeps': [],
+            'replaces': ["sub"],
+            'shortcut_exe_relpaths': [],
+            'version_path': None,
+        })
+        return installer
+
+    def run_install(self, installer, simulate, jobs=None):
+        undo = io.StringIO()
+        redo = io.StringIO()
+        results = installer._install(undo=undo, redo=redo, evt={},
+                                     callback=no_callback,
+                                     simulate=simulate, jobs=jobs)
+        return results, redo.getvalue(), undo.getvalue()
+
+    def test_install_manifest(self):
+        for jobs in (None, 3):
+            self.check_install_manifest(jobs)
+
+    def check_install_manifest(self, jobs):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            installer = self.make_installer(src, dst)
+            results, redo, _ = self.run_install(installer, True)
+            self.assertIsNone(results.get('error'))
+            self.assertEqual(read_file(os.path.join(dst, "a.txt")),
+                             "a old\n")  # simulate changes nothing
+            ops = [(op.op, op.rel) for op in installer.manifest]
+            self.assertIn((OP_RM, os.path.join("sub", "old.txt")), ops)
+            self.assertIn((OP_RMTREE, os.path.join("sub", "olddir")), ops)
+            self.assertIn((OP_MKDIR, os.path.join("sub", "deep")), ops)
+            self.assertIn((OP_COPY, "a.txt"), ops)
+            self.assertNotIn((OP_COPY, "same.txt"), ops)
+            self.assertIn((OP_UNCHANGED, "same.txt"), ops)
+            self.assertEqual(results['bytes_unchanged'], len("same\n"))
+            bytes_total = installer.bytes_total
+            self.assertEqual(bytes_total, len("a new\nb\nc\n"))
+
+            def walk(*args, **kwargs):
+                raise AssertionError("The manifest should be used.")
+
+            installer.copytree = walk
+            results, real_redo, _ = self.run_install(installer, False,
+                                                     jobs=jobs)
+            self.assertIsNone(results.get('error'))
+            self.assertEqual(real_redo, redo)
+            self.assertEqual(installer.bytes_done, bytes_total)
+            self.assertEqual(results['bytes_copied'], bytes_total)
+            self.assertEqual(results['unchanged_count'], 1)
+            self.assertEqual(sum(results['copy_strategies'].values()), 3)
+            self.assertIn("  # unchanged\n", real_redo)
+            self.assertEqual(read_file(os.path.join(dst, "a.txt")),
+                             "a new\n")
+            self.assertEqual(
+                read_file(os.path.join(dst, "sub", "deep", "c.txt")),
+                "c\n",
+            )
+            self.assertFalse(
+                os.path.exists(os.path.join(dst, "sub", "old.txt")))
+            self.assertFalse(
+                os.path.exists(os.path.join(dst, "sub", "olddir")))
+
+    def test_unchanged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            write_file(os.path.join(dst, "a.txt"), "a NEW\n")
+            for name in ("same.txt", "a.txt"):
+                # Same size, different mtime:
+                os.utime(os.path.join(dst, name), (1, 1))
+            for verify_hash, expected in ((True, {"same.txt"}),
+                                          (False, set())):
+                installer = self.make_installer(src, dst)
+                installer.meta['verify_hash'] = verify_hash
+                self.run_install(installer, True)
+                self.assertEqual(
+                    {op.rel for op in installer.manifest
+                     if op.op == OP_UNCHANGED},
+                    expected,
+                )
+
+    def test_batched_log(self):
+        stream = io.StringIO()
+        log = BatchedLog(stream, max_lines=3, max_ms=60000)
+        log.write("a\n")
+        log.write("b\n")
+        self.assertEqual(stream.getvalue(), "")
+        log.write("c\n")
+        self.assertEqual(stream.getvalue(), "a\nb\nc\n")
+        log.write("d\n")
+        log.sync()  # StringIO has no fileno, so only flush.
+        self.assertEqual(stream.getvalue(), "a\nb\nc\nd\n")
+
+    def test_ops_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            installer = self.make_installer(src, dst)
+            ops_stream = io.StringIO()
+            installer.ops_log = BatchedLog(ops_stream)
+            _, redo, _ = self.run_install(installer, True)
+            self.assertTrue(redo.endswith("\n"))
+            # ^ The log is complete (flushed) when _install returns.
+            records = [json.loads(line)
+                       for line in ops_stream.getvalue().splitlines()]
+            self.assertEqual(len(records), len(installer.manifest))
+            self.assertIn(
+                {'op': OP_COPY, 'path': os.path.join(dst, "a.txt"),
+                 'size': len("a new\n")},
+                records,
+            )
+
+    def test_undo_archive(self):
+        for method, compression in ((UNDO_ZIP, "store"),
+                                    (UNDO_ZIP, "deflate"),
+                                    (UNDO_LINK, "store"),
+                                    (UNDO_MOVE, "store")):
+            self.check_undo_archive(method, compression)
+
+    def check_undo_archive(self, method, compression):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            installer = self.make_installer(src, dst)
+            path = os.path.join(tmp, "removed")
+            if method == UNDO_ZIP:
+                path += ".zip"
+            self.run_install(installer, True)
+            with UndoArchive(path, method=method, compression=compression,
+                             queue_size=1) as installer.undo_archive:
+                results, _, _ = self.run_install(installer, False)
+            self.assertIsNone(results.get('error'))
+            self.assertFalse(
+                os.path.exists(os.path.join(dst, "sub", "old.txt")))
+            self.assertFalse(
+                os.path.exists(os.path.join(dst, "sub", "olddir")))
+            old_rel = os.path.join("program", "sub", "old.txt")
+            x_rel = os.path.join("program", "sub", "olddir", "x.txt")
+            if method == UNDO_ZIP:
+                with zipfile.ZipFile(path) as archive:
+                    self.assertEqual(
+                        archive.read(old_rel.replace(os.path.sep, "/")),
+                        b"old\n",
+                    )
+                    self.assertEqual(
+                        archive.read(x_rel.replace(os.path.sep, "/")),
+                        b"x\n",
+                    )
+            else:
+                self.assertEqual(read_file(os.path.join(path, old_rel)),
+                                 "old\n")
+                self.assertEqual(read_file(os.path.join(path, x_rel)),
+                                 "x\n")
+
+    def test_type_change(self):
+        self.check_type_change(None, None)
+        self.check_type_change(None, UNDO_ZIP)
+        self.check_type_change(3, None)
+        self.check_type_change(3, UNDO_ZIP)
+
+    def check_type_change(self, jobs, method):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            write_file(os.path.join(src, "sub", "t2d", "in.txt"), "in\n")
+            write_file(os.path.join(dst, "sub", "t2d"), "was a file\n")
+            write_file(os.path.join(src, "sub", "d2f"), "now a file\n")
+            write_file(os.path.join(dst, "sub", "d2f", "x.txt"), "x\n")
+            installer = self.make_installer(src, dst)
+            self.run_install(installer, True)
+            ops = [(op.op, op.rel) for op in installer.manifest]
+            self.assertIn((OP_RM, os.path.join("sub", "t2d")), ops)
+            self.assertIn((OP_RMTREE, os.path.join("sub", "d2f")), ops)
+            if method is None:
+                results, _, _ = self.run_install(installer, False, jobs=jobs)
+            else:
+                path = os.path.join(tmp, "removed.zip")
+                with UndoArchive(path, method=method) \
+                        as installer.undo_archive:
+                    results, _, _ = self.run_install(installer, False,
+                                                     jobs=jobs)
+            self.assertIsNone(results.get('error'))
+            self.assertEqual(
+                read_file(os.path.join(dst, "sub", "t2d", "in.txt")),
+                "in\n",
+            )
+            self.assertEqual(read_file(os.path.join(dst, "sub", "d2f")),
+                             "now a file\n")
+            if method == UNDO_ZIP:
+                with zipfile.ZipFile(path) as archive:
+                    names = archive.namelist()
+                self.assertIn("program/sub/t2d", names)
+                self.assertIn("program/sub/d2f/x.txt", names)
+
+    def test_staged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            installer = self.make_installer(src, dst)
+            installer.meta['staged'] = True
+            self.run_install(installer, True)
+            same_ino = os.stat(os.path.join(dst, "same.txt")).st_ino
+            results, _, _ = self.run_install(installer, False, jobs=2)
+            self.assertIsNone(results.get('error'))
+            self.assertFalse(os.path.exists(dst + STAGE_SUFFIX))
+            self.assertEqual(read_file(os.path.join(dst, "a.txt")),
+                             "a new\n")
+            self.assertFalse(
+                os.path.exists(os.path.join(dst, "sub", "olddir")))
+            old = installer.rollback_root
+            self.assertEqual(read_file(os.path.join(old, "a.txt")),
+                             "a old\n")
+            self.assertEqual(
+                read_file(os.path.join(old, "sub", "olddir", "x.txt")),
+                "x\n",
+            )
+            self.assertEqual(os.stat(os.path.join(dst, "same.txt")).st_ino,
+                             same_ino)  # linked, not copied
+            installer.rollback()
+            self.assertFalse(os.path.exists(old))
+            self.assertEqual(read_file(os.path.join(dst, "a.txt")),
+                             "a old\n")
+
+    def test_staged_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            installer = self.make_installer(src, dst)
+            installer.meta['staged'] = True
+            self.run_install(installer, True)
+
+            def fail(src_path, dst_path):
+                raise OSError("test")
+
+            installer._copy_file = fail
+            with self.assertRaises(OSError):
+                self.run_install(installer, False)
+            self.assertFalse(os.path.exists(dst + STAGE_SUFFIX))
+            self.assertFalse(os.path.exists(installer.rollback_root))
+            self.assertEqual(read_file(os.path.join(dst, "a.txt")),
+                             "a old\n")
+            self.assertTrue(
+                os.path.exists(os.path.join(dst, "sub", "olddir")))
+
+    def test_delete_not_in_src(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = self.make_trees(tmp)
+            for i in range(5):
+                write_file(os.path.join(dst, "sub", "{}.txt".format(i)),
+                           "gone\n")
+            write_file(os.path.join(dst, "sub", "deep", "d", "d.txt"), "d\n")
+            write_file(os.path.join(dst, "sub", "deep", "c.txt", "x.txt"),
+                       "x\n")  # a directory where src has a file
+            installer = self.make_installer(src, dst)
+            self.run_install(installer, True)
+            ops = [(op.op, op.rel) for op in installer.manifest]
+            self.assertIn((OP_RM, os.path.join("sub", "0.txt")), ops)
+            self.assertIn((OP_RMTREE, os.path.join("sub", "deep", "d")), ops)
+            self.assertIn((OP_RMTREE, os.path.join("sub", "deep", "c.txt")),
+                          ops)
+            results, _, _ = self.run_install(installer, False, jobs=3)
+            self.assertIsNone(results.get('error'))
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(dst, "sub"))),
+                ["b.txt", "deep"],
+            )
+            self.assertEqual(
+                read_file(os.path.join(dst, "sub", "deep", "c.txt")),
+                "c\n",
+            )
+
+            installer = self.make_installer(src, dst)
+            installer.simulate = True
+            installer.manifest = []
+            installer.rmdir_lines = []
+            installer.undo = installer.redo = io.StringIO()
+            installer.deletes_total = installer.deletes_done = 0
+            installer.delete_not_in_src(tmp, dst, "sub", delete0=True)
+            self.assertEqual(
+                [(op.op, op.rel) for op in installer.manifest][-1],
+                (OP_RMDIR, "sub"),
+            )  # "sub" isn't in tmp, so it is emptied then removed.
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import os
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from hierosoft.moreplatform import (  # noqa: E402
+    COPY_COPY2,
+    COPY_FILE_RANGE,
+    COPY_REFLINK,
+    COPY_SENDFILE,
+    EXTRACT_SUFFIX,
+    JOURNAL_SUFFIX,
+    extract_tar_streamed,
+    extract_zip_streamed,
+    fast_copy,
+    get_digest,
+    get_hexdigest,
+    get_hexdigests,
+    hash_file,
+    install_archive,
+    same_hash,
+    verify_tar,
+    verify_zip,
+)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestMorePlatform(unittest.TestCase):
+
+    def test_fast_copy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src.bin")
+            dst = os.path.join(tmp, "dst.bin")
+            data = os.urandom(200000)
+            with open(src, 'wb') as outs:
+                outs.write(data)
+            os.chmod(src, 0o750)
+            os.utime(src, (1, 1))
+            with open(dst, 'wb') as outs:
+                outs.write(b"x" * 300000)  # longer, so must be truncated
+            strategy = fast_copy(src, dst)
+            self.assertIn(strategy, (COPY_REFLINK, COPY_FILE_RANGE,
+                                     COPY_SENDFILE, COPY_COPY2))
+            with open(dst, 'rb') as ins:
+                self.assertEqual(ins.read(), data)
+            st = os.stat(dst)
+            self.assertEqual(st.st_mode & 0o777, 0o750)
+            self.assertEqual(int(st.st_mtime), 1)
+
+            empty = os.path.join(tmp, "empty")
+            open(empty, 'wb').close()
+            fast_copy(empty, dst)
+            self.assertEqual(os.path.getsize(dst), 0)
+
+            link = os.path.join(tmp, "link")
+            try:
+                os.symlink("src.bin", link)
+            except (OSError, NotImplementedError):
+                return  # Symlinks may require privileges on Windows.
+            self.assertEqual(fast_copy(link, os.path.join(tmp, "link2")),
+                             COPY_COPY2)
+            self.assertEqual(os.readlink(os.path.join(tmp, "link2")),
+                             "src.bin")
+            fast_copy(link, os.path.join(tmp, "link2"))  # replace it
+            self.assertEqual(os.readlink(os.path.join(tmp, "link2")),
+                             "src.bin")
+
+    def test_hash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            datas = []
+            for i in range(3):
+                path = os.path.join(tmp, "{}.bin".format(i))
+                data = os.urandom(1000 + i)
+                with open(path, 'wb') as outs:
+                    outs.write(data)
+                paths.append(path)
+                datas.append(data)
+            self.assertEqual(get_digest(paths[0]),
+                             hashlib.md5(datas[0]).digest())
+            for algorithm in ("sha256", "blake2b"):
+                self.assertEqual(
+                    get_hexdigest(paths[0], algorithm=algorithm),
+                    hashlib.new(algorithm, datas[0]).hexdigest(),
+                )
+            self.assertEqual(
+                hash_file(paths[1], chunk_size=7).hexdigest(),
+                hashlib.md5(datas[1]).hexdigest(),
+            )
+            hexdigests = get_hexdigests(paths, algorithm="sha256", jobs=2)
+            self.assertEqual(list(hexdigests), paths)
+            self.assertEqual(
+                list(hexdigests.values()),
+                [hashlib.sha256(data).hexdigest() for data in datas],
+            )
+
+    def test_same_hash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path1 = os.path.join(tmp, "1.bin")
+            path2 = os.path.join(tmp, "2.bin")
+            data = os.urandom(1000)
+            for path in (path1, path2):
+                with open(path, 'wb') as outs:
+                    outs.write(data)
+            self.assertTrue(same_hash(path1, path2, chunk_size=64))
+            with open(path2, 'wb') as outs:
+                last = b"y" if data.endswith(b"x") else b"x"
+                outs.write(data[:-1] + last)  # differs in the last chunk
+            self.assertFalse(same_hash(path1, path2, chunk_size=64))
+            with open(path2, 'ab') as outs:
+                outs.write(b"more")
+            self.assertFalse(same_hash(path1, path2))
+
+    def test_install_archive(self):
+        for ext in (".zip", ".tar.xz", ".tar.gz"):
+            for top in ("program-1.0", None):
+                self.check_install_archive(ext, top)
+
+    def check_install_archive(self, ext, top):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "program" + ext)
+            files = {"bin/run.sh": b"#!/bin/sh\n",
+                     "share/data.txt": b"data\n"}
+            prefix = (top + "/") if top else ""
+            if ext == ".zip":
+                with zipfile.ZipFile(archive, 'w') as outs:
+                    for name, data in files.items():
+                        outs.writestr(prefix + name, data)
+            else:
+                mode = "w:" + ext.split(".")[-1]
+                with tarfile.open(archive, mode) as outs:
+                    for name, data in files.items():
+                        path = os.path.join(tmp, "src", prefix + name)
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        with open(path, 'wb') as f:
+                            f.write(data)
+                    outs.add(os.path.join(tmp, "src"), arcname=".")
+            dst = os.path.join(tmp, "programs", "program")
+            events = []
+            installed = install_archive(archive, dst, remove_archive=False,
+                                        status_cb=events.append)
+            self.assertIsNone(installed.get('error'), msg=ext)
+            self.assertEqual(installed.get('extracted_name'), top)
+            for name, data in files.items():
+                with open(os.path.join(dst, name), 'rb') as ins:
+                    self.assertEqual(ins.read(), data)
+            self.assertFalse(os.path.exists(dst + EXTRACT_SUFFIX))
+            self.assertTrue(os.path.isfile(archive))
+            progress = [evt for evt in events if 'ratio' in evt]
+            self.assertEqual(progress[-1]['ratio'], 1.0)
+            self.assertTrue(events[-1].get('done'))
+
+    def test_extract_zip_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "program.zip")
+            with zipfile.ZipFile(archive, 'w',
+                                 compression=zipfile.ZIP_DEFLATED) as outs:
+                for i in range(20):
+                    outs.writestr("lib/{}/{}.txt".format(i % 3, i),
+                                  "{}\n".format(i) * 1000)
+                info = zipfile.ZipInfo("bin/run.sh")
+                info.create_system = 3
+                info.external_attr = (stat.S_IFREG | 0o755) << 16
+                outs.writestr(info, "#!/bin/sh\n")
+                for name, link in (("bin/run", "run.sh"),
+                                   ("bin/escape", "../../outside"),
+                                   ("l1", "."),
+                                   ("l1/l2", "..")):
+                    info = zipfile.ZipInfo(name)
+                    info.create_system = 3
+                    info.external_attr = (stat.S_IFLNK | 0o777) << 16
+                    outs.writestr(info, link)
+                outs.writestr("l2/escaped.txt", "escaped\n")
+                # ^ l2 would be outside if l1/l2 were followed.
+            for jobs in (1, 4):
+                path = os.path.join(tmp, "out{}".format(jobs))
+                with mock.patch("hierosoft.moreplatform.ZIP_JOBS_MIN_BYTES",
+                                0):
+                    extract_zip_streamed(archive, path, jobs=jobs)
+                with open(os.path.join(path, "lib", "1", "19.txt")) as ins:
+                    self.assertEqual(ins.read(), "19\n" * 1000)
+                run_sh = os.path.join(path, "bin", "run.sh")
+                if os.name != "nt":
+                    self.assertEqual(os.stat(run_sh).st_mode & 0o777, 0o755)
+                run = os.path.join(path, "bin", "run")
+                if os.path.islink(run):
+                    self.assertEqual(os.readlink(run), "run.sh")
+                self.assertFalse(
+                    os.path.lexists(os.path.join(path, "bin", "escape")))
+                self.assertFalse(
+                    os.path.lexists(os.path.join(tmp, "escaped.txt")))
+
+    def test_extract_tar_without_filter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "program.tar")
+            with tarfile.open(archive, "w") as outs:
+                for name, link in (("up", "../.."), ("etc", "/etc"),
+                                   ("ok", "a.txt")):
+                    info = tarfile.TarInfo(name)
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = link
+                    outs.addfile(info)
+                for name in ("a.txt", "up/escaped.txt"):
+                    data = b"data\n"
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    outs.addfile(info, io.BytesIO(data))
+            path = os.path.join(tmp, "a", "b")
+            data_filter = getattr(tarfile, 'data_filter', None)
+            if data_filter is not None:
+                del tarfile.data_filter  # Test the fallback.
+            try:
+                extract_tar_streamed(archive, path, mode="r|")
+            finally:
+                if data_filter is not None:
+                    tarfile.data_filter = data_filter
+            self.assertFalse(os.path.islink(os.path.join(path, "up")))
+            self.assertFalse(os.path.lexists(os.path.join(path, "etc")))
+            self.assertFalse(os.path.lexists(os.path.join(tmp,
+                                                          "escaped.txt")))
+            if os.name != "nt":
+                self.assertEqual(os.readlink(os.path.join(path, "ok")),
+                                 "a.txt")
+
+    def test_install_zip_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "bad.zip")
+            with open(archive, 'wb') as outs:
+                outs.write(b"not a zip")
+            installed = install_archive(archive, os.path.join(tmp, "dst"),
+                                        status_cb=lambda evt: None, jobs=4)
+            self.assertIn("BadZipFile", installed['error'])
+            self.assertFalse(os.path.exists(archive))  # deleted as bad
+
+    def make_zip(self, archive, count=10):
+        with zipfile.ZipFile(archive, 'w',
+                             compression=zipfile.ZIP_DEFLATED) as outs:
+            for i in range(count):
+                outs.writestr("program/{}.txt".format(i),
+                              "{}\n".format(i) * 100)
+
+    def test_verify_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "program.zip")
+            self.make_zip(archive)
+            self.assertIsNone(verify_zip(archive))
+            with open(archive, 'rb') as ins:
+                data = bytearray(ins.read())
+            with zipfile.ZipFile(archive) as ins:
+                info = ins.infolist()[0]
+            data[info.header_offset + 30 + len(info.filename) + 1] ^= 0xFF
+            # ^ in the first member's compressed data
+            with open(archive, 'wb') as outs:
+                outs.write(data)
+            self.assertIsNotNone(verify_zip(archive))
+            dst = os.path.join(tmp, "dst")
+            installed = install_archive(
+                archive, dst, status_cb=lambda evt: None,
+                event_template={'verify_archive': True},
+            )
+            self.assertTrue(installed['archive_corrupt'])
+            self.assertTrue(os.path.isfile(archive))  # kept
+            self.assertFalse(os.path.exists(dst))
+            self.assertFalse(os.path.exists(dst + EXTRACT_SUFFIX))
+
+            tar = os.path.join(tmp, "program.tar.gz")
+            with tarfile.open(tar, "w:gz") as outs:
+                outs.add(archive, arcname="program.zip")
+            self.assertIsNone(verify_tar(tar, mode="r|gz"))
+            with open(tar, 'rb') as ins:
+                data = ins.read()
+            with open(tar, 'wb') as outs:
+                outs.write(data[:len(data) // 2])  # truncated download
+            self.assertIsNotNone(verify_tar(tar, mode="r|gz"))
+
+    def test_resume_extract(self):
+        for ext in (".zip", ".tar.gz"):
+            self.check_resume_extract(ext)
+            self.check_resume_extract(ext, remove_extracted=True)
+
+    def check_resume_extract(self, ext, remove_extracted=False):
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "program" + ext)
+            zip_path = os.path.join(tmp, "src.zip")
+            self.make_zip(zip_path)
+            if ext == ".zip":
+                archive = zip_path
+            else:
+                with zipfile.ZipFile(zip_path) as ins:
+                    ins.extractall(os.path.join(tmp, "src"))
+                with tarfile.open(archive, "w:gz") as outs:
+                    outs.add(os.path.join(tmp, "src", "program"),
+                             arcname="program")
+            dst = os.path.join(tmp, "dst")
+            evt = {'resume_extract': True}
+            written = []
+            state = {'interrupt': True}
+
+            def record(name):
+                if state['interrupt'] and name.endswith("5.txt"):
+                    raise Interrupted()
+                written.append(name)
+
+            if ext == ".zip":
+                real_extract = zipfile.ZipFile.extract
+
+                def extract(this, member, *args, **kwargs):
+                    record(member.filename)
+                    return real_extract(this, member, *args, **kwargs)
+
+                patcher = mock.patch.object(zipfile.ZipFile, 'extract',
+                                            extract)
+            elif hasattr(tarfile.TarFile, '_extract_one'):
+                real_extract = tarfile.TarFile._extract_one
+
+                def extract(this, member, *args, **kwargs):
+                    record(member.name)
+                    return real_extract(this, member, *args, **kwargs)
+
+                patcher = mock.patch.object(tarfile.TarFile, '_extract_one',
+                                            extract)
+            else:
+                return  # No per-member hook in this version of tarfile
+            with patcher:
+                with self.assertRaises(Interrupted):
+                    install_archive(archive, dst, remove_archive=False,
+                                    status_cb=lambda evt: None,
+                                    event_template=evt, jobs=1)
+                self.assertTrue(os.path.isfile(
+                    dst + EXTRACT_SUFFIX + JOURNAL_SUFFIX))
+                first = set(name for name in written
+                            if name.endswith(".txt"))
+                self.assertTrue(first)
+                if remove_extracted:
+                    shutil.rmtree(dst + EXTRACT_SUFFIX)
+                    # ^ So the journal is stale and must be restarted.
+                del written[:]
+                state['interrupt'] = False
+                installed = install_archive(
+                    archive, dst, remove_archive=False,
+                    status_cb=lambda evt: None, event_template=evt, jobs=1,
+                )
+            self.assertIsNone(installed.get('error'))
+            second = set(name for name in written if name.endswith(".txt"))
+            if remove_extracted:
+                self.assertEqual(len(second), 10)  # all extracted again
+            else:
+                self.assertFalse(first & second)  # not extracted again
+                self.assertEqual(len(first | second), 10)
+            for i in range(10):
+                with open(os.path.join(dst, "{}.txt".format(i))) as ins:
+                    self.assertEqual(ins.read(), "{}\n".format(i) * 100)
+            self.assertFalse(os.path.exists(dst + EXTRACT_SUFFIX))
+            self.assertFalse(
+                os.path.exists(dst + EXTRACT_SUFFIX + JOURNAL_SUFFIX))
+
+
+if __name__ == "__main__":
+    unittest.main()
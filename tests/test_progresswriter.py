@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from hierosoft.progresswriter import (  # noqa: E402
+    ProgressAggregator,
+)
+
+
+class TestProgressAggregator(unittest.TestCase):
+
+    def test_coalesce(self):
+        clock = [100.0]
+        snapshots = []
+        evt = {'url': "example", 'total_size': 1000}
+        progress = ProgressAggregator(snapshots.append, evt=evt,
+                                      interval=1.0)
+        with mock.patch("hierosoft.progresswriter.default_timer",
+                        lambda: clock[0]):
+            self.assertTrue(progress.update())  # The first is sent.
+            for _ in range(10):
+                clock[0] += .05
+                self.assertFalse(progress.add(10))
+            self.assertEqual(len(snapshots), 1)
+            clock[0] += .6
+            self.assertTrue(progress.add(100))
+            self.assertEqual(len(snapshots), 2)
+            self.assertTrue(progress.finish())
+        self.assertEqual(evt['loaded'], 200)
+        snapshot = snapshots[-1]
+        self.assertIsNot(snapshot, evt)
+        self.assertEqual(snapshot['url'], "example")
+        self.assertEqual(snapshot['ratio'], .2)
+        self.assertAlmostEqual(snapshot['rate'], 200 / 1.1)
+        self.assertAlmostEqual(snapshot['eta'], 800 / (200 / 1.1))
+        self.assertIsNone(snapshots[0]['eta'])
+
+    def test_refresh(self):
+        counters = {'done': 0}
+        snapshots = []
+
+        def refresh(evt):
+            evt['bytes_done'] = counters['done']
+
+        progress = ProgressAggregator(snapshots.append, interval=0,
+                                      done_key='bytes_done',
+                                      total_key='bytes_total',
+                                      refresh=refresh)
+        counters['done'] = 5
+        progress.update()
+        self.assertEqual(snapshots[-1]['bytes_done'], 5)
+        self.assertNotIn('ratio', snapshots[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()